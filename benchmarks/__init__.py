@@ -0,0 +1,26 @@
+# -*- coding: utf-8
+"""
+Benchmarks for django-prompt-responses.
+
+These are not part of the test suite. Run them as modules from the repository root, e.g.
+`python -m benchmarks.instance_serializer`
+"""
+from __future__ import unicode_literals, absolute_import
+
+import os
+
+import django
+
+
+def setup():
+    """Configure Django with the test settings and create an empty test database"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+    django.setup()
+
+    from django.conf import settings
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    # The test settings enable DEBUG, which logs (and slows down) every query
+    settings.DEBUG = False
+    connection.creation.create_test_db(verbosity=0)
@@ -0,0 +1,98 @@
+# -*- coding: utf-8
+"""
+Seeded generator of synthetic data for the Book/Category test models.
+
+The same seed and counts always produce the same data, so benchmark
+results of different releases can be compared.
+"""
+from __future__ import unicode_literals, absolute_import
+
+import random
+
+
+SIZES = {
+    'small': dict(users=20, books=20, categories=10, prompts=4, responses=200, tags_per_response=3),
+    'medium': dict(users=200, books=200, categories=50, prompts=8, responses=5000, tags_per_response=5),
+    'large': dict(users=1000, books=2000, categories=200, prompts=16, responses=50000, tags_per_response=5),
+}
+
+
+def generate(users=20, books=20, categories=10, prompts=4, responses=200, tags_per_response=3, seed=0):
+    """
+    Create users, books, categories, a promptset with likert and tagging prompts (alternating),
+    and `responses` responses per prompt. Responses of tagging prompts get `tags_per_response` tags.
+    Returns a dict with the promptset, the prompts, and a user.
+    """
+    from django.contrib.auth.models import User
+    from prompt_responses.models import Prompt, PromptSet, Response, Tag
+    from tests.models import Book, Category
+
+    rand = random.Random(seed)
+
+    User.objects.bulk_create(
+        [User(username='benchmark-user-%d' % idx) for idx in range(users)]
+    )
+    Book.objects.bulk_create([Book(title='Book %d' % idx) for idx in range(books)])
+    Category.objects.bulk_create(
+        [Category(name='Category %d' % idx) for idx in range(categories)]
+    )
+    # bulk_create does not set primary keys on all backends
+    user_ids = list(User.objects.filter(username__startswith='benchmark-user-').values_list('id', flat=True))
+    book_ids = list(Book.objects.values_list('id', flat=True))
+    category_ids = list(Category.objects.values_list('id', flat=True))
+
+    promptset = PromptSet.objects.create(name='benchmark')
+    prompt_list = []
+    for idx in range(prompts):
+        if idx % 2:
+            prompt = Prompt.create(
+                type=Prompt.TYPES.tagging,
+                text='Please rate the relevancy of the following categories for {object}.',
+                prompt_object_type=Book,
+                response_object_type=Category,
+                scale_min=-1,
+                scale_max=1,
+            )
+        else:
+            prompt = Prompt.create(
+                type=Prompt.TYPES.likert,
+                text='How do you like {object}?',
+                prompt_object_type=Book,
+                scale_max=5,
+            )
+        prompt_list.append(prompt)
+    promptset.prompts.add(*prompt_list)
+
+    book_type = prompt_list[0].prompt_object_type
+    category_type = prompt_list[-1].response_object_type
+    for prompt in prompt_list:
+        tagging = prompt.type == Prompt.TYPES.tagging
+        Response.objects.bulk_create([
+            Response(
+                prompt=prompt,
+                user_id=rand.choice(user_ids),
+                content_type=book_type,
+                object_id=rand.choice(book_ids),
+                rating=None if tagging else rand.randint(prompt.scale_min, prompt.scale_max),
+            ) for _ in range(responses)
+        ])
+        if not tagging:
+            continue
+
+        response_ids = Response.objects.filter(prompt=prompt).order_by('id').values_list('id', flat=True)
+        tags = []
+        for response_id in response_ids:
+            for category_id in rand.sample(category_ids, min(tags_per_response, len(category_ids))):
+                tags.append(Tag(
+                    response_id=response_id,
+                    content_type=category_type,
+                    object_id=category_id,
+                    rating=rand.randint(prompt.scale_min, prompt.scale_max),
+                ))
+        Tag.objects.bulk_create(tags)
+
+    return {
+        'promptset': promptset,
+        'prompts': prompt_list,
+        'user': User.objects.get(pk=user_ids[0]),
+    }
@@ -0,0 +1,54 @@
+# -*- coding: utf-8
+"""
+Compare PromptInstanceSerializer and FastPromptInstanceSerializer.
+
+Usage: python -m benchmarks.instance_serializer [repeat]
+"""
+from __future__ import unicode_literals, absolute_import, print_function
+
+import sys
+import timeit
+
+from . import setup
+
+
+def run(repeat=1000):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    from prompt_responses.models import Prompt, PromptSet
+    from prompt_responses.serializers import PromptInstanceSerializer, FastPromptInstanceSerializer
+    from tests.models import Book, Category
+
+    Book.objects.create(title="Two Scoops of Django")
+    for name in ("crime", "thriller", "travel"):
+        Category.objects.create(name=name)
+    prompt = Prompt.create(
+        type=Prompt.TYPES.tagging,
+        text="Please rate the relevancy of the following categories for {object}.",
+        prompt_object_type=Book,
+        response_object_type=Category
+    )
+    prompt_set = PromptSet.objects.create(name='benchmark')
+    prompt_set.prompts.add(prompt, Prompt.create(text="Next prompt"))
+    instance = prompt.get_instance(promptset=prompt_set)
+    context = {'request': Request(APIRequestFactory().get('/'))}
+
+    results = []
+    for serializer_class in (PromptInstanceSerializer, FastPromptInstanceSerializer):
+        def render():
+            return serializer_class(instance, context=context).data
+        with CaptureQueriesContext(connection) as queries:
+            render()
+        seconds = timeit.timeit(render, number=repeat)
+        results.append((serializer_class.__name__, seconds / repeat * 1e6, len(queries)))
+    return results
+
+
+if __name__ == '__main__':
+    setup()
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    for name, microseconds, queries in run(repeat):
+        print('%-30s %10.1f us/instance %5d queries' % (name, microseconds, queries))
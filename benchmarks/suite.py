@@ -0,0 +1,169 @@
+# -*- coding: utf-8
+"""
+Time the statistics, sampling, and response code and the API endpoints
+on synthetic data of several sizes (see benchmarks.data).
+
+For every benchmark, the report records the number of queries, the wall time
+(best of `repeat` runs), and the peak memory allocated during one run.
+Write the report to a JSON file to compare it between releases.
+
+Usage: python -m benchmarks.suite [--sizes small,medium] [--repeat 5] [--seed 0] [--output report.json]
+"""
+from __future__ import unicode_literals, absolute_import, print_function
+
+import argparse
+import json
+import platform
+import sys
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+from . import setup
+
+
+def measure(func, repeat):
+    "Return a dict with queries, seconds (best of repeat), and peak_memory (bytes) of calling func"
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as queries:
+        if tracemalloc:
+            tracemalloc.start()
+            func()
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            func()
+            peak_memory = None
+    # Count before timing, as requests reset the query log
+    query_count = len(queries)
+    seconds = min(timeit.repeat(func, number=1, repeat=repeat))
+    return {
+        'queries': query_count,
+        'seconds': seconds,
+        'peak_memory': peak_memory,
+    }
+
+
+def get_benchmarks(data):
+    "Return a list of (name, callable) tuples for the generated data"
+    from rest_framework.test import APIClient
+    from tests.models import Book, Category
+
+    promptset = data['promptset']
+    likert, tagging = data['prompts'][0], data['prompts'][1]
+    user = data['user']
+    book = Book.objects.first()
+    categories = list(Category.objects.all()[:3])
+
+    client = APIClient()
+    client.force_authenticate(user=user)
+    staff_client = APIClient()
+    staff_client.force_authenticate(user=type(user)(pk=user.pk, username=user.username, is_staff=True))
+
+    def api_get(url, client=client):
+        def request():
+            response = client.get(url)
+            assert response.status_code == 200, response.status_code
+        return request
+
+    def api_create_response():
+        response = client.post('/api/prompts/%d/create-response/' % tagging.pk, {
+            'object_id': book.pk,
+            'tags': [{'object_id': category.pk, 'rating': 1} for category in categories],
+        }, format='json')
+        assert response.status_code == 201, response.status_code
+
+    return [
+        ('get_prompt_statistics', promptset.get_prompt_statistics),
+        ('get_prompt_statistics(depth=prompt)', lambda: promptset.get_prompt_statistics(depth='prompt')),
+        ('get_mean_tag_rating_matrix', tagging.get_mean_tag_rating_matrix),
+        ('get_instance(likert)', likert.get_instance),
+        ('get_instance(tagging)', tagging.get_instance),
+        ('create_response(likert)', lambda: likert.create_response(user=user, prompt_object=book, rating=1)),
+        ('create_response(tagging)', lambda: tagging.create_response(
+            user=user, prompt_object=book, tags=[(category, 1) for category in categories]
+        )),
+        ('api:prompt-sets-statistics', api_get('/api/prompt-sets/%s/statistics/' % promptset.name)),
+        ('api:prompts-instantiate', api_get('/api/prompts/%d/instantiate/' % tagging.pk)),
+        ('api:prompts-instantiate-from-set', api_get(
+            '/api/prompts/%d/instantiate/%s/' % (tagging.pk, promptset.name)
+        )),
+        ('api:prompts-create-response', api_create_response),
+        ('api:responses-list', api_get('/api/responses/?prompt=%d' % tagging.pk, staff_client)),
+    ]
+
+
+def run(sizes=('small',), repeat=5, seed=0):
+    "Run all benchmarks for each size and return the report as a dict"
+    import django
+    from django.db import connection, transaction
+
+    from .data import SIZES, generate
+
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'seed': seed,
+            'repeat': repeat,
+        },
+        'results': [],
+    }
+    for size in sizes:
+        counts = SIZES[size]
+        # Roll back the generated data so every size starts from an empty database
+        with transaction.atomic():
+            data = generate(seed=seed, **counts)
+            results = {}
+            for name, func in get_benchmarks(data):
+                results[name] = measure(func, repeat)
+            report['results'].append({'size': size, 'counts': counts, 'benchmarks': results})
+            transaction.set_rollback(True)
+    return report
+
+
+def format_report(report):
+    lines = []
+    for result in report['results']:
+        lines.append('%s %s' % (result['size'], json.dumps(result['counts'], sort_keys=True)))
+        for name, values in sorted(result['benchmarks'].items()):
+            memory = values['peak_memory']
+            lines.append('  %-36s %10.2f ms %6d queries %10s KiB' % (
+                name, values['seconds'] * 1000, values['queries'],
+                '-' if memory is None else '%.1f' % (memory / 1024.0)
+            ))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    from .data import SIZES
+
+    parser = argparse.ArgumentParser(description='Benchmark django-prompt-responses on synthetic data.')
+    parser.add_argument('--sizes', default='small', help='comma-separated sizes of %s' % ', '.join(sorted(SIZES)))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='path of the JSON report')
+    args = parser.parse_args(argv)
+
+    sizes = args.sizes.split(',')
+    for size in sizes:
+        if size not in SIZES:
+            parser.error('unknown size: %s' % size)
+
+    setup()
+    report = run(sizes, repeat=args.repeat, seed=args.seed)
+    print(format_report(report))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
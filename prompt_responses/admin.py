@@ -1,6 +1,19 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.conf import settings
+from django.conf.urls import url
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import connections
+from django.http import HttpResponseRedirect
+from django.shortcuts import get_object_or_404
+from django.template.response import TemplateResponse
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from django.utils.translation import ugettext_lazy as _
 
 from . import models
+from .summary import get_summary, refresh_summaries
 
 from functools import partial
 
@@ -34,13 +47,140 @@ class ForeignKeyLinks(object):
         raise AttributeError
 
 
-class PromptSetAdmin(admin.ModelAdmin):
-    list_display = ('name', 'created')
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that avoids COUNT(*) on large, unfiltered tables.
+
+    Uses the table statistics of the database backend (pg_class on PostgreSQL,
+    information_schema on MySQL) or, on other backends, an exact count
+    that is cached for `PROMPT_RESPONSES_ADMIN_COUNT_CACHE_TIMEOUT` seconds.
+    Filtered querysets and tables estimated below
+    `PROMPT_RESPONSES_ADMIN_EXACT_COUNT_THRESHOLD` rows are counted exactly.
+    """
+    cache_key_prefix = 'prompt_responses:admin_count'
+
+    @property
+    def exact_count_threshold(self):
+        return getattr(settings, 'PROMPT_RESPONSES_ADMIN_EXACT_COUNT_THRESHOLD', 10000)
+
+    @property
+    def cache_timeout(self):
+        return getattr(settings, 'PROMPT_RESPONSES_ADMIN_COUNT_CACHE_TIMEOUT', 5 * 60)
+
+    @cached_property
+    def exact_count(self):
+        return super(EstimatedCountPaginator, self).count
+
+    def get_estimate(self, queryset):
+        connection = connections[queryset.db]
+        table = queryset.model._meta.db_table
+        query = None
+        if connection.vendor == 'postgresql':
+            query = 'SELECT reltuples::bigint FROM pg_class WHERE relname = %s'
+        elif connection.vendor == 'mysql':
+            query = ('SELECT table_rows FROM information_schema.tables '
+                     'WHERE table_schema = DATABASE() AND table_name = %s')
+        if query:
+            with connection.cursor() as cursor:
+                cursor.execute(query, [table])
+                row = cursor.fetchone()
+            # Tables that were never analyzed report 0 or -1 rows
+            if row and row[0] is not None and row[0] > 0:
+                return int(row[0])
+
+        key = '%s:%s:%s' % (self.cache_key_prefix, queryset.db, table)
+        estimate = cache.get(key)
+        if estimate is None:
+            estimate = self.exact_count
+            cache.set(key, estimate, self.cache_timeout)
+        return estimate
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query') or queryset.query.where or not queryset.query.can_filter():
+            return self.exact_count
+        estimate = self.get_estimate(queryset)
+        if estimate < self.exact_count_threshold:
+            return self.exact_count
+        return estimate
+
+
+def histogram_rows(histogram):
+    "Convert [(rating, count), ...] into rows of (rating, count, percentage of the largest count)"
+    largest = max([count for rating, count in histogram] or [0])
+    return [(rating, count, 100 * count // largest) for rating, count in histogram]
+
+
+class StatisticsAdminMixin(object):
+    """
+    Adds a statistics page and a refresh action to a ModelAdmin of Prompts or PromptSets.
+    The page displays precomputed summaries (see summary.py),
+    which are recomputed in the background when refreshed.
+    """
+    statistics_template = 'admin/prompt_responses/statistics.html'
+    refresh_in_background = True
+    actions = ['refresh_statistics']
+
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        urls = [
+            url(r'^(.+)/statistics/$', self.admin_site.admin_view(self.statistics_view),
+                name='%s_%s_statistics' % info),
+        ]
+        return urls + super(StatisticsAdminMixin, self).get_urls()
+
+    def statistics_link(self, obj):
+        return format_html('<a href="{}/statistics/">{}</a>', obj.pk, _('Statistics'))
+    statistics_link.short_description = _('statistics')
+
+    def refresh_statistics(self, request, queryset):
+        # Refreshes are expensive, so they require the change permission
+        if not self.has_change_permission(request):
+            raise PermissionDenied
+        refresh_summaries(queryset, background=self.refresh_in_background)
+        self.message_user(request, _('The statistics of %d objects are being refreshed.') % len(queryset))
+    refresh_statistics.short_description = _('Refresh statistics')
+    refresh_statistics.allowed_permissions = ('change',)
+
+    def statistics_view(self, request, object_id):
+        obj = get_object_or_404(self.get_queryset(request), pk=object_id)
+        can_refresh = self.has_change_permission(request, obj)
+        if request.method == 'POST':
+            if not can_refresh:
+                raise PermissionDenied
+            self.refresh_statistics(request, [obj])
+            return HttpResponseRedirect(request.path)
+
+        summary = get_summary(obj)
+        prompts = []
+        if summary and summary['data']:
+            data = summary['data']
+            for prompt_summary in data.get('prompts', [data]):
+                prompt_summary = dict(prompt_summary)
+                prompt_summary['rating_rows'] = histogram_rows(prompt_summary['rating_histogram'])
+                prompt_summary['tag_rating_rows'] = histogram_rows(prompt_summary.get('tag_rating_histogram', []))
+                prompts.append(prompt_summary)
+
+        context = dict(
+            self.admin_site.each_context(request),
+            title=_('Statistics of %s') % obj,
+            opts=self.model._meta,
+            original=obj,
+            summary=summary,
+            prompts=prompts,
+            can_refresh=can_refresh,
+        )
+        return TemplateResponse(request, self.statistics_template, context)
+
+
+class PromptSetAdmin(StatisticsAdminMixin, admin.ModelAdmin):
+    list_display = ('name', 'created', 'statistics_link')
 admin.site.register(models.PromptSet, PromptSetAdmin)
 
 
-class PromptAdmin(admin.ModelAdmin):
-    list_display = ('text', 'type', 'prompt_object_type', 'response_object_type', 'created')
+class PromptAdmin(StatisticsAdminMixin, admin.ModelAdmin):
+    list_display = ('text', 'type', 'prompt_object_type', 'response_object_type', 'created', 'statistics_link')
     list_filter = ('type', 'prompt_object_type', 'response_object_type')
 admin.site.register(models.Prompt, PromptAdmin)
 
@@ -51,17 +191,27 @@ class TagInline(admin.TabularInline):
 
 class ResponseAdmin(ForeignKeyLinks, admin.ModelAdmin):
     list_display = ('created', 'link_to_prompt', 'link_to_user', 'link_to_prompt_object', 'rating', 'text', 'response_objects')
+    list_select_related = ('prompt', 'user')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     raw_id_fields = ('user', )
     inlines = [TagInline]
 
     def get_queryset(self, request):
-        return super(ResponseAdmin,self).get_queryset(request).prefetch_related('tags')
+        # Generic foreign keys are prefetched with one query per content type
+        return super(ResponseAdmin, self).get_queryset(request).prefetch_related(
+            'prompt_object', 'tags__response_object'
+        )
 
     def response_objects(self, instance):
-        if instance.tags.count():
+        tags = instance.tag_list
+        if tags:
             def tag_label(tag):
+                if tag.pk is None:
+                    # Packed tags are shown by object id, see packing.py
+                    return '#%d (%d)' % (tag.object_id, tag.rating)
                 return '%s (%d)' % (model_link(tag.response_object), tag.rating)
-            return ', '.join(map(tag_label, instance.tags.all()))
+            return ', '.join(map(tag_label, tags))
         return None
     response_objects.allow_tags = True
 
@@ -70,5 +220,10 @@ admin.site.register(models.Response, ResponseAdmin)
 
 class TagAdmin(admin.ModelAdmin):
     list_display = ("rating", "response_object")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super(TagAdmin, self).get_queryset(request).prefetch_related('response_object')
 admin.site.register(models.Tag, TagAdmin)
 
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Inter-rater agreement.
+
+Measures how much users agree in their ratings of the same objects, e.g. to check the quality
+of annotations. Each prompt object (of likert prompts) or pair of prompt object and response object
+(of tagging prompts) is a unit, which users rate on the prompt's scale.
+Only the latest rating of each user per unit counts.
+
+The ratings are streamed from the database into NumPy arrays once, and the coefficients are
+computed from the units x ratings matrix of counts with vectorized operations.
+NumPy is an optional dependency:
+
+    pip install numpy
+"""
+from django.core.exceptions import ImproperlyConfigured
+
+# NumPy is imported on first use (see require_numpy()), as models import this module
+np = None
+
+from .packing import packed_tag_rows, unpack_tags
+
+
+METRICS = ('nominal', 'ordinal', 'interval')
+
+
+def require_numpy():
+    "Import NumPy into this module and return it, or raise ImproperlyConfigured if it isn't installed"
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImproperlyConfigured('Agreement statistics require NumPy (pip install numpy).')
+        np = numpy
+    return np
+
+
+def _flatten(rows):
+    for row in rows:
+        for value in row:
+            yield -1 if value is None else value
+
+
+def _packed_rows(responses):
+    rows = packed_tag_rows(responses)
+    for pk, prompt_id, content_type_id, object_id, user_id, response_content_type_id, data in rows:
+        object_ids, ratings = unpack_tags(data)
+        for tag_object_id, rating in zip(object_ids, ratings):
+            yield object_id, tag_object_id, user_id, rating
+
+
+def load_ratings(prompt):
+    """
+    Load the ratings of a prompt into an array with the columns unit (two ids), user, and rating,
+    newest first. Units are prompt objects (with a second id of 0) for likert prompts,
+    and pairs of prompt object and response object for tagging prompts. Missing objects are -1.
+    """
+    # Imported here, as models import this module
+    from .models import Prompt, Tag
+    require_numpy()
+    if prompt.type != Prompt.TYPES.tagging:
+        rows = prompt.responses.filter(rating__isnull=False).order_by('-id').values_list(
+            'object_id', 'user_id', 'rating'
+        ).iterator()
+        rows = ((object_id, 0, user_id, rating) for object_id, user_id, rating in rows)
+    elif prompt.tag_storage == Prompt.TAG_STORAGES.packed:
+        rows = _packed_rows(prompt.responses.all())
+    else:
+        rows = Tag.objects.filter(response__prompt=prompt).order_by('-response_id', '-id').values_list(
+            'response__object_id', 'object_id', 'response__user_id', 'rating'
+        ).iterator()
+    return np.fromiter(_flatten(rows), dtype=np.int64).reshape(-1, 4)
+
+
+def _codes(column):
+    "Factorize a column into codes 0..n-1. Returns (codes, number of distinct values)"
+    values, codes = np.unique(column, return_inverse=True)
+    return codes.reshape(-1), len(values)
+
+
+def get_reliability_counts(data):
+    """
+    Count the ratings of each unit from an array of load_ratings(),
+    keeping only the first (i.e. latest) rating of each user per unit.
+    Returns (counts, values, coder_count): counts has one row per unit and one column per
+    rated value (in the order of the sorted array values).
+    """
+    require_numpy()
+    if not len(data):
+        return np.zeros((0, 0), dtype=np.int64), np.zeros(0, dtype=np.int64), 0
+    first = _codes(data[:, 0])[0]
+    second, second_count = _codes(data[:, 1])
+    units, unit_count = _codes(first * second_count + second)
+    users, user_count = _codes(data[:, 2])
+    keep = np.unique(units * user_count + users, return_index=True)[1]
+    units, ratings = units[keep], data[keep, 3]
+    values, value_codes = np.unique(ratings, return_inverse=True)
+    counts = np.bincount(
+        units * len(values) + value_codes.reshape(-1), minlength=unit_count * len(values)
+    ).reshape(unit_count, len(values))
+    return counts, values, user_count
+
+
+def _squared_distances(values, totals, metric):
+    "The matrix of squared distances between rated values, see Krippendorff's difference functions"
+    if metric == 'nominal':
+        return 1.0 - np.eye(len(values))
+    if metric == 'interval':
+        values = values.astype(float)
+        return (values[:, None] - values[None, :]) ** 2
+    # Ordinal: the number of ratings between two values, counting both halfway
+    cumulative = np.cumsum(totals) - totals / 2.0
+    return (cumulative[:, None] - cumulative[None, :]) ** 2
+
+
+def krippendorff_alpha(counts, values, metric='interval'):
+    """
+    Krippendorff's alpha from a units x values matrix of counts (see get_reliability_counts()).
+    metric is one of METRICS. Units with fewer than two ratings are left out.
+    Returns None if there is no disagreement to be expected (e.g. only one rated value).
+    """
+    require_numpy()
+    if metric not in METRICS:
+        raise ValueError('Unsupported metric: %s' % metric)
+    pairable = counts[counts.sum(axis=1) >= 2].astype(float)
+    if not len(pairable):
+        return None
+    weights = 1.0 / (pairable.sum(axis=1) - 1)
+    # Coincidence matrix of the pairs of values within units
+    coincidences = np.dot((pairable * weights[:, None]).T, pairable) - np.diag(np.dot(weights, pairable))
+    totals = coincidences.sum(axis=0)
+    n = totals.sum()
+    distances = _squared_distances(values, totals, metric)
+    expected = np.dot(np.dot(totals, distances), totals)
+    if not expected:
+        return None
+    return float(1.0 - (n - 1) * (coincidences * distances).sum() / expected)
+
+
+def fleiss_kappa(counts):
+    """
+    Fleiss' kappa from a units x values matrix of counts (see get_reliability_counts()),
+    generalized to units with different numbers of ratings. Units with fewer than two ratings are left out.
+    Returns None if there is no disagreement to be expected.
+    """
+    require_numpy()
+    pairable = counts[counts.sum(axis=1) >= 2].astype(float)
+    if not len(pairable):
+        return None
+    raters = pairable.sum(axis=1)
+    observed = ((pairable ** 2).sum(axis=1) - raters) / (raters * (raters - 1))
+    proportions = pairable.sum(axis=0) / raters.sum()
+    expected = (proportions ** 2).sum()
+    if expected >= 1:
+        return None
+    return float((observed.mean() - expected) / (1 - expected))
+
+
+def get_agreement(prompt, metric='interval'):
+    """
+    Compute the agreement of the users who rated a prompt with one streamed query.
+    Returns {'unit_count': 10, 'coder_count': 3, 'rating_count': 25,
+    'krippendorff_alpha': 0.8, 'fleiss_kappa': 0.7, 'metric': 'interval'},
+    where unit_count and rating_count only include units with at least two ratings.
+    """
+    if metric not in METRICS:
+        raise ValueError('Unsupported metric: %s' % metric)
+    counts, values, coder_count = get_reliability_counts(load_ratings(prompt))
+    pairable = counts[counts.sum(axis=1) >= 2]
+    return {
+        'unit_count': int(len(pairable)),
+        'coder_count': int(coder_count),
+        'rating_count': int(pairable.sum()),
+        'krippendorff_alpha': krippendorff_alpha(counts, values, metric),
+        'fleiss_kappa': fleiss_kappa(counts),
+        'metric': metric,
+    }
@@ -1,7 +1,13 @@
 # -*- coding: utf-8
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class PromptResponsesConfig(AppConfig):
     name = 'prompt_responses'
     verbose_name = "Prompts and Responses"
+
+    def ready(self):
+        if getattr(settings, 'PROMPT_RESPONSES_METRICS', False):
+            from . import metrics
+            metrics.enable()
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+Archival of old responses.
+
+Responses created before a cutoff are written to gzip-compressed JSONL files
+and deleted together with their tags, so the hot tables and indexes stay small.
+Before deletion, their contribution is added to ResponseAggregate and TagAggregate,
+which get_response_count, get_mean_rating, and get_prompt_statistics add to the
+totals of the remaining responses.
+Each user's latest archived responses and tags are kept in ArchivedResponse and ArchivedTag,
+so that newer responses of the same user can replace them.
+
+Run it with the archive_responses management command:
+
+    python manage.py archive_responses --days 365 --output 'archive/responses-%Y-%m.jsonl.gz'
+"""
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
+from collections import OrderedDict
+from functools import reduce
+import gzip
+import json
+import operator
+import os
+
+from .models import Response, Tag, ResponseAggregate, TagAggregate, ArchivedResponse, ArchivedTag
+from .packing import aggregate_packed_tags, packed_tag_rows, unpack_tags
+
+
+RESPONSE_KEYS = ('prompt_id', 'content_type_id', 'object_id')
+TAG_KEYS = ('prompt_id', 'content_type_id', 'object_id', 'response_content_type_id', 'response_object_id')
+# Fields of the latest archived response and tags of each user
+RESPONSE_USER_KEYS = ('prompt_id', 'user_id', 'content_type_id', 'object_id')
+TAG_USER_KEYS = (
+    'prompt_id', 'user_id', 'content_type_id', 'object_id', 'response_content_type_id', 'response_object_id'
+)
+
+
+def serialize_response(response):
+    "A JSON-serializable dict of a response and its tags, one line of the archive"
+    return {
+        'id': response.pk,
+        'created': response.created.isoformat(),
+        'prompt': response.prompt_id,
+        'user': response.user_id,
+        'rating': response.rating,
+        'text': response.text,
+        'content_type': response.content_type_id,
+        'object_id': response.object_id,
+        'tags': [{
+            'id': tag.pk,
+            'rating': tag.rating,
+            'content_type': tag.content_type_id,
+            'object_id': tag.object_id,
+        } for tag in response.tag_list],
+    }
+
+
+def get_response_totals(ids):
+    """
+    Sum up the responses with the given ids per prompt and prompt object.
+    Returns a dict of (prompt_id, content_type_id, object_id) to the values of ResponseAggregate's fields.
+    """
+    totals = {}
+    for row in Response.objects.filter(pk__in=ids).order_by().values('prompt', 'content_type', 'object_id').annotate(
+        response_count=Count('id'), rating_count=Count('rating'),
+        rating_sum=Sum('rating'), rating_sq_sum=Sum(F('rating') * F('rating'))
+    ):
+        totals[(row['prompt'], row['content_type'], row['object_id'])] = {
+            'response_count': row['response_count'],
+            'rating_count': row['rating_count'],
+            'rating_sum': row['rating_sum'] or 0,
+            'rating_sq_sum': row['rating_sq_sum'] or 0,
+        }
+    return totals
+
+
+def get_tag_totals(ids):
+    """
+    Sum up the tags of the responses with the given ids per prompt, prompt object, and response object.
+    Returns a dict of (prompt_id, content_type_id, object_id, response_content_type_id, response_object_id)
+    to the values of TagAggregate's fields.
+    """
+    group_by = ['response__prompt', 'response__content_type', 'response__object_id', 'content_type', 'object_id']
+    totals = {}
+    for row in Tag.objects.filter(response__in=ids).order_by().values(*group_by).annotate(
+        tag_count=Count('id'), rating_sum=Sum('rating'), rating_sq_sum=Sum(F('rating') * F('rating'))
+    ):
+        totals[tuple(row[field] for field in group_by)] = {
+            'tag_count': row['tag_count'], 'rating_sum': row['rating_sum'] or 0,
+            'rating_sq_sum': row['rating_sq_sum'] or 0,
+        }
+    for row in aggregate_packed_tags(
+        packed_tag_rows(Response.objects.filter(pk__in=ids)), group_by, user_unique=False
+    ):
+        values = totals.setdefault(tuple(row[field] for field in group_by), {
+            'tag_count': 0, 'rating_sum': 0, 'rating_sq_sum': 0,
+        })
+        for field in ('tag_count', 'rating_sum', 'rating_sq_sum'):
+            values[field] += row[field]
+    return totals
+
+
+def _object_filter(lookup, object_ids):
+    "A filter for the object ids in object_ids, which may include None"
+    q = Q(**{lookup + '__in': [pk for pk in object_ids if pk is not None]})
+    if None in object_ids:
+        q |= Q(**{lookup + '__isnull': True})
+    return q
+
+
+def _replace_archived(model, keys, rows):
+    """
+    Replace the archived rows of model with the same keys (fields) as the new rows (dicts of field values),
+    which are the latest ones of each user.
+    """
+    if not rows:
+        return
+    existing = model.objects.select_for_update().filter(
+        _object_filter('object_id', set(row['object_id'] for row in rows)),
+        prompt__in=set(row['prompt_id'] for row in rows),
+        user__in=set(row['user_id'] for row in rows),
+    )
+    new_keys = set(tuple(row[key] for key in keys) for row in rows)
+    replaced = [values[0] for values in existing.values_list('pk', *keys) if tuple(values[1:]) in new_keys]
+    model.objects.filter(pk__in=replaced).delete()
+    model.objects.bulk_create([model(**row) for row in rows])
+
+
+def update_archived_responses(ids):
+    """
+    Keep the latest response of each user per prompt and prompt object among the responses
+    with the given ids in ArchivedResponse, replacing the user's earlier archived responses.
+    Responses that are followed by a remaining response of the same user are left out.
+    Only the responses of the users and prompt objects of the batch are grouped.
+    """
+    fields = ('id', 'prompt', 'user', 'content_type', 'object_id', 'rating')
+    responses = list(Response.objects.filter(pk__in=ids).values_list(*fields))
+    if not responses:
+        return
+    candidates = Response.objects.filter(
+        prompt__in=set(row[1] for row in responses), user__in=set(row[2] for row in responses)
+    ).order_by()
+    # Latest response of each user per prompt object (see get_prompt_statistics) and per prompt (see get_mean_rating)
+    unique_ids = dict(
+        (tuple(values[:-1]), values[-1])
+        for values in candidates.filter(_object_filter('object_id', set(row[4] for row in responses))).values_list(
+            'prompt', 'content_type', 'object_id', 'user'
+        ).annotate(max_id=Max('id'))
+    )
+    latest_ids = set(candidates.values('prompt', 'user').annotate(max_id=Max('id')).values_list('max_id', flat=True))
+    rows = [
+        {
+            'prompt_id': prompt_id, 'user_id': user_id, 'content_type_id': content_type_id, 'object_id': object_id,
+            'rating': rating, 'latest': pk in latest_ids,
+        }
+        for pk, prompt_id, user_id, content_type_id, object_id, rating in responses
+        if unique_ids[(prompt_id, content_type_id, object_id, user_id)] == pk
+    ]
+    # The new latest response to a prompt replaces the user's earlier one
+    latest_users = [(row['prompt_id'], row['user_id']) for row in rows if row['latest']]
+    if latest_users:
+        ArchivedResponse.objects.filter(
+            reduce(operator.or_, [Q(prompt=prompt_id, user=user_id) for prompt_id, user_id in latest_users]),
+            latest=True,
+        ).update(latest=False)
+    _replace_archived(ArchivedResponse, RESPONSE_USER_KEYS, rows)
+
+
+def update_archived_tags(ids):
+    """
+    Keep the latest tags of each user per prompt, prompt object, and response object among the tags
+    of the responses with the given ids in ArchivedTag, replacing the user's earlier archived tags.
+    Tags that were tagged again in a remaining response of the same user are left out.
+    Only the tags of the users and prompt objects of the batch are grouped.
+    """
+    fields = ('response__prompt', 'response__user', 'response__content_type', 'response__object_id',
+              'content_type', 'object_id')
+    tags = list(Tag.objects.filter(response__in=ids).values_list(*(fields + ('response', 'rating'))))
+    # The latest response of each user that tagged a response object (see get_prompt_statistics)
+    latest_ids = {}
+    if tags:
+        latest_ids = dict(
+            (tuple(values[:-1]), values[-1])
+            for values in Tag.objects.filter(
+                _object_filter('response__object_id', set(tag[3] for tag in tags)),
+                response__prompt__in=set(tag[0] for tag in tags), response__user__in=set(tag[1] for tag in tags),
+            ).order_by().values_list(*fields).annotate(max_id=Max('response__id'))
+        )
+    # A response can tag a response object more than once, so the tags are summed up per key
+    totals = OrderedDict()
+
+    def add_tag(key, rating):
+        total = totals.setdefault(key, dict(zip(TAG_USER_KEYS, key), tag_count=0, rating_sum=0, rating_sq_sum=0))
+        total['tag_count'] += 1
+        total['rating_sum'] += rating
+        total['rating_sq_sum'] += rating * rating
+
+    for values in tags:
+        key = tuple(values[:-2])
+        if latest_ids[key] == values[-2]:
+            add_tag(key, values[-1])
+    # Packed tags are unique per user, see Prompt.replace_packed_tags()
+    for response_id, prompt_id, content_type_id, object_id, user_id, response_content_type_id, data in packed_tag_rows(
+        Response.objects.filter(pk__in=ids)
+    ):
+        key = (prompt_id, user_id, content_type_id, object_id, response_content_type_id)
+        for response_object_id, rating in zip(*unpack_tags(data)):
+            add_tag(key + (response_object_id,), rating)
+    _replace_archived(ArchivedTag, TAG_USER_KEYS, list(totals.values()))
+
+
+def add_to_aggregates(model, keys, totals):
+    "Add totals (see get_response_totals and get_tag_totals) to the aggregate rows of model"
+    if not totals:
+        return
+    object_ids = set(key[2] for key in totals)
+    existing = model.objects.select_for_update().filter(
+        Q(object_id__in=[pk for pk in object_ids if pk is not None]) | Q(object_id__isnull=True),
+        prompt__in=set(key[0] for key in totals),
+    )
+    aggregates = {tuple(getattr(aggregate, field) for field in keys): aggregate for aggregate in existing}
+
+    new_aggregates = []
+    for key, values in totals.items():
+        aggregate = aggregates.get(key)
+        if aggregate is None:
+            new_aggregates.append(model(**dict(zip(keys, key), **values)))
+            continue
+        for field, value in values.items():
+            setattr(aggregate, field, getattr(aggregate, field) + value)
+        aggregate.save()
+    model.objects.bulk_create(new_aggregates)
+
+
+class ArchiveWriter(object):
+    """
+    Writes responses to gzip-compressed JSONL files.
+    The path is formatted with the creation time of each response (see strftime),
+    so e.g. 'responses-%Y-%m.jsonl.gz' creates one file per month.
+    Responses are written to temporary '.partial' files first, which are appended
+    to the archive files by commit() (once they were deleted from the database) or removed by discard().
+    Existing files are appended to.
+    """
+    partial_suffix = '.partial'
+
+    def __init__(self, path):
+        self.path = path
+        self.files = set()
+        self.pending = {}
+
+    def write(self, response):
+        path = response.created.strftime(self.path)
+        if path not in self.pending:
+            self.pending[path] = gzip.open(path + self.partial_suffix, 'wb')
+        line = json.dumps(serialize_response(response), sort_keys=True)
+        self.pending[path].write(line.encode('utf-8') + b'\n')
+
+    def flush(self):
+        for f in self.pending.values():
+            f.flush()
+
+    def commit(self):
+        "Append the pending responses to the archive files, as concatenated gzip members"
+        for path, f in self.pending.items():
+            f.close()
+            with open(path + self.partial_suffix, 'rb') as partial, open(path, 'ab') as archive:
+                archive.write(partial.read())
+            os.remove(path + self.partial_suffix)
+            self.files.add(path)
+        self.pending = {}
+
+    def discard(self):
+        "Remove the pending responses"
+        for path, f in self.pending.items():
+            f.close()
+            os.remove(path + self.partial_suffix)
+        self.pending = {}
+
+    def close(self):
+        self.discard()
+
+
+def archive_batch(ids, writer=None):
+    """
+    Archive the responses with the given ids in one transaction:
+    add them to the aggregates, delete them with their tags, and write them to writer (if given)
+    once the transaction was committed.
+    Returns the number of archived tags.
+    """
+    try:
+        with transaction.atomic():
+            if writer is not None:
+                for response in Response.objects.filter(pk__in=ids).order_by('id').prefetch_related('tags'):
+                    writer.write(response)
+                writer.flush()
+            add_to_aggregates(ResponseAggregate, RESPONSE_KEYS, get_response_totals(ids))
+            update_archived_responses(ids)
+            tag_totals = get_tag_totals(ids)
+            add_to_aggregates(TagAggregate, TAG_KEYS, tag_totals)
+            update_archived_tags(ids)
+            Response.objects.filter(pk__in=ids).delete()
+    except Exception:
+        if writer is not None:
+            writer.discard()
+        raise
+    if writer is not None:
+        writer.commit()
+    return sum(values['tag_count'] for values in tag_totals.values())
+
+
+def archive_responses(before, output=None, batch_size=1000):
+    """
+    Archive all responses created before the datetime `before`, oldest first, in batches of batch_size.
+    output is the path (pattern) of the archive files, see ArchiveWriter.
+    Without output, the responses are only added to the aggregates and deleted.
+    Returns the numbers of archived responses and tags and the written paths.
+    """
+    writer = ArchiveWriter(output) if output else None
+    result = {'responses': 0, 'tags': 0, 'files': []}
+    try:
+        while True:
+            ids = list(
+                Response.objects.filter(created__lt=before).order_by('id').values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            result['tags'] += archive_batch(ids, writer)
+            result['responses'] += len(ids)
+    finally:
+        if writer is not None:
+            writer.close()
+            result['files'] = sorted(writer.files)
+    return result
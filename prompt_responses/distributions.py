@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Rating distributions.
+
+Histograms are counted in the database, one group per rating (see PromptSet.get_prompt_statistics),
+so the number of queries does not depend on the size of the scale.
+Median, percentiles, and standard deviation are derived from the bucket counts in memory.
+
+Variance and standard error are derived from the count, sum, and sum of squares of the ratings,
+which are summed up in the same queries as the means.
+"""
+from collections import Counter
+import math
+
+from django.conf import settings
+
+
+PERCENTILES = (25, 50, 75)
+
+
+def get_prior_weight():
+    "The number of ratings at the prompt's mean that adjusted ratings start with"
+    return getattr(settings, 'PROMPT_RESPONSES_PRIOR_WEIGHT', 5)
+
+
+def get_variance(count, rating_sum, rating_sq_sum):
+    """
+    Sample variance of ratings from their count, sum, and sum of squares, or None for fewer than two ratings.
+    Ratings are integers, so the numerator is computed exactly.
+    """
+    if count < 2:
+        return None
+    return float(count * rating_sq_sum - rating_sum * rating_sum) / (count * (count - 1))
+
+
+def describe_ratings(count, rating_sum, rating_sq_sum, prior_mean=None, prior_weight=None):
+    """
+    Describe the spread of ratings from their count, sum, and sum of squares.
+    Returns {'variance': 0.5, 'std_error': 0.25, 'adjusted_rating': 1.2}.
+    adjusted_rating is the Bayesian average, which starts with prior_weight (see get_prior_weight())
+    ratings at prior_mean (e.g. the mean of all ratings of the prompt), so that objects with few ratings
+    rank close to the prior mean instead of at the extremes.
+    The values are None if they are undefined for count.
+    """
+    variance = get_variance(count, rating_sum, rating_sq_sum)
+    if prior_weight is None:
+        prior_weight = get_prior_weight()
+    if prior_mean is None:
+        adjusted_rating = float(rating_sum) / count if count else None
+    else:
+        adjusted_rating = (prior_weight * prior_mean + rating_sum) / float(prior_weight + count)
+    return {
+        'variance': variance,
+        'std_error': math.sqrt(variance / count) if variance is not None else None,
+        'adjusted_rating': adjusted_rating,
+    }
+
+
+def merge_histograms(histograms):
+    "Sum up {rating: count} dicts"
+    total = Counter()
+    for histogram in histograms:
+        total.update(histogram)
+    return total
+
+
+def get_percentile(buckets, count, percentile):
+    "Nearest-rank percentile of sorted (rating, count) buckets with `count` ratings in total"
+    rank = max(1, int(math.ceil(percentile / 100.0 * count)))
+    seen = 0
+    for rating, bucket_count in buckets:
+        seen += bucket_count
+        if seen >= rank:
+            return rating
+
+
+def get_median(buckets, count):
+    "Median of sorted (rating, count) buckets, the mean of the two middle ratings for even counts"
+    lower = get_percentile(buckets, count, 50)
+    if count % 2:
+        return float(lower)
+    seen = 0
+    for rating, bucket_count in buckets:
+        seen += bucket_count
+        if seen > count // 2:
+            return (lower + rating) / 2.0
+
+
+def describe_histogram(histogram, scale=(), percentiles=PERCENTILES):
+    """
+    Describe the ratings counted in a {rating: count} dict.
+    The histogram has one bucket for each value of scale (a Scale or the output of Prompt.generate_scale()),
+    in the order of the scale and including empty buckets, followed by ratings that are not part of the scale.
+    Returns {'histogram': [{'value': 1, 'label': '1', 'count': 2}, ...], 'median': 1.0, 'std': 0.5,
+    'percentiles': [{'percentile': 25, 'value': 1}, ...]}; the values are None without ratings.
+    std is the sample standard deviation, which is None for fewer than two ratings.
+    """
+    histogram = dict((rating, count) for rating, count in histogram.items() if rating is not None and count)
+    buckets = [{'value': value, 'label': label, 'count': histogram.get(value, 0)} for value, label in scale]
+    values = set(bucket['value'] for bucket in buckets)
+    buckets += [
+        {'value': rating, 'label': str(rating), 'count': count}
+        for rating, count in sorted(histogram.items()) if rating not in values
+    ]
+
+    count = sum(histogram.values())
+    if not count:
+        return {
+            'histogram': buckets, 'median': None, 'std': None,
+            'percentiles': [{'percentile': percentile, 'value': None} for percentile in percentiles],
+        }
+    ordered = sorted(histogram.items())
+    # The sample standard deviation, like the variance of describe_ratings()
+    variance = get_variance(
+        count, sum(rating * c for rating, c in ordered), sum(rating * rating * c for rating, c in ordered)
+    )
+    return {
+        'histogram': buckets,
+        'median': get_median(ordered, count),
+        'std': math.sqrt(variance) if variance is not None else None,
+        'percentiles': [
+            {'percentile': percentile, 'value': get_percentile(ordered, count, percentile)}
+            for percentile in percentiles
+        ],
+    }
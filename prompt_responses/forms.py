@@ -1,17 +1,95 @@
 from django import forms
-from django.forms.models import inlineformset_factory
+from django.forms.models import inlineformset_factory, BaseInlineFormSet
 from .models import Prompt, Response, Tag
+from .scales import Scale, get_scale_identity
+from .metrics import cache_requests
+from django.conf import settings
+from django.core.cache import cache
 from django.contrib.contenttypes.models import ContentType
-from django.core.exceptions import ImproperlyConfigured
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.utils.encoding import force_text
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from django.utils.translation import ugettext_lazy as _, get_language
+import hashlib
+
+
+def get_scale_fragment_key(prompt, custom_scale=None):
+    """
+    Cache key for the rendered rating scale of a prompt.
+    Depends on the prompt, its last modification, the identity of its custom_scale, and the language.
+    Returns None, i.e. the fragment isn't cached, if the custom_scale has no identity (see get_scale_identity()).
+    """
+    if custom_scale is None:
+        custom_scale = prompt.custom_scale
+    identity = get_scale_identity(custom_scale)
+    if identity is None:
+        return None
+    return 'prompt_responses:scale:%s' % hashlib.md5(repr((
+        prompt.pk, prompt.modified.isoformat() if prompt.modified else None,
+        identity, get_language()
+    )).encode('utf-8')).hexdigest()
+
+
+class ScaleChoiceField(forms.TypedChoiceField):
+    """
+    Choice field for a rating scale.
+    Set `field.scale` to a Scale to use it as choices and to validate values with a set lookup.
+    """
+    _scale = None
+
+    def _get_scale(self):
+        return self._scale
+
+    def _set_scale(self, scale):
+        if scale is not None and not isinstance(scale, Scale):
+            scale = Scale(scale)
+        self._scale = scale
+        self.choices = scale
+
+    scale = property(_get_scale, _set_scale)
+
+    def valid_value(self, value):
+        if self._scale is None:
+            return super(ScaleChoiceField, self).valid_value(value)
+        return force_text(value) in self._scale.text_values
 
 
 class RatingRadioSelect(forms.RadioSelect):
+    """
+    Radio buttons for a rating scale.
+    If fragment_key is set (see get_scale_fragment_key()), the markup is rendered only once,
+    cached, and reused for every form with the same scale. Only the field's name and id are replaced.
+    Widgets with a selected value are always rendered from the templates.
+    """
     template_name = 'prompt_responses/widgets/radio.html'
     option_template_name = 'prompt_responses/widgets/radio_option.html'
+    fragment_key = None
+    name_placeholder = '__prompt_responses_name__'
+    id_placeholder = '__prompt_responses_id__'
+
+    def render(self, name, value, attrs=None, renderer=None):
+        if not self.fragment_key or value not in (None, ''):
+            return super(RatingRadioSelect, self).render(name, value, attrs=attrs, renderer=renderer)
+        attrs = dict(attrs or {})
+        auto_id = attrs.pop('id', None)
+        key = '%s:%s' % (self.fragment_key, hashlib.md5(repr(sorted(attrs.items())).encode('utf-8')).hexdigest())
+        fragment = cache.get(key)
+        cache_requests.inc(cache='rating_fragment', result='miss' if fragment is None else 'hit')
+        if fragment is None:
+            if auto_id:
+                attrs['id'] = self.id_placeholder
+            fragment = super(RatingRadioSelect, self).render(
+                self.name_placeholder, value, attrs=attrs, renderer=renderer
+            )
+            cache.set(key, str(fragment), getattr(settings, 'PROMPT_RESPONSES_FRAGMENT_CACHE_TIMEOUT', 60 * 60))
+        if auto_id:
+            fragment = fragment.replace(self.id_placeholder, escape(auto_id))
+        return mark_safe(fragment.replace(self.name_placeholder, escape(name)))
 
 
 class ResponseForm(forms.ModelForm):
-    rating = forms.TypedChoiceField(choices=[], widget=RatingRadioSelect(attrs={'class':'rating-input'}), coerce=int)
+    rating = ScaleChoiceField(choices=[], widget=RatingRadioSelect(attrs={'class':'rating-input'}), coerce=int)
 
     class Meta:
         model = Response
@@ -38,7 +116,10 @@ class ResponseForm(forms.ModelForm):
         if prompt_instance.prompt.type == Prompt.TYPES.likert:
             del self.fields['text']
             self.fields['rating'].required = True
-            self.fields['rating'].choices = prompt_instance.prompt.generate_scale()
+            self.fields['rating'].scale = prompt_instance.scale
+            self.fields['rating'].widget.fragment_key = get_scale_fragment_key(
+                prompt_instance.prompt, prompt_instance.custom_scale
+            )
         if prompt_instance.prompt.type == Prompt.TYPES.openended:
             del self.fields['rating']
             self.fields['text'].required = True
@@ -53,6 +134,30 @@ class ResponseForm(forms.ModelForm):
             self.initial['object_id'] = prompt_instance.object.pk
 
 
+class ContentTypeField(forms.Field):
+    """
+    Hidden field for a ContentType.
+    Uses Django's content type cache instead of querying the database like a ModelChoiceField.
+    """
+    widget = forms.HiddenInput
+    default_error_messages = {
+        'invalid_choice': _('Select a valid choice. That choice is not one of the available choices.'),
+    }
+
+    def prepare_value(self, value):
+        if isinstance(value, ContentType):
+            return value.pk
+        return value
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            return ContentType.objects.get_for_id(int(value))
+        except (ValueError, TypeError, ContentType.DoesNotExist):
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+
+
 class TagForm(forms.ModelForm):
     @property
     def object(self):
@@ -60,27 +165,92 @@ class TagForm(forms.ModelForm):
         Convert response_object into proper model for use in template.
         Example: `{% for form in formset %}{{form.object}}{% endfor %}`
         """
-        if not self.initial.get('content_type'):
-            return None
-        if not self.initial.get('object_id'):
-            return None
-        return self.initial.get('content_type').get_object_for_this_type(
-            pk=self.initial.get('object_id')
-        )
+        if not hasattr(self, '_object'):
+            if not self.initial.get('content_type'):
+                return None
+            if not self.initial.get('object_id'):
+                return None
+            self._object = self.initial.get('content_type').get_object_for_this_type(
+                pk=self.initial.get('object_id')
+            )
+        return self._object
 
-    rating = forms.TypedChoiceField(choices=[], widget=RatingRadioSelect(attrs={'class':'rating-input'}), coerce=int)
+    rating = ScaleChoiceField(choices=[], widget=RatingRadioSelect(attrs={'class':'rating-input'}), coerce=int)
+    # Not a model form field, so that saving tags doesn't query the content type for each form
+    content_type = ContentTypeField()
 
     class Meta:
         model = Tag
-        fields = ('rating', 'content_type', 'object_id')
+        fields = ('rating', 'object_id')
         widgets = {
-            'content_type': forms.HiddenInput(),
             'object_id': forms.HiddenInput(),
         }
 
-    def __init__(self, prompt_instance=None, *args, **kwargs):
+    def __init__(self, prompt_instance=None, scale=None, *args, **kwargs):
         super(TagForm, self).__init__(*args, **kwargs)
+        self.prompt_instance = prompt_instance
+
+        if scale is None:
+            scale = prompt_instance.scale
+        self.fields['rating'].scale = scale
+        if prompt_instance:
+            self.fields['rating'].widget.fragment_key = get_scale_fragment_key(
+                prompt_instance.prompt, prompt_instance.custom_scale
+            )
+
+    def clean_content_type(self):
+        content_type = self.cleaned_data['content_type']
+        if self.prompt_instance and content_type != self.prompt_instance.prompt.response_object_type:
+            raise ValidationError(self.fields['content_type'].error_messages['invalid_choice'], code='invalid_choice')
+        return content_type
+
+    def clean(self):
+        cleaned_data = super(TagForm, self).clean()
+        self.instance.content_type = cleaned_data.get('content_type')
+        return cleaned_data
+
+
+class BaseResponseTagsFormSet(BaseInlineFormSet):
+    """
+    Formset for the tags of a response.
+    Loads the objects of all forms in bulk (see load_objects()).
+    """
+
+    def load_objects(self, objects=None):
+        """
+        Set the object of each form with one query per content type.
+        Pass a list of already loaded objects (e.g. the prompt instance's response_objects)
+        to avoid any queries for these.
+        """
+        loaded = {}
+        for obj in objects or []:
+            loaded[(ContentType.objects.get_for_model(obj).pk, obj.pk)] = obj
+
+        def get_key(form):
+            content_type = form.initial.get('content_type')
+            object_id = form.initial.get('object_id')
+            if not content_type or not object_id:
+                return None
+            if not isinstance(content_type, ContentType):
+                content_type = ContentType.objects.get_for_id(content_type)
+            return (content_type.pk, int(object_id))
+
+        missing = {}
+        for form in self.forms:
+            key = get_key(form)
+            if key and key not in loaded:
+                missing.setdefault(key[0], set()).add(key[1])
+        for content_type_id, object_ids in missing.items():
+            model = ContentType.objects.get_for_id(content_type_id).model_class()
+            for pk, obj in model._base_manager.in_bulk(list(object_ids)).items():
+                loaded[(content_type_id, pk)] = obj
+
+        for form in self.forms:
+            key = get_key(form)
+            if key in loaded:
+                form._object = loaded[key]
 
-        self.fields['rating'].choices = prompt_instance.prompt.generate_scale()
 
-ResponseTagsForm = inlineformset_factory(Response, Tag, form=TagForm, can_delete=False, extra=0)
+ResponseTagsForm = inlineformset_factory(
+    Response, Tag, form=TagForm, formset=BaseResponseTagsFormSet, can_delete=False, extra=0
+)
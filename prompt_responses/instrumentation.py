@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight instrumentation of the statistics, sampling, and response code.
+
+Instrumented stages send the `stage_finished` signal with the stage name,
+its duration in seconds, and the number of database queries it ran.
+Connect a receiver to collect these numbers, e.g. for logging or metrics:
+
+    from prompt_responses.instrumentation import stage_finished
+
+    def log_stage(sender, stage, duration, queries, **kwargs):
+        logger.info('%s took %.1f ms (%s queries)', stage, duration * 1000, queries)
+
+    stage_finished.connect(log_stage)
+
+Without receivers, stages are not timed at all.
+"""
+from django.db import connections
+from django.dispatch import Signal
+from functools import wraps
+import time
+
+# Sent with the arguments stage (name), duration (seconds), and queries
+# (None if they cannot be counted, i.e. before Django 2.0), plus the stage's data
+stage_finished = Signal()
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+class stage(object):
+    """
+    Context manager that times a block and sends `stage_finished` when it exits.
+
+        with stage('get_instance.object', sender=Prompt):
+            obj = self.get_object()
+
+    Values added to the stage's data dict are sent as additional arguments.
+    Queries are counted on all databases (e.g. also on the analytics database, see routers.py),
+    or only on the database alias using.
+    """
+    def __init__(self, name, sender=None, using=None):
+        self.name = name
+        self.sender = sender
+        self.using = using
+        self.active = False
+        self.data = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        "Execute wrapper counting the queries of this stage"
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.active = stage_finished.has_listeners(self.sender)
+        if not self.active:
+            return self
+        self.queries = None
+        self.wrappers = []
+        databases = [connections[self.using]] if self.using else connections.all()
+        if all(hasattr(connection, 'execute_wrapper') for connection in databases):
+            self.queries = 0
+            for connection in databases:
+                wrapper = connection.execute_wrapper(self)
+                wrapper.__enter__()
+                self.wrappers.append(wrapper)
+        self.start = timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not self.active:
+            return
+        duration = timer() - self.start
+        for wrapper in reversed(self.wrappers):
+            wrapper.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None:
+            stage_finished.send(
+                sender=self.sender, stage=self.name, duration=duration, queries=self.queries, **self.data
+            )
+
+
+def instrumented(name):
+    "Decorator to run a method as a stage, sent by the class of the instance"
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with stage(name, sender=self.__class__):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from prompt_responses.archive import archive_responses
+from prompt_responses.models import Response, Tag
+
+
+class Command(BaseCommand):
+    help = (
+        'Move responses created before a cutoff into compressed JSONL files '
+        'and keep their totals in the aggregate tables.'
+    )
+
+    def add_arguments(self, parser):
+        cutoff = parser.add_mutually_exclusive_group()
+        cutoff.add_argument('--before', help='Archive responses created before this date or datetime (ISO 8601).')
+        cutoff.add_argument('--days', type=int, help='Archive responses older than this number of days.')
+        parser.add_argument(
+            '--output',
+            help='Path of the archive files, formatted with the creation time of each response '
+                 '(e.g. responses-%%Y-%%m.jsonl.gz for one file per month). Existing files are appended to.'
+        )
+        parser.add_argument(
+            '--discard', action='store_true',
+            help='Only keep the aggregates and do not write the responses to files.'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Responses per transaction.')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the responses to archive.')
+
+    def get_cutoff(self, options):
+        if options['days'] is None and not options['before']:
+            raise CommandError('Pass --before or --days to choose the responses to archive.')
+        if options['days'] is not None:
+            return timezone.now() - timedelta(days=options['days'])
+        cutoff = parse_datetime(options['before'])
+        if cutoff is None:
+            date = parse_date(options['before'])
+            if date is None:
+                raise CommandError('Invalid date: %s' % options['before'])
+            cutoff = datetime(date.year, date.month, date.day)
+        if settings.USE_TZ and timezone.is_naive(cutoff):
+            cutoff = timezone.make_aware(cutoff)
+        return cutoff
+
+    def handle(self, *args, **options):
+        cutoff = self.get_cutoff(options)
+        if not options['output'] and not options['discard']:
+            raise CommandError('Pass --output to write the archive files, or --discard to only keep aggregates.')
+
+        if options['dry_run']:
+            responses = Response.objects.filter(created__lt=cutoff)
+            self.stdout.write('Would archive %d responses with %d tags created before %s.' % (
+                responses.count(), Tag.objects.filter(response__in=responses).count(), cutoff.isoformat()
+            ))
+            return
+
+        result = archive_responses(cutoff, output=options['output'], batch_size=options['batch_size'])
+        self.stdout.write('Archived %d responses with %d tags created before %s.' % (
+            result['responses'], result['tags'], cutoff.isoformat()
+        ))
+        for path in result['files']:
+            self.stdout.write('Wrote %s' % path)
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from django.core.management.base import BaseCommand
+
+from prompt_responses.models import Prompt, ResponseAggregate, ResponseRollup
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the hourly and daily rollups of prompts from their stored responses. '
+        'Prompts with archived responses are skipped, as their rollups would lose the archived periods, '
+        'unless --force is passed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--prompt', type=int, action='append', dest='prompts',
+            help='Id of a prompt to rebuild, can be repeated. Defaults to all prompts.'
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Also rebuild prompts with archived responses, dropping the archived responses from their rollups.'
+        )
+
+    def handle(self, *args, **options):
+        prompts = Prompt.objects.order_by('id')
+        if options['prompts']:
+            prompts = prompts.filter(pk__in=options['prompts'])
+        archived = set(ResponseAggregate.objects.values_list('prompt', flat=True).distinct())
+        for prompt in prompts:
+            if prompt.pk in archived and not options['force']:
+                self.stderr.write('Skipped prompt %d, which has archived responses (see --force)' % prompt.pk)
+                continue
+            ResponseRollup.rebuild(prompt, force=True)
+            self.stdout.write('Rebuilt rollups of prompt %d' % prompt.pk)
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+In-process metrics in the Prometheus text format.
+
+Enable collection with the setting PROMPT_RESPONSES_METRICS = True and
+serve them with prompt_responses.views.metrics_view.
+
+Every thread writes to its own shard of a metric, so recording values needs no locks.
+Reading a metric sums up the shards of all threads. When a thread ends, its shard is merged
+into the totals of finished threads, so the number of shards doesn't grow with thread-per-request servers.
+"""
+from collections import defaultdict
+import threading
+import weakref
+
+from .instrumentation import stage_finished
+
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _ThreadMarker(object):
+    "Lives only in a thread's local storage, so a weak reference to it tells when the thread has ended"
+    __slots__ = ('__weakref__',)
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.enabled = False
+        self._local = threading.local()
+        # Reentrant, as the callbacks of weak references may run whenever an object is released
+        self._lock = threading.RLock()
+        # Shards of running threads by id, with the weak references that retire them
+        self._shards = {}
+        self._retired = self.create_shard()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self.create_shard()
+            key = id(shard)
+            marker = self._local.marker = _ThreadMarker()
+            with self._lock:
+                self._shards[key] = (weakref.ref(marker, lambda ref: self._retire(key)), shard)
+            self._local.shard = shard
+            return shard
+
+    def _retire(self, key):
+        "Merge the shard of an ended thread into the totals of ended threads"
+        with self._lock:
+            entry = self._shards.pop(key, None)
+            if entry is not None:
+                self.merge_shard(self._retired, entry[1])
+
+    def _all_shards(self):
+        with self._lock:
+            return [self._retired] + [shard for ref, shard in self._shards.values()]
+
+    def _labelvalues(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('%s expects the labels %s' % (self.name, ', '.join(self.labelnames)))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, labelvalues, extra=()):
+        pairs = list(zip(self.labelnames, labelvalues)) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (name, escape_label_value(value)) for name, value in pairs)
+
+    def create_shard(self):
+        raise NotImplementedError
+
+    def merge_shard(self, target, shard):
+        "Add the values of shard to target"
+        raise NotImplementedError
+
+    def collect(self):
+        "Return a dict of label values to the merged values of all threads"
+        values = self.create_shard()
+        for shard in self._all_shards():
+            self.merge_shard(values, shard)
+        return dict(values)
+
+    def render(self):
+        raise NotImplementedError
+
+    def reset(self):
+        for shard in self._all_shards():
+            shard.clear()
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def create_shard(self):
+        return defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        if not self.enabled:
+            return
+        self._shard()[self._labelvalues(labels)] += amount
+
+    def merge_shard(self, target, shard):
+        for labelvalues, value in list(shard.items()):
+            target[labelvalues] += value
+
+    def get(self, **labels):
+        return self.collect().get(self._labelvalues(labels), 0)
+
+    def render(self):
+        return ['%s%s %s' % (self.name, self._format_labels(labelvalues), format_value(value))
+                for labelvalues, value in sorted(self.collect().items())]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def create_shard(self):
+        # [count per bucket, sum]
+        return defaultdict(lambda: [[0] * len(self.buckets), 0.0])
+
+    def observe(self, value, **labels):
+        if not self.enabled:
+            return
+        entry = self._shard()[self._labelvalues(labels)]
+        for idx, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][idx] += 1
+                break
+        entry[1] += value
+
+    def merge_shard(self, target, shard):
+        for labelvalues, (counts, total) in list(shard.items()):
+            merged = target[labelvalues]
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+
+    def get_count(self, **labels):
+        counts, total = self.collect().get(self._labelvalues(labels), ([], 0))
+        return sum(counts)
+
+    def render(self):
+        lines = []
+        for labelvalues, (counts, total) in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = self._format_labels(labelvalues, [('le', format_value(bound))])
+                lines.append('%s_bucket%s %s' % (self.name, labels, format_value(cumulative)))
+            lines.append('%s_sum%s %s' % (self.name, self._format_labels(labelvalues), format_value(total)))
+            lines.append('%s_count%s %s' % (self.name, self._format_labels(labelvalues), format_value(cumulative)))
+        return lines
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def set_enabled(self, enabled):
+        for metric in self.metrics:
+            metric.enabled = enabled
+
+    def reset(self):
+        for metric in self.metrics:
+            metric.reset()
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+responses_created = registry.register(Counter(
+    'prompt_responses_responses_created_total', 'Responses created per prompt.', ['prompt']
+))
+stage_duration = registry.register(Histogram(
+    'prompt_responses_stage_duration_seconds',
+    'Duration of instrumented stages, e.g. get_instance (instantiate) and get_prompt_statistics.', ['stage']
+))
+cache_requests = registry.register(Counter(
+    'prompt_responses_cache_requests_total', 'Lookups in the scale and rating fragment caches.', ['cache', 'result']
+))
+tag_upserts = registry.register(Counter(
+    'prompt_responses_tag_upserts_total', 'Tags inserted or updated by create_response.', ['operation']
+))
+
+
+def record_stage(sender, stage, duration, queries, **kwargs):
+    stage_duration.observe(duration, stage=stage)
+    if stage == 'create_response.tags':
+        tag_upserts.inc(kwargs.get('inserted', 0), operation='insert')
+        tag_upserts.inc(kwargs.get('updated', 0), operation='update')
+
+
+def record_response(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        responses_created.inc(prompt=instance.prompt_id)
+
+
+def enable():
+    "Start collecting metrics, see the setting PROMPT_RESPONSES_METRICS"
+    from django.db.models.signals import post_save
+    from .models import Response
+
+    registry.set_enabled(True)
+    stage_finished.connect(record_stage, dispatch_uid='prompt_responses.metrics.record_stage')
+    post_save.connect(record_response, sender=Response, dispatch_uid='prompt_responses.metrics.record_response')
+
+
+def disable():
+    from django.db.models.signals import post_save
+    from .models import Response
+
+    registry.set_enabled(False)
+    stage_finished.disconnect(dispatch_uid='prompt_responses.metrics.record_stage')
+    post_save.disconnect(sender=Response, dispatch_uid='prompt_responses.metrics.record_response')
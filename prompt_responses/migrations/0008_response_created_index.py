@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prompt_responses', '0007_auto_20180110_2103'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='response',
+            index_together=set([('created', 'id')]),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import model_utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('prompt_responses', '0008_response_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagAggregate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('response_object_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('tag_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.BigIntegerField(default=0)),
+                ('unique_tag_count', models.PositiveIntegerField(default=0)),
+                ('unique_rating_sum', models.BigIntegerField(default=0)),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('content_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+                ('prompt', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tag_aggregates', to='prompt_responses.Prompt')),
+                ('response_content_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+            ],
+            options={
+                'unique_together': set([('prompt', 'content_type', 'object_id', 'response_content_type', 'response_object_id')]),
+            },
+        ),
+        migrations.CreateModel(
+            name='ResponseAggregate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('response_count', models.PositiveIntegerField(default=0)),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.BigIntegerField(default=0)),
+                ('unique_response_count', models.PositiveIntegerField(default=0)),
+                ('unique_rating_count', models.PositiveIntegerField(default=0)),
+                ('unique_rating_sum', models.BigIntegerField(default=0)),
+                ('latest_response_count', models.PositiveIntegerField(default=0)),
+                ('latest_rating_count', models.PositiveIntegerField(default=0)),
+                ('latest_rating_sum', models.BigIntegerField(default=0)),
+                ('modified', model_utils.fields.AutoLastModifiedField(default=django.utils.timezone.now, editable=False, verbose_name='modified')),
+                ('content_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='contenttypes.ContentType')),
+                ('prompt', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='response_aggregates', to='prompt_responses.Prompt')),
+            ],
+            options={
+                'unique_together': set([('prompt', 'content_type', 'object_id')]),
+            },
+        ),
+    ]
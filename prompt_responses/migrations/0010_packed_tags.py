@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prompt_responses', '0009_response_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prompt',
+            name='tag_storage',
+            field=models.CharField(choices=[('table', 'tag table'), ('packed', 'packed column')], default='table', max_length=20, verbose_name='storage of tags'),
+        ),
+        migrations.AddField(
+            model_name='response',
+            name='packed_tags',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
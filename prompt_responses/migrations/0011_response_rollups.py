@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prompt_responses', '0010_packed_tags'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResponseRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'hour'), ('day', 'day')], max_length=10)),
+                ('bucket', models.DateTimeField(verbose_name='start of the hour or day')),
+                ('response_count', models.PositiveIntegerField(default=0)),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.BigIntegerField(default=0)),
+                ('tag_count', models.PositiveIntegerField(default=0)),
+                ('tag_rating_sum', models.BigIntegerField(default=0)),
+                ('prompt', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='prompt_responses.Prompt')),
+            ],
+            options={
+                'unique_together': set([('prompt', 'granularity', 'bucket')]),
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prompt_responses', '0011_response_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='responseaggregate',
+            name='latest_rating_sq_sum',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='responseaggregate',
+            name='rating_sq_sum',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='responseaggregate',
+            name='unique_rating_sq_sum',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='responserollup',
+            name='rating_sq_sum',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='responserollup',
+            name='tag_rating_sq_sum',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tagaggregate',
+            name='rating_sq_sum',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tagaggregate',
+            name='unique_rating_sq_sum',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('prompt_responses', '0012_rating_squares'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='responseaggregate',
+            name='latest_rating_count',
+        ),
+        migrations.RemoveField(
+            model_name='responseaggregate',
+            name='latest_rating_sq_sum',
+        ),
+        migrations.RemoveField(
+            model_name='responseaggregate',
+            name='latest_rating_sum',
+        ),
+        migrations.RemoveField(
+            model_name='responseaggregate',
+            name='latest_response_count',
+        ),
+        migrations.RemoveField(
+            model_name='responseaggregate',
+            name='unique_rating_count',
+        ),
+        migrations.RemoveField(
+            model_name='responseaggregate',
+            name='unique_rating_sq_sum',
+        ),
+        migrations.RemoveField(
+            model_name='responseaggregate',
+            name='unique_rating_sum',
+        ),
+        migrations.RemoveField(
+            model_name='responseaggregate',
+            name='unique_response_count',
+        ),
+        migrations.RemoveField(
+            model_name='tagaggregate',
+            name='unique_rating_sq_sum',
+        ),
+        migrations.RemoveField(
+            model_name='tagaggregate',
+            name='unique_rating_sum',
+        ),
+        migrations.RemoveField(
+            model_name='tagaggregate',
+            name='unique_tag_count',
+        ),
+        migrations.CreateModel(
+            name='ArchivedTag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('response_id', models.PositiveIntegerField(db_index=True)),
+                ('response_object_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('tag_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.BigIntegerField(default=0)),
+                ('rating_sq_sum', models.BigIntegerField(default=0)),
+                ('replaced', models.BooleanField(default=False)),
+                ('content_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+                ('prompt', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_tags', to='prompt_responses.Prompt')),
+                ('response_content_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': set([('response_id', 'response_content_type', 'response_object_id')]),
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedResponse',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField(blank=True, null=True)),
+                ('rating', models.IntegerField(blank=True, null=True)),
+                ('latest', models.BooleanField(default=False)),
+                ('content_type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='contenttypes.ContentType')),
+                ('prompt', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_responses', to='prompt_responses.Prompt')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': set([('prompt', 'user', 'content_type', 'object_id')]),
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def keep_latest_tags(apps, schema_editor):
+    "Keep only the tags of each user's latest archived response per response object"
+    ArchivedTag = apps.get_model('prompt_responses', 'ArchivedTag')
+    tags = ArchivedTag.objects.using(schema_editor.connection.alias)
+    keys = ('prompt', 'user', 'content_type', 'object_id', 'response_content_type', 'response_object_id')
+    latest = tags.order_by().values(*keys).annotate(max_id=models.Max('response_id'))
+    tags.exclude(pk__in=[
+        pk for row in latest for pk in tags.filter(
+            response_id=row['max_id'], **dict((key, row[key]) for key in keys)
+        ).values_list('pk', flat=True)
+    ]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('prompt_responses', '0013_archived_latest'),
+    ]
+
+    operations = [
+        migrations.RunPython(keep_latest_tags, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='archivedtag',
+            unique_together=set([
+                ('prompt', 'user', 'content_type', 'object_id', 'response_content_type', 'response_object_id'),
+            ]),
+        ),
+        migrations.RemoveField(
+            model_name='archivedtag',
+            name='replaced',
+        ),
+        migrations.RemoveField(
+            model_name='archivedtag',
+            name='response_id',
+        ),
+    ]
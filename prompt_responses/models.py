@@ -1,19 +1,28 @@
 # -*- coding: utf-8 -*-
 
-from django.db import models, transaction
-from django.db.models import Count, Avg, F, Max
+from django.db import models, transaction, IntegrityError
+from django.db.models import Count, Avg, ExpressionWrapper, F, FloatField, Max, Q, Sum, Value
 from model_utils import Choices, FieldTracker
 from model_utils.fields import AutoCreatedField, AutoLastModifiedField
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.html import html_safe
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 import random
-from collections import defaultdict
+from collections import defaultdict, Counter, OrderedDict
 from sortedm2m.fields import SortedManyToManyField
+from .scales import scale_cache
+from .distributions import describe_histogram, describe_ratings, get_prior_weight, get_variance, merge_histograms
+from .packing import pack_tags, unpack_tags, packed_tag_rows, aggregate_packed_tags
+from .agreement import get_agreement
+from .similarity import get_similar_response_objects
+from .instrumentation import stage, instrumented
+from .routers import analytics
 
 class PromptSet(models.Model):
     created = AutoCreatedField(_('created'))
@@ -23,12 +32,55 @@ class PromptSet(models.Model):
 
     @property
     def first_prompt(self):
+        if 'prompts' in getattr(self, '_prefetched_objects_cache', {}):
+            # Read from prefetched (already sorted) prompts to avoid another query
+            prompts = self.prompts.all()
+            return prompts[0] if prompts else None
         return self.prompts.first()
 
     def __str__(self):
         return self.name
 
-    def get_prompt_statistics(self, subset=None, user_id=None, user_unique=True, object_ids=None, response_object_ids=None):
+    @analytics
+    def get_data_version(self):
+        """
+        Get a summary of the responses to this set's prompts that changes
+        whenever responses are created or deleted.
+        Returns a dict with count, max_id, and last_created (time of the latest response).
+        This is cheap compared to the statistics and can be used for conditional requests or as cache key.
+        """
+        return Response.objects.filter(prompt__promptset=self.pk).aggregate(
+            count=Count('id'), max_id=Max('id'), last_created=Max('created')
+        )
+
+    @analytics
+    def get_timeseries(self, start=None, end=None, granularity='day'):
+        """
+        Get the time series of each prompt in this promptset, see Prompt.get_timeseries().
+        Returns [{'prompt_id': 1, 'series': [...]}, ...]
+        """
+        series = OrderedDict((pk, []) for pk in self.prompts.values_list('id', flat=True))
+        for rollup in ResponseRollup.select(start, end, granularity, prompt__in=list(series.keys())):
+            series[rollup.prompt_id].append(rollup.as_dict())
+        return [{'prompt_id': pk, 'series': buckets} for pk, buckets in series.items()]
+
+    @analytics
+    def get_agreement(self, metric='interval'):
+        """
+        Get the inter-rater agreement of each prompt in this promptset, see Prompt.get_agreement().
+        Returns [{'prompt_id': 1, 'krippendorff_alpha': 0.8, ...}, ...]
+        """
+        return [dict(prompt.get_agreement(metric), prompt_id=prompt.pk) for prompt in self.prompts.all()]
+
+    STATISTICS_DEPTHS = ('prompt', 'object', 'response_object')
+    DEFAULT_STATISTICS_FIELDS = ('mean_rating', 'response_count', 'tag_count')
+    SPREAD_STATISTICS_FIELDS = ('variance', 'std_error', 'adjusted_rating')
+    STATISTICS_FIELDS = DEFAULT_STATISTICS_FIELDS + ('distribution',) + SPREAD_STATISTICS_FIELDS
+
+    @analytics
+    @instrumented('get_prompt_statistics')
+    def get_prompt_statistics(self, subset=None, user_id=None, user_unique=True, object_ids=None,
+                              response_object_ids=None, depth='response_object', fields=None):
         """
         Get statistics for each prompt in this promptset.
         If prompts refer to objects, this should be passed
@@ -37,141 +89,399 @@ class PromptSet(models.Model):
         of all objects and response_objects, which may take a long time (esp. for tagging prompts).
         Supports multiple subsets (all users, a specific user (pass user_id), or another strategy (pass subset)).
         Note that this contains some possibly meaningless values, like the mean of all tagging responses.
+
+        depth limits how detailed the statistics are: 'prompt' only returns totals per prompt,
+        'object' adds the list of objects, and 'response_object' (default) adds the response_objects
+        of tagging prompts. Queries for levels below depth are not run.
+        fields chooses the returned values from STATISTICS_FIELDS (by default, DEFAULT_STATISTICS_FIELDS).
+        Response counts are only queried if requested.
+        The distribution field adds the histogram, median, percentiles, and standard deviation
+        of the ratings (see distributions.describe_histogram), shaped to each prompt's scale.
+        The histograms are counted by grouping the same queries by rating and do not include archived responses.
+        The variance, std_error, and adjusted_rating fields describe the spread of the ratings
+        (see distributions.describe_ratings). They are computed from sums of squared ratings in the same queries.
+        Adjusted ratings rank objects and response objects with few ratings closer to the prompt's mean.
+        Totals include archived responses (see archive.py), unless they are restricted to a user_id.
         """
+        if depth not in self.STATISTICS_DEPTHS:
+            raise ValueError('Unsupported depth: %s' % depth)
+        fields = set(self.DEFAULT_STATISTICS_FIELDS if fields is None else fields)
+        with_counts = 'response_count' in fields
+        with_distribution = 'distribution' in fields
+        with_spread = bool(fields.intersection(self.SPREAD_STATISTICS_FIELDS))
+        with_objects = depth != 'prompt'
+        with_response_objects = depth == 'response_object'
+
+        # Response counts are per object, so objects are needed to sum them up even for prompt totals
+        tag_group_by = ['response__prompt']
+        if with_objects or with_counts:
+            tag_group_by += ['response__content_type', 'response__object_id']
+        if with_response_objects:
+            tag_group_by += ['content_type', 'object_id']
+
+        prompts = list(self.prompts.all())
+        packed_prompt_ids = [prompt.pk for prompt in prompts if prompt.tag_storage == Prompt.TAG_STORAGES.packed]
+
+        "Totals of archived responses and tags (see archive.py), which are not available per user"
+        with stage('get_prompt_statistics.archived', sender=self.__class__):
+            archived_tags = []
+            archived_responses = []
+            if not user_id:
+                # Fields of TagAggregate and ArchivedTag for the fields of Tag
+                tag_fields = {
+                    'response__prompt': 'prompt',
+                    'response__content_type': 'content_type', 'response__object_id': 'object_id',
+                    'content_type': 'response_content_type', 'object_id': 'response_object_id',
+                }
+                if user_unique:
+                    # The latest archived tags of each user, see Prompt.replace_archived_tags()
+                    qs = ArchivedTag.objects.filter(prompt__promptset=self.pk)
+                else:
+                    qs = TagAggregate.objects.filter(prompt__promptset=self.pk)
+                if object_ids:
+                    try:
+                        qs = qs.filter(object_id__in=object_ids.split(','))
+                    except ValueError:
+                        pass
+                if response_object_ids:
+                    try:
+                        qs = qs.filter(response_object_id__in=response_object_ids.split(','))
+                    except ValueError:
+                        pass
+                tag_totals = {
+                    'tag_count': Sum('tag_count'), 'rating_sum': Sum('rating_sum'),
+                    'rating_sq_sum': Sum('rating_sq_sum'),
+                }
+                for row in qs.order_by().values(*[tag_fields[field] for field in tag_group_by]).annotate(**tag_totals):
+                    if row['tag_count']:
+                        archived_tags.append(dict(
+                            ((field, row[tag_fields[field]]) for field in tag_group_by),
+                            tag_count=row['tag_count'], rating_sum=row['rating_sum'],
+                            rating_sq_sum=row['rating_sq_sum'],
+                        ))
+
+                if user_unique:
+                    # The latest archived responses of each user that weren't replaced
+                    qs = ArchivedResponse.objects.filter(prompt__promptset=self.pk)
+                    response_totals = {
+                        'response_count': Count('id'), 'rating_count': Count('rating'),
+                        'rating_sum': Sum('rating'), 'rating_sq_sum': Sum(F('rating') * F('rating')),
+                    }
+                else:
+                    qs = ResponseAggregate.objects.filter(prompt__promptset=self.pk)
+                    response_totals = {
+                        'response_count': Sum('response_count'), 'rating_count': Sum('rating_count'),
+                        'rating_sum': Sum('rating_sum'), 'rating_sq_sum': Sum('rating_sq_sum'),
+                    }
+                if object_ids:
+                    try:
+                        qs = qs.filter(object_id__in=object_ids.split(','))
+                    except ValueError:
+                        pass
+                if user_unique:
+                    qs = qs.remaining()
+                group_by = ['prompt', 'prompt__type']
+                if with_objects or with_counts:
+                    group_by += ['content_type', 'object_id']
+                archived_responses = [
+                    dict(row, rating_sum=row['rating_sum'] or 0, rating_sq_sum=row['rating_sq_sum'] or 0)
+                    for row in qs.order_by().values(*group_by).annotate(**response_totals)
+                ]
 
         "Means for all tagging prompts"
         # SELECT AVG(tags__rating) WHERE prompt_id=... GROUP BY prompt_object, response_object
-        qs = Tag.objects.filter(response__prompt__promptset=self.pk)
-        if object_ids:
-            try:
-                qs = qs.filter(response__object_id__in=object_ids.split(','))
-            except ValueError:
-                pass
-        if response_object_ids:
-            try:
-                qs = qs.filter(object_id__in=response_object_ids.split(','))
-            except ValueError:
-                pass
-        if user_id:
-            qs = qs.filter(response__user_id=user_id)
-        if user_unique:
-            # Select most recent response for each user
-            latest_ratings = qs.order_by().values(
-                'response__prompt',
-                'response__content_type', 'response__object_id', 
-                'content_type', 'object_id', 'response__user_id'
-            ).annotate(
-                max_id=Max('response__id')
-            ).values('max_id')
-            qs = qs.filter(response__pk__in=latest_ratings)
+        with stage('get_prompt_statistics.tag_matrix', sender=self.__class__):
+            qs = Tag.objects.filter(response__prompt__promptset=self.pk)
+            if object_ids:
+                try:
+                    qs = qs.filter(response__object_id__in=object_ids.split(','))
+                except ValueError:
+                    pass
+            if response_object_ids:
+                try:
+                    qs = qs.filter(object_id__in=response_object_ids.split(','))
+                except ValueError:
+                    pass
+            if user_id:
+                qs = qs.filter(response__user_id=user_id)
+            if user_unique:
+                # Select most recent response for each user
+                latest_ratings = qs.order_by().values(
+                    'response__prompt',
+                    'response__content_type', 'response__object_id', 
+                    'content_type', 'object_id', 'response__user_id'
+                ).annotate(
+                    max_id=Max('response__id')
+                ).values('max_id')
+                qs = qs.filter(response__pk__in=latest_ratings)
 
-        q = qs.values(
-            'response__prompt',
-            'response__content_type', 'response__object_id', 
-            'content_type', 'object_id'
-        ).annotate(
-            mean_rating=Avg('rating'),
-            tag_count=Count('id'),
-            response_count=Count('response__id', distinct=True)
-        )
-        # Convert rows into matrix
-        tag_matrix = defaultdict(lambda: defaultdict(dict))
-        for row in q.all():
-            d = {'mean': row['mean_rating'], 'count': row['tag_count'], 'response_count': row['response_count']}
-            tag_matrix[row['response__prompt']][row['response__object_id']][row['object_id']] = d
+            # Sums of ratings and their squares give means and variances
+            aggregates = {
+                'tag_count': Count('id'), 'rating_sum': Sum('rating'), 'rating_sq_sum': Sum(F('rating') * F('rating')),
+            }
+            if with_response_objects and with_counts:
+                aggregates['response_count'] = Count('response__id', distinct=True)
+            # With distributions, there is one group per rating, which are summed up below
+            group_by = tag_group_by + ['rating'] if with_distribution else tag_group_by
+            totals = list(qs.values(*group_by).annotate(**aggregates))
+
+            # Add archived tags and packed tags, which are decoded in bulk
+            totals += archived_tags
+            if packed_prompt_ids:
+                responses = Response.objects.filter(prompt__in=packed_prompt_ids)
+                if object_ids:
+                    try:
+                        responses = responses.filter(object_id__in=object_ids.split(','))
+                    except ValueError:
+                        pass
+                if user_id:
+                    responses = responses.filter(user_id=user_id)
+                packed_response_object_ids = None
+                if response_object_ids:
+                    try:
+                        packed_response_object_ids = [int(pk) for pk in response_object_ids.split(',')]
+                    except ValueError:
+                        pass
+                totals += aggregate_packed_tags(
+                    packed_tag_rows(responses), group_by,
+                    user_unique=user_unique, response_object_ids=packed_response_object_ids
+                )
+            rows = OrderedDict()
+            for total in totals:
+                key = tuple(total[field] for field in tag_group_by)
+                if key not in rows:
+                    rows[key] = dict(zip(tag_group_by, key), tag_count=0, rating_sum=0, rating_sq_sum=0)
+                    if 'response_count' in aggregates:
+                        rows[key]['response_count'] = 0
+                    if with_distribution:
+                        rows[key]['histogram'] = Counter()
+                row = rows[key]
+                row['tag_count'] += total['tag_count']
+                row['rating_sum'] += total['rating_sum']
+                row['rating_sq_sum'] += total['rating_sq_sum']
+                row['mean_rating'] = float(row['rating_sum']) / row['tag_count']
+                if 'response_count' in row:
+                    # Each response tags a response object only once
+                    row['response_count'] += total.get('response_count', total['tag_count'])
+                if 'rating' in total:
+                    row['histogram'][total['rating']] += total['tag_count']
+            # Convert rows into matrix
+            tag_matrix = defaultdict(lambda: defaultdict(list))
+            for row in rows.values():
+                tag_matrix[row['response__prompt']][row.get('response__object_id')].append(row)
+
+        "Response counts for tagging prompts"
+        with stage('get_prompt_statistics.tag_response_counts', sender=self.__class__):
+            tag_response_counts = {}
+            if with_counts and tag_matrix:
+                count_query = Response.objects.filter(prompt_id__in=list(tag_matrix.keys()))
+                if object_ids:
+                    try:
+                        count_query = count_query.filter(object_id__in=object_ids.split(','))
+                    except ValueError:
+                        pass
+                if user_id:
+                    count_query = count_query.filter(user__id=user_id)
+                if user_unique:
+                    # Select most recent ratings for each user
+                    latest_ratings = count_query.order_by().values('prompt', 'object_id', 'user_id').annotate(
+                        max_id=Max('id')
+                    ).values('max_id')
+                    count_query = count_query.filter(pk__in=latest_ratings)
+                for row in count_query.values('prompt', 'object_id').annotate(count=Count('id')):
+                    tag_response_counts[(row['prompt'], row['object_id'])] = row['count']
+                for row in archived_responses:
+                    if row['prompt'] in tag_matrix:
+                        key = (row['prompt'], row['object_id'])
+                        tag_response_counts[key] = tag_response_counts.get(key, 0) + row['response_count']
 
         "Means for non-tagging prompts"
-        qs = Response.objects.filter(
-            prompt__promptset=self.pk,
-        ).exclude(
-            rating__isnull=True,
-            prompt__type=Prompt.TYPES.tagging
-        )
-        if object_ids:
-            try:
-                qs = qs.filter(object_id__in=object_ids.split(','))
-            except ValueError:
-                pass
-        if user_id:
-            qs = qs.filter(user__id=user_id)
-        if user_unique:
-            # Select most recent response for each user
-            latest_ratings = qs.order_by().values('prompt', 'content_type', 'object_id', 'user_id').annotate(
-                max_id=Max('id')
-            ).values('max_id')
-            qs = qs.filter(pk__in=latest_ratings)
-        q = qs.values(
-            'prompt', 'content_type', 'object_id'
-        ).annotate(mean_rating=Avg('rating'), response_count=Count('id'))
-         # Convert rows into matrix
-        response_matrix = defaultdict(dict)
-        print(q.query)
-        for row in q.all():
-            d = {'mean': row['mean_rating'], 'count': row['response_count']}
-            response_matrix[row['prompt']][row['object_id']] = d
+        with stage('get_prompt_statistics.response_matrix', sender=self.__class__):
+            qs = Response.objects.filter(
+                prompt__promptset=self.pk,
+            ).exclude(
+                rating__isnull=True,
+                prompt__type=Prompt.TYPES.tagging
+            )
+            if object_ids:
+                try:
+                    qs = qs.filter(object_id__in=object_ids.split(','))
+                except ValueError:
+                    pass
+            if user_id:
+                qs = qs.filter(user__id=user_id)
+            if user_unique:
+                # Select most recent response for each user
+                latest_ratings = qs.order_by().values('prompt', 'content_type', 'object_id', 'user_id').annotate(
+                    max_id=Max('id')
+                ).values('max_id')
+                qs = qs.filter(pk__in=latest_ratings)
+            group_by = ['prompt']
+            if with_objects:
+                group_by += ['content_type', 'object_id']
+            # Convert rows into matrix
+            response_matrix = defaultdict(dict)
+
+            def add_responses(prompt_id, object_id, count, rating_count, rating_sum, rating_sq_sum):
+                d = response_matrix[prompt_id].setdefault(object_id, {
+                    'mean': None, 'count': 0, 'rating_count': 0, 'rating_sum': 0, 'rating_sq_sum': 0,
+                })
+                d['count'] += count
+                d['rating_count'] += rating_count
+                d['rating_sum'] += rating_sum
+                d['rating_sq_sum'] += rating_sq_sum
+                d['mean'] = float(d['rating_sum']) / d['rating_count'] if d['rating_count'] else None
+                if with_distribution:
+                    d.setdefault('histogram', Counter())
+                return d
+
+            # With distributions, there is one group per rating, which are summed up
+            q = qs.values(*(group_by + ['rating'] if with_distribution else group_by)).annotate(
+                response_count=Count('id'), rating_count=Count('rating'),
+                rating_sum=Sum('rating'), rating_sq_sum=Sum(F('rating') * F('rating')),
+            )
+            for row in q.all():
+                d = add_responses(
+                    row['prompt'], row.get('object_id'), row['response_count'], row['rating_count'],
+                    row['rating_sum'] or 0, row['rating_sq_sum'] or 0
+                )
+                if with_distribution and row['rating'] is not None:
+                    d['histogram'][row['rating']] += row['rating_count']
+            for row in archived_responses:
+                # Like above, responses to tagging prompts only count if they have a rating
+                count = row['rating_count'] if row['prompt__type'] == Prompt.TYPES.tagging else row['response_count']
+                if not count:
+                    continue
+                add_responses(
+                    row['prompt'], row['object_id'] if with_objects else None, count,
+                    row['rating_count'], row['rating_sum'], row['rating_sq_sum']
+                )
+
+        def select_fields(d):
+            for field in self.STATISTICS_FIELDS:
+                if field not in fields:
+                    d.pop(field, None)
+            return d
 
         "Convert matrices into lists of ordered prompts"
-        l = []
-        for prompt_id in self.prompts.values_list('id', flat=True):
-            objects = []
-            prompt = {"prompt_id": prompt_id, 'mean_rating': None, 'response_count': 0, 'objects': []}
-            if prompt_id in tag_matrix:   
-                prompt_total = {'mean': 0, 'count': 0, 'tag_count': 0} 
-                for object_id in tag_matrix[prompt_id]:
-                    response_objects = []
-                    object_total = {'mean': 0, 'count': 0, 'tag_count': 0}
-                    for response_object_id in tag_matrix[prompt_id][object_id]:
-                        rating = tag_matrix[prompt_id][object_id][response_object_id]
-                        response_objects.append({
-                            "response_object_id": response_object_id,
-                            "mean_rating": rating['mean'],
-                            "tag_count": rating['count'],
-                            "response_count": rating['response_count']
-                        })
-                        object_total['tag_count'] += rating['count']
-                        object_total['mean'] += rating['mean']*rating['count']
-                    count_query = Response.objects.filter(prompt_id=prompt_id, object_id=object_id)
-                    if user_id:
-                        count_query = qs.filter(user__id=user_id)
-                    if user_unique:
-                        # Select most recent ratings for each user
-                        latest_ratings = count_query.order_by().values('user_id').annotate(
-                            max_id=Max('id')
-                        ).values('max_id')
-                        count_query = count_query.filter(pk__in=latest_ratings)
-                    object_total['count'] = count_query.values('object_id').annotate(count=Count('id')).all()[0]['count']
-                    object_total['mean'] /= object_total['tag_count']
-                    prompt_total['tag_count'] += object_total['tag_count']
-                    prompt_total['count'] += object_total['count']
-                    prompt_total['mean'] += object_total['mean']*object_total['tag_count']
-                    objects.append({
-                        'object_id': object_id,
-                        'response_objects': response_objects,
-                        'mean_rating': object_total['mean'],
-                        'tag_count': object_total['tag_count'],
-                        'response_count': object_total['count']
-                    })
-                prompt_total['mean'] /= prompt_total['tag_count']
-                prompt['tag_count'] = prompt_total['tag_count']
-                prompt['response_count'] = prompt_total['count']
-                prompt['mean_rating'] = prompt_total['mean']
-                prompt["objects"] = objects
-            if prompt_id in response_matrix: 
-                prompt_total = {'mean': 0, 'count': 0} 
-                for object_id in response_matrix[prompt_id]:
-                    rating = response_matrix[prompt_id][object_id]
-                    objects.append({
-                        'object_id': object_id,
-                        'mean_rating': rating['mean'],
-                        "response_count": rating['count']
-                    })
-                    prompt_total['count'] += rating['count']
-                    prompt_total['mean'] += rating['mean']*rating['count']
-                prompt_total['mean'] /= prompt_total['count']
-                prompt['response_count'] = prompt_total['count']
-                prompt['mean_rating'] = prompt_total['mean']
-            prompt['objects'] = objects
-            l.append(prompt)
+        with stage('get_prompt_statistics.assembly', sender=self.__class__):
+            l = []
+            for prompt_obj in prompts:
+                prompt_id = prompt_obj.pk
+                if with_distribution:
+                    scale = prompt_obj.get_scale() if prompt_obj.has_scale() else ()
+                objects = []
+                prompt = {"prompt_id": prompt_id, 'mean_rating': None, 'response_count': 0}
+                if prompt_id in tag_matrix:   
+                    prompt_total = {'mean': 0, 'count': 0, 'tag_count': 0, 'histograms': [], 'sums': [0, 0]}
+                    # Entries with their count, sum, and sum of squares of ratings for describe_ratings
+                    spreads = []
+                    for object_id in tag_matrix[prompt_id]:
+                        response_objects = []
+                        object_total = {'mean': 0, 'count': 0, 'tag_count': 0, 'histograms': [], 'sums': [0, 0]}
+                        for rating in tag_matrix[prompt_id][object_id]:
+                            if with_response_objects:
+                                response_object = {
+                                    "response_object_id": rating['object_id'],
+                                    "mean_rating": rating['mean_rating'],
+                                    "tag_count": rating['tag_count'],
+                                    "response_count": rating.get('response_count')
+                                }
+                                if with_distribution:
+                                    response_object['distribution'] = describe_histogram(rating['histogram'], scale)
+                                spreads.append((
+                                    response_object, rating['tag_count'], rating['rating_sum'],
+                                    rating['rating_sq_sum'],
+                                ))
+                                response_objects.append(select_fields(response_object))
+                            object_total['tag_count'] += rating['tag_count']
+                            object_total['mean'] += rating['mean_rating']*rating['tag_count']
+                            object_total['sums'][0] += rating['rating_sum']
+                            object_total['sums'][1] += rating['rating_sq_sum']
+                            if with_distribution:
+                                object_total['histograms'].append(rating['histogram'])
+                        object_total['count'] = tag_response_counts.get((prompt_id, object_id), 0)
+                        object_total['mean'] /= object_total['tag_count']
+                        prompt_total['tag_count'] += object_total['tag_count']
+                        prompt_total['count'] += object_total['count']
+                        prompt_total['mean'] += object_total['mean']*object_total['tag_count']
+                        prompt_total['sums'][0] += object_total['sums'][0]
+                        prompt_total['sums'][1] += object_total['sums'][1]
+                        histogram = merge_histograms(object_total['histograms'])
+                        prompt_total['histograms'].append(histogram)
+                        if with_objects:
+                            obj = {
+                                'object_id': object_id,
+                                'mean_rating': object_total['mean'],
+                                'tag_count': object_total['tag_count'],
+                                'response_count': object_total['count']
+                            }
+                            if with_distribution:
+                                obj['distribution'] = describe_histogram(histogram, scale)
+                            if with_response_objects:
+                                obj['response_objects'] = response_objects
+                            spreads.append((obj, object_total['tag_count']) + tuple(object_total['sums']))
+                            objects.append(select_fields(obj))
+                    prompt_total['mean'] /= prompt_total['tag_count']
+                    prompt['tag_count'] = prompt_total['tag_count']
+                    prompt['response_count'] = prompt_total['count']
+                    prompt['mean_rating'] = prompt_total['mean']
+                    if with_distribution:
+                        prompt['distribution'] = describe_histogram(
+                            merge_histograms(prompt_total['histograms']), scale
+                        )
+                    if with_spread:
+                        # Adjusted ratings start at the mean tag rating of the prompt
+                        spreads.append((prompt, prompt_total['tag_count']) + tuple(prompt_total['sums']))
+                        for d, count, rating_sum, rating_sq_sum in spreads:
+                            d.update(describe_ratings(count, rating_sum, rating_sq_sum, prompt_total['mean']))
+                            select_fields(d)
+                if prompt_id in response_matrix: 
+                    prompt_total = {'mean': 0, 'count': 0, 'histograms': [], 'rating_count': 0, 'sums': [0, 0]}
+                    spreads = []
+                    for object_id in response_matrix[prompt_id]:
+                        rating = response_matrix[prompt_id][object_id]
+                        if with_objects:
+                            obj = {
+                                'object_id': object_id,
+                                'mean_rating': rating['mean'],
+                                "response_count": rating['count']
+                            }
+                            if with_distribution:
+                                obj['distribution'] = describe_histogram(rating['histogram'], scale)
+                            spreads.append(
+                                (obj, rating['rating_count'], rating['rating_sum'], rating['rating_sq_sum'])
+                            )
+                            objects.append(select_fields(obj))
+                        prompt_total['count'] += rating['count']
+                        prompt_total['mean'] += rating['mean']*rating['count']
+                        prompt_total['rating_count'] += rating['rating_count']
+                        prompt_total['sums'][0] += rating['rating_sum']
+                        prompt_total['sums'][1] += rating['rating_sq_sum']
+                        if with_distribution:
+                            prompt_total['histograms'].append(rating['histogram'])
+                    prompt_total['mean'] /= prompt_total['count']
+                    prompt['response_count'] = prompt_total['count']
+                    prompt['mean_rating'] = prompt_total['mean']
+                    if with_distribution:
+                        prompt['distribution'] = describe_histogram(
+                            merge_histograms(prompt_total['histograms']), scale
+                        )
+                    if with_spread:
+                        # Adjusted ratings start at the mean rating of the prompt
+                        spreads.append((prompt, prompt_total['rating_count']) + tuple(prompt_total['sums']))
+                        prior_mean = float(prompt_total['sums'][0]) / prompt_total['rating_count']
+                        for d, count, rating_sum, rating_sq_sum in spreads:
+                            d.update(describe_ratings(count, rating_sum, rating_sq_sum, prior_mean))
+                            select_fields(d)
+                elif prompt_id not in tag_matrix:
+                    if with_distribution:
+                        prompt['distribution'] = describe_histogram({}, scale)
+                    if with_spread:
+                        prompt.update(describe_ratings(0, 0, 0))
+                if with_objects:
+                    prompt['objects'] = objects
+                l.append(select_fields(prompt))
 
         return l
 
@@ -183,12 +493,21 @@ class Prompt(models.Model):
         ('tagging', _('tagging'))
     )
 
+    # Tags of packed prompts are stored in Response.packed_tags instead of the Tag table, see packing.py
+    TAG_STORAGES = Choices(
+        ('table', _('tag table')),
+        ('packed', _('packed column'))
+    )
+
     type = models.CharField(choices=TYPES, default=TYPES.likert, max_length=20)
     scale_min = models.IntegerField(_('minimum value of likert scale'), default=1, blank=True)
     scale_max = models.IntegerField(_('maximum value of likert scale'), null=True, blank=True)
     text = models.TextField(_('text, format can contain {object}'), default="{object}")
     label = models.CharField(_('short label'), max_length=50, null=True, blank=True)
     name = models.SlugField(null=True, blank=True, unique=True)
+    tag_storage = models.CharField(
+        _('storage of tags'), choices=TAG_STORAGES, default=TAG_STORAGES.table, max_length=20
+    )
 
     prompt_object_type = models.ForeignKey(
         ContentType,
@@ -243,6 +562,25 @@ class Prompt(models.Model):
         high = getattr(self, 'scale_max', 5)
         return [(i, str(i)) for i in range(low, high+1)]
 
+    def get_scale(self, custom_scale=None):
+        """
+        Get the rating scale of this prompt as an immutable, hashable Scale object.
+        Scales are generated once (see generate_scale()) and memoized per prompt, custom_scale,
+        and language until the prompt is modified.
+        Use `rating in prompt.get_scale()` to check if a rating is valid.
+        """
+        def generate():
+            if custom_scale is None:
+                return self.generate_scale()
+            if callable(custom_scale):
+                return custom_scale(self)
+            return custom_scale
+        return scale_cache.get(self, custom_scale, generate)
+
+    def has_scale(self, custom_scale=None):
+        "Whether ratings for this prompt can be validated against a scale"
+        return bool(custom_scale or self.custom_scale or self.scale_max is not None)
+
     def clean_fields(self, exclude=None):
         super(Prompt, self).clean_fields(exclude=exclude)
         # Check consonsitency between fields
@@ -265,13 +603,17 @@ class Prompt(models.Model):
                 msg = _('Only tagging-style prompts can have a prompt_object_type.')
                 raise ValidationError({'response_object_type': msg})
 
-        if self.tracker.has_changed('type'):
-            if self.responses.count() > 0:
+        if not self.type == self.TYPES.tagging and self.tag_storage == self.TAG_STORAGES.packed:
+            msg = _('Only tagging-style prompts can store packed tags.')
+            raise ValidationError({'tag_storage': msg})
+
+        for field in ('type', 'tag_storage'):
+            if self.tracker.has_changed(field) and self.responses.count() > 0:
                 msg = _(
-                    'Changing type for prompts that have responses is dangerous. '
+                    'Changing {field} for prompts that have responses is dangerous. '
                     'Please create a new prompt or delete this prompt\'s responses first.'
-                )
-                raise ValidationError({'type': msg})
+                ).format(field=field.replace('_', ' '))
+                raise ValidationError({field: msg})
 
         try:
             self.formatted_text()
@@ -303,22 +645,33 @@ class Prompt(models.Model):
         `str(instance)` returns the prompt text with the inserted `object`.
         Objects of this class can be directly printed in HTML templates.
         """
-        def __init__(self, prompt, obj, response_objects=None, promptset=None):
+        def __init__(self, prompt, obj, response_objects=None, promptset=None, custom_scale=None):
             self.prompt = prompt
             self.object = obj
             self.response_objects = response_objects
             self.promptset = promptset
+            self.custom_scale = custom_scale
 
         def __str__(self):
             return self.prompt.display_text(self.object)
 
+        @property
+        def scale(self):
+            "The rating scale of this instance, see Prompt.get_scale()"
+            return self.prompt.get_scale(self.custom_scale)
+
         @property
         def prompt_id(self):
             return getattr(self.prompt, 'id', None)
+
+        def create_response(self, user, **kwargs):
+            "Create a response to this instance's object, validated against its scale, see Prompt.create_response()"
+            kwargs.setdefault('prompt_object', self.object)
+            return self.prompt.create_response(user, custom_scale=self.custom_scale, **kwargs)
     
-        @property
+        @cached_property
         def next_prompt(self):
-            "Get the next prompt in order of the promptset"
+            "Get the next prompt in order of the promptset. Only queried once per instance"
             if not self.promptset:
                 return None
 
@@ -333,11 +686,11 @@ class Prompt(models.Model):
                 # Get the prompt with a sort_value > current prompt's sort_value
                 prompt_id = self.promptset.prompts.through.objects.filter(
                     promptset=self.promptset.pk, sort_value__gt=current_sort_value
-                ).values('prompt_id')[0]['prompt_id']
+                ).order_by('sort_value').values('prompt_id')[0]['prompt_id']
             except IndexError:
                 return None
             
-            return Prompt.objects.get(pk=prompt_id)
+            return Prompt.objects.select_related('prompt_object_type', 'response_object_type').get(pk=prompt_id)
     
     def get_queryset(self):
         """Get the queryset to sample a prompt_object from"""
@@ -387,27 +740,29 @@ class Prompt(models.Model):
         sample = random.sample(range(0, count), min(n, count))
         return [queryset.all()[idx] for idx in sample]
 
+    @instrumented('get_instance')
     def get_instance(self, custom_scale=None, promptset=None, **kwargs):
         """
         Creates a single instance of this prompt with populated object.
         kwargs are passed to get_object() and get_response_objects() so
         you can override these with custom algorithms.
-        If you pass a prompt_set, the instance can determine a next_prompt_instance url."""
+        If you pass a prompt_set, the instance can determine a next_prompt_instance url.
+        A custom_scale is kept by the instance (see Instance.scale), the prompt itself is not changed."""
         obj = None
         response_objects = None
-        
-        if custom_scale:
-            self.custom_scale = custom_scale
 
         if self.prompt_object_type:
-            obj = self.get_object(**kwargs)
+            with stage('get_instance.object', sender=self.__class__):
+                obj = self.get_object(**kwargs)
         if self.type == self.TYPES.tagging and self.response_object_type:
-            response_objects = self.get_response_objects(**kwargs)
+            with stage('get_instance.response_objects', sender=self.__class__):
+                response_objects = self.get_response_objects(**kwargs)
 
-        return self.__class__.Instance(self, obj, response_objects, promptset)
+        return self.__class__.Instance(self, obj, response_objects, promptset, custom_scale=custom_scale or None)
 
+    @instrumented('create_response')
     @transaction.atomic
-    def create_response(self, user, tags=None, **kwargs):
+    def create_response(self, user, tags=None, custom_scale=None, **kwargs):
         """
         Create and save a new response for this prompt.
         Pass rating or text, and prompt_object as needed.
@@ -426,66 +781,192 @@ class Prompt(models.Model):
 
         This method verifies that the objects match the models defined in the prompt and
         raises a ValidationException on a mismatch.
+        If the prompt has a scale (see has_scale()), ratings are also checked against it.
+        Pass the custom_scale of the prompt instance (see get_instance()) to check against that one instead,
+        or use Instance.create_response().
         """
         if not 'rating' in kwargs and not 'text' in kwargs and not tags:
             msg = 'A response has to include at least one of rating, text, or tags.'
             raise ValidationError(msg)
 
-        response = Response(**kwargs)
-        response.user = user
-        response.prompt = self
-        response.clean_fields()
-        response.save()
+        with stage('create_response.validation', sender=self.__class__):
+            scale = self.get_scale(custom_scale) if self.has_scale(custom_scale) else None
+            if scale is not None and kwargs.get('rating', None) is not None and kwargs['rating'] not in scale:
+                msg = '%s is not a valid rating for this prompt.'
+                raise ValidationError({'rating': msg % kwargs['rating']})
+
+            response = Response(**kwargs)
+            response.user = user
+            response.prompt = self
+            response.clean_fields()
+            if tags:
+                tag_ratings = self._clean_tags(tags, scale)
+                if self.tag_storage == self.TAG_STORAGES.packed:
+                    response.packed_tags = pack_tags([
+                        (object_id, tag_rating) for object_id, (tag_object, tag_rating) in tag_ratings.items()
+                    ])
+        with stage('create_response.response', sender=self.__class__):
+            response.save()
         if tags:
-            if not self.response_object_type:
-                msg = 'This prompt does not support tagging. Set type to tagging and choose a response_object_type'
-                raise ValidationError({'tag_object': msg})
-
-            if len(tags) and isinstance(tags[0], dict):
-                # Alternative tag dict format, translate
-                tags = map(dict, tags)
-                tags = [(tag['object_id'], tag['rating']) for tag in tags]
-
-            for tag_object, tag_rating in tags:
-                # Resuce tag_object that is only an object_id
-                if isinstance(tag_object, (int, str)):
-                    tag_object = self.response_object_type.get_object_for_this_type(pk=tag_object)
-
-                if ContentType.objects.get_for_model(tag_object) != self.response_object_type:
-                    msg = 'tag_object has a different model class (%s) than defined in the prompt (%s)'
-                    raise ValidationError({'tag_object': msg % (tag_object.__class__.__name__, self.response_object_type.model)})
-                
-                try:
-                    # Try to get existing tag by this user
-                    tag = Tag.objects.get(
-                        response__prompt=self,
-                        response__user=user,
-                        response__object_id=response.prompt_object.id,
-                        response__content_type=ContentType.objects.get_for_model(response.prompt_object),
-                        object_id=tag_object.id,
-                        content_type=ContentType.objects.get_for_model(tag_object),
-                    )
-                    tag.rating = tag_rating
-                    tag.save()
-                    response.tags.add(tag)
-                except Tag.DoesNotExist:
-                    response.tags.create(response_object=tag_object, rating=tag_rating)
+            with stage('create_response.tags', sender=self.__class__) as tags_stage:
+                if self.tag_storage == self.TAG_STORAGES.packed:
+                    tags_stage.data.update(self.replace_packed_tags(response))
+                else:
+                    tags_stage.data.update(self._save_tags(response, user, tag_ratings))
+        with stage('create_response.rollups', sender=self.__class__):
+            ResponseRollup.record(response, [rating for tag_object, rating in tag_ratings.values()] if tags else ())
         return response
 
+    def _clean_tags(self, tags, scale):
+        """
+        Validate the tags of a new response, see create_response().
+        Returns an OrderedDict of response object ids to (response object, rating).
+        """
+        if not self.response_object_type:
+            msg = 'This prompt does not support tagging. Set type to tagging and choose a response_object_type'
+            raise ValidationError({'tag_object': msg})
+
+        if len(tags) and isinstance(tags[0], dict):
+            # Alternative tag dict format, translate
+            tags = map(dict, tags)
+            tags = [(tag['object_id'], tag['rating']) for tag in tags]
+
+        # Load tag objects that were passed as object_id in one query
+        model = self.response_object_type.model_class()
+        object_ids = [tag_object for tag_object, tag_rating in tags if isinstance(tag_object, (int, str))]
+        loaded_objects = {}
+        if object_ids:
+            loaded_objects = {str(pk): obj for pk, obj in model._base_manager.in_bulk(object_ids).items()}
+
+        tag_ratings = OrderedDict()
+        for tag_object, tag_rating in tags:
+            # Resuce tag_object that is only an object_id
+            if isinstance(tag_object, (int, str)):
+                try:
+                    tag_object = loaded_objects[str(tag_object)]
+                except KeyError:
+                    raise model.DoesNotExist('%s matching query does not exist.' % model._meta.object_name)
+
+            if ContentType.objects.get_for_model(tag_object) != self.response_object_type:
+                msg = 'tag_object has a different model class (%s) than defined in the prompt (%s)'
+                raise ValidationError({
+                    'tag_object': msg % (tag_object.__class__.__name__, self.response_object_type.model)
+                })
+            if scale is not None and tag_rating not in scale:
+                msg = '%s is not a valid rating for this prompt.'
+                raise ValidationError({'tags': msg % tag_rating})
+            tag_ratings[tag_object.pk] = (tag_object, tag_rating)
+        return tag_ratings
+
+    def _save_tags(self, response, user, tag_ratings):
+        """
+        Save the validated tags of a new response in the Tag table, see create_response().
+        Returns the numbers of inserted and updated tags.
+        """
+        # Get existing tags by this user
+        existing_tags = defaultdict(list)
+        for object_id, tag_id in Tag.objects.filter(
+            response__prompt=self,
+            response__user=user,
+            response__object_id=response.object_id,
+            response__content_type=response.content_type_id,
+            object_id__in=list(tag_ratings.keys()),
+            content_type=self.response_object_type,
+        ).values_list('object_id', 'id'):
+            existing_tags[object_id].append(tag_id)
+        # Only new tags can replace archived tags, as archived tags were replaced when the existing ones were saved
+        new_object_ids = [object_id for object_id in tag_ratings if object_id not in existing_tags]
+        if new_object_ids:
+            self.replace_archived_tags(response, new_object_ids)
+
+        # Update existing tags (one query per rating value) and insert new tags in bulk
+        updated_tags = defaultdict(list)
+        new_tags = []
+        for object_id, (tag_object, tag_rating) in tag_ratings.items():
+            if object_id in existing_tags:
+                updated_tags[tag_rating] += existing_tags[object_id]
+            else:
+                new_tags.append(Tag(response=response, response_object=tag_object, rating=tag_rating))
+        for tag_rating, tag_ids in updated_tags.items():
+            Tag.objects.filter(pk__in=tag_ids).update(rating=tag_rating, response=response)
+        Tag.objects.bulk_create(new_tags)
+        return {
+            'inserted': len(new_tags),
+            'updated': sum(len(tag_ids) for tag_ids in updated_tags.values()),
+        }
+
+    def replace_archived_tags(self, response, object_ids, aggregates=True):
+        """
+        Remove the user's archived tags of the response objects tagged by a new response
+        from ArchivedTag, so that only the new tags count when only each user's latest tags count.
+        With aggregates, they are subtracted from TagAggregate as well, like earlier tags are moved
+        to the new response in the Tag table and removed from packed tags (see archive.py).
+        """
+        archived = ArchivedTag.objects.filter(
+            prompt=self, user=response.user_id, content_type=response.content_type_id, object_id=response.object_id,
+            response_object_id__in=object_ids,
+        )
+        if not aggregates:
+            archived.delete()
+            return
+        totals = list(archived.values_list(
+            'pk', 'response_content_type', 'response_object_id', 'tag_count', 'rating_sum', 'rating_sq_sum'
+        ))
+        if not totals:
+            return
+        for pk, response_content_type_id, response_object_id, tag_count, rating_sum, rating_sq_sum in totals:
+            TagAggregate.objects.filter(
+                prompt=self, content_type=response.content_type_id, object_id=response.object_id,
+                response_content_type=response_content_type_id, response_object_id=response_object_id,
+            ).update(
+                tag_count=F('tag_count') - tag_count,
+                rating_sum=F('rating_sum') - rating_sum,
+                rating_sq_sum=F('rating_sq_sum') - rating_sq_sum,
+            )
+        ArchivedTag.objects.filter(pk__in=[row[0] for row in totals]).delete()
+
+    def replace_packed_tags(self, response):
+        """
+        Remove the response objects tagged by a new response from the packed tags of the user's
+        earlier responses to the same object, so that tags are unique like in the Tag table.
+        The user's archived tags of these response objects are replaced as well (see ArchivedTag).
+        Returns the numbers of inserted and updated (i.e. replaced) tags.
+        """
+        object_ids, ratings = unpack_tags(response.packed_tags)
+        tagged = set(object_ids)
+        self.replace_archived_tags(response, tagged)
+        updated = 0
+        earlier = self.responses.filter(
+            user=response.user_id, content_type=response.content_type_id, object_id=response.object_id,
+            pk__lt=response.pk,
+        ).exclude(packed_tags=None)
+        for pk, data in earlier.values_list('pk', 'packed_tags'):
+            earlier_tags = list(zip(*unpack_tags(data)))
+            remaining = [tag for tag in earlier_tags if tag[0] not in tagged]
+            if len(remaining) < len(earlier_tags):
+                Response.objects.filter(pk=pk).update(packed_tags=pack_tags(remaining))
+                updated += len(earlier_tags) - len(remaining)
+        return {'inserted': len(object_ids) - updated, 'updated': updated}
+
+    @analytics
     def get_response_count(self, user_unique=True):
         """
-        Get the count of all responses to this prompt.
+        Get the count of all responses to this prompt. Includes archived responses (see archive.py).
         : user_unique (default True) only count each user's latest response
         """
         q = self.responses
         if user_unique:
             # Group by user
             q = q.values('user').annotate(count=Count('user')).order_by('user')
-        return q.count()
+            # Archived responses of users without remaining responses
+            return q.count() + self.archived_responses.remaining(latest=True).count()
+        archived = self.response_aggregates.aggregate(count=Sum('response_count'))
+        return q.count() + (archived['count'] or 0)
 
+    @analytics
     def get_mean_rating(self, user_unique=True):
         """
-        Get the mean rating of all responses to this prompt.
+        Get the mean rating of all responses to this prompt. Includes archived responses (see archive.py).
         : user_unique (default True) only count each user's latest response
         """
         q = self.responses
@@ -495,9 +976,74 @@ class Prompt(models.Model):
                 max_id=Max('id')
             ).values('max_id')
             q = q.filter(pk__in=latest_ratings)
-        r = q.aggregate(average_rating=Avg('rating'))
-        return r['average_rating']
+        r = q.aggregate(rating_sum=Sum('rating'), rating_count=Count('rating'))
+        # Add archived responses, see archive.py
+        if user_unique:
+            archived = self.archived_responses.remaining(latest=True).aggregate(
+                rating_sum=Sum('rating'), rating_count=Count('rating')
+            )
+        else:
+            archived = self.response_aggregates.aggregate(
+                rating_sum=Sum('rating_sum'), rating_count=Sum('rating_count')
+            )
+        count = r['rating_count'] + (archived['rating_count'] or 0)
+        if not count:
+            return None
+        return float((r['rating_sum'] or 0) + (archived['rating_sum'] or 0)) / count
+
+    def _aggregate_packed_tags(self, group_by, response_object_ids=None, **filters):
+        "Average the packed tags of all responses to this prompt, see packing.aggregate_packed_tags()"
+        rows = aggregate_packed_tags(
+            packed_tag_rows(self.responses.filter(**filters)), group_by,
+            user_unique=False, response_object_ids=response_object_ids
+        )
+        for row in rows:
+            row['average_rating'] = float(row['rating_sum']) / row['tag_count']
+        return rows
+
+    @analytics
+    def get_agreement(self, metric='interval'):
+        """
+        Get the inter-rater agreement of the users who responded to this prompt:
+        Krippendorff's alpha (with the difference function metric, one of agreement.METRICS) and Fleiss' kappa.
+        Units are the prompt objects, or pairs of prompt object and response object for tagging prompts.
+        Only each user's latest rating of a unit counts. Requires NumPy, see agreement.py.
+        Returns {'unit_count': 10, 'coder_count': 3, 'rating_count': 25,
+        'krippendorff_alpha': 0.8, 'fleiss_kappa': 0.7, 'metric': 'interval'}
+        """
+        return get_agreement(self, metric)
 
+    @analytics
+    def get_similar_response_objects(self, k=10, metric='cosine', min_common=1, chunk_size=None,
+                                     response_object_ids=None):
+        """
+        Get the k most similar response objects of each response object of this tagging prompt, by their
+        mean tag ratings of the same prompt objects (metric is one of similarity.METRICS).
+        Response objects that share fewer than min_common prompt objects are left out.
+        response_object_ids optionally restricts the response objects to get neighbors for.
+        Similarities are computed for chunk_size response objects at a time. Requires NumPy, see similarity.py.
+        Returns [{'response_object_id': 1,
+                  'neighbors': [{'response_object_id': 2, 'similarity': 0.9, 'common_count': 3}, ...]}, ...]
+        """
+        if self.type != self.TYPES.tagging:
+            raise ValueError('Only tagging prompts have similar response objects')
+        if k < 1:
+            raise ValueError('k must be at least 1')
+        return get_similar_response_objects(
+            self, k=k, metric=metric, min_common=min_common, chunk_size=chunk_size, object_ids=response_object_ids
+        )
+
+    @analytics
+    def get_timeseries(self, start=None, end=None, granularity='day'):
+        """
+        Get the response count and mean ratings of this prompt per hour or day (see ResponseRollup),
+        for the buckets from start to end (exclusive). Buckets without responses are left out.
+        Returns [{'bucket': datetime, 'response_count': 1, 'mean_rating': 1.0,
+                  'tag_count': 0, 'mean_tag_rating': None}, ...]
+        """
+        return [rollup.as_dict() for rollup in ResponseRollup.select(start, end, granularity, prompt=self.pk)]
+
+    @analytics
     def get_mean_tag_rating_matrix(self):
         """
         Get mean ratings for all response_objects of all prompt_objects
@@ -507,6 +1053,12 @@ class Prompt(models.Model):
         e.g. prompt.response_object_type.get_object_for_this_type(pk=object1)
         or prompt.prompt_object_type.get_object_for_this_type(pk=object2)
         """
+        if self.tag_storage == self.TAG_STORAGES.packed:
+            matrix = defaultdict(dict)
+            for row in self._aggregate_packed_tags(['response__object_id', 'object_id']):
+                matrix[row['response__object_id']][row['object_id']] = row['average_rating']
+            return dict(matrix)
+
         # SELECT AVG(tags__rating) WHERE prompt_id=... GROUP BY prompt_object, response_object
         q = Tag.objects.values(
             'response__content_type', 'response__object_id', 
@@ -524,11 +1076,22 @@ class Prompt(models.Model):
         
         return dict(matrix)
         
+    @analytics
     def get_mean_tag_ratings(self, prompt_object):
         """
         Get mean ratings for all response_objects of prompt_object
         Returns <QuerySet [{'response_object_id': 1, 'average_rating': -1.0}, ...>
+        (a list for prompts with packed tags)
         """
+        if self.tag_storage == self.TAG_STORAGES.packed:
+            return [
+                {'response_object_id': row['object_id'], 'average_rating': row['average_rating']}
+                for row in self._aggregate_packed_tags(
+                    ['object_id'], object_id=prompt_object.pk,
+                    content_type=ContentType.objects.get_for_model(prompt_object)
+                )
+            ]
+
         # SELECT AVG(tags__rating) WHERE prompt_object=... AND prompt_id=... GROUP BY response_object
         q = self.responses
 
@@ -539,8 +1102,16 @@ class Prompt(models.Model):
         q = q.annotate(average_rating=Avg('tags__rating'))
         return q
     
+    @analytics
     def get_mean_tag_rating(self, prompt_object, response_object):
         """Get mean rating for response_object of prompt_object across all users"""
+        if self.tag_storage == self.TAG_STORAGES.packed:
+            rows = self._aggregate_packed_tags(
+                ['object_id'], response_object_ids=[response_object.pk],
+                object_id=prompt_object.pk, content_type=ContentType.objects.get_for_model(prompt_object)
+            )
+            return rows[0]['average_rating'] if rows else None
+
         # SELECT AVG(tags__rating) WHERE prompt_object=... AND response_object=... AND prompt_id=...
         q = self.responses
             
@@ -552,6 +1123,69 @@ class Prompt(models.Model):
         r = q.aggregate(average_rating=Avg('tags__rating'))        
         return r['average_rating']
 
+    TOP_RANKINGS = ('mean_rating', 'adjusted_rating')
+
+    @analytics
+    def get_top_response_objects(self, prompt_object, k=10, min_count=1, rank_by='mean_rating'):
+        """
+        Get the k response_objects of prompt_object with the highest mean or adjusted rating
+        (see distributions.describe_ratings), leaving out response_objects with fewer than min_count tags.
+        Ordering, filtering, and the limit are done by the database.
+        Ties are ranked by tag count.
+        Returns [{'response_object_id': 1, 'mean_rating': 1.0, 'adjusted_rating': 0.5, 'tag_count': 2}, ...]
+        """
+        if rank_by not in self.TOP_RANKINGS:
+            raise ValueError('Unsupported ranking: %s' % rank_by)
+        content_type = ContentType.objects.get_for_model(prompt_object)
+        prior_weight = get_prior_weight()
+
+        if self.tag_storage == self.TAG_STORAGES.packed:
+            # Packed tags can't be ranked by the database
+            prior = aggregate_packed_tags(
+                packed_tag_rows(self.responses.all()), ['response__prompt'], user_unique=False
+            )
+            prior_mean = float(prior[0]['rating_sum']) / prior[0]['tag_count'] if prior else 0
+            rows = [
+                {
+                    'response_object_id': row['object_id'],
+                    'mean_rating': row['average_rating'],
+                    'adjusted_rating': describe_ratings(
+                        row['tag_count'], row['rating_sum'], row['rating_sq_sum'], prior_mean, prior_weight
+                    )['adjusted_rating'],
+                    'tag_count': row['tag_count'],
+                }
+                for row in self._aggregate_packed_tags(
+                    ['object_id'], object_id=prompt_object.pk, content_type=content_type
+                )
+                if row['tag_count'] >= min_count
+            ]
+            rows.sort(key=lambda row: (-row[rank_by], -row['tag_count'], row['response_object_id']))
+            return rows[:k]
+
+        # SELECT object_id, AVG(rating), COUNT(id) WHERE prompt_object=... GROUP BY response_object
+        # HAVING COUNT(id) >= min_count ORDER BY ... LIMIT k
+        tags = Tag.objects.filter(response__prompt=self)
+        prior_mean = tags.aggregate(mean=Avg('rating'))['mean'] or 0
+        adjusted_rating = ExpressionWrapper(
+            (Value(prior_weight * prior_mean, output_field=FloatField()) + Sum('rating')) /
+            (Value(float(prior_weight), output_field=FloatField()) + Count('id')),
+            output_field=FloatField()
+        )
+        q = tags.filter(
+            response__object_id=prompt_object.pk, response__content_type=content_type
+        ).order_by().values('object_id').annotate(
+            mean_rating=Avg('rating'), adjusted_rating=adjusted_rating, tag_count=Count('id')
+        ).filter(tag_count__gte=min_count).order_by('-' + rank_by, '-tag_count', 'object_id')
+        return [
+            {
+                'response_object_id': row['object_id'],
+                'mean_rating': row['mean_rating'],
+                'adjusted_rating': row['adjusted_rating'],
+                'tag_count': row['tag_count'],
+            }
+            for row in q[:k]
+        ]
+
 
 class Response(models.Model):
     created = AutoCreatedField(_('created'))
@@ -568,6 +1202,26 @@ class Response(models.Model):
     object_id = models.PositiveIntegerField(null=True, blank=True)
     prompt_object = GenericForeignKey('content_type', 'object_id')
 
+    # Tags of prompts with packed tag storage, see packing.py
+    packed_tags = models.BinaryField(null=True, blank=True, editable=False)
+
+    class Meta:
+        # Used for keyset pagination
+        index_together = [('created', 'id')]
+
+    @property
+    def tag_list(self):
+        """
+        The tags of this response, from the Tag table or decoded from packed_tags.
+        Decoded tags are unsaved Tag objects without content_type.
+        """
+        if self.packed_tags is None:
+            return self.tags.all()
+        return [
+            Tag(response=self, object_id=object_id, rating=rating)
+            for object_id, rating in zip(*unpack_tags(self.packed_tags))
+        ]
+
     def clean_fields(self, exclude=None):
         super(Response, self).clean_fields(exclude=exclude)
         # Check type of prompt_object
@@ -603,3 +1257,287 @@ class Tag(models.Model):
     object_id = models.PositiveIntegerField(null=True, blank=True)
     response_object = GenericForeignKey('content_type', 'object_id')
 
+
+
+class ResponseAggregate(models.Model):
+    """
+    Totals of archived responses per prompt and prompt object, see archive.py.
+    Analysis functions add them to the totals of the remaining responses.
+    The rating_sq_sum field holds the sum of squared ratings, for variances.
+    Each user's latest archived responses are kept in ArchivedResponse instead.
+    """
+    prompt = models.ForeignKey(
+        'Prompt',
+        on_delete=models.CASCADE,
+        related_name='response_aggregates'
+    )
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, null=True, blank=True)
+    object_id = models.PositiveIntegerField(null=True, blank=True)
+
+    response_count = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.BigIntegerField(default=0)
+    rating_sq_sum = models.BigIntegerField(default=0)
+
+    modified = AutoLastModifiedField(_('modified'))
+
+    class Meta:
+        unique_together = [('prompt', 'content_type', 'object_id')]
+
+
+class TagAggregate(models.Model):
+    """
+    Totals of archived tags per prompt, prompt object, and response object, see archive.py.
+    Archived tags that are replaced by a new response are subtracted again, see Prompt.replace_archived_tags().
+    """
+    prompt = models.ForeignKey(
+        'Prompt',
+        on_delete=models.CASCADE,
+        related_name='tag_aggregates'
+    )
+    content_type = models.ForeignKey(
+        ContentType, on_delete=models.CASCADE, null=True, blank=True, related_name='+'
+    )
+    object_id = models.PositiveIntegerField(null=True, blank=True)
+    response_content_type = models.ForeignKey(
+        ContentType, on_delete=models.CASCADE, null=True, blank=True, related_name='+'
+    )
+    response_object_id = models.PositiveIntegerField(null=True, blank=True)
+
+    tag_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.BigIntegerField(default=0)
+    rating_sq_sum = models.BigIntegerField(default=0)
+
+    modified = AutoLastModifiedField(_('modified'))
+
+    class Meta:
+        unique_together = [('prompt', 'content_type', 'object_id', 'response_content_type', 'response_object_id')]
+
+
+class ArchivedResponseQuerySet(models.QuerySet):
+
+    def remaining(self, latest=False):
+        """
+        Leave out archived responses of users who responded to the same prompt object again,
+        since their remaining responses replace them when only each user's latest response counts.
+        With latest, only each user's latest archived response to the prompt is selected,
+        and left out if the user responded to the prompt again.
+        """
+        same_user = {'prompt__responses__user': F('user')}
+        if latest:
+            return self.filter(latest=True).exclude(pk__in=self.filter(**same_user).values('pk'))
+        superseded = self.filter(
+            Q(prompt__responses__content_type=F('content_type'), prompt__responses__object_id=F('object_id')) |
+            Q(prompt__responses__object_id__isnull=True, object_id__isnull=True),
+            **same_user
+        )
+        return self.exclude(pk__in=superseded.values('pk'))
+
+
+class ArchivedResponse(models.Model):
+    """
+    The latest archived response of each user per prompt and prompt object, see archive.py.
+    When only each user's latest response counts (user_unique), analysis functions add those
+    to the totals that were not replaced by a remaining response of the same user.
+    latest marks the user's latest archived response to the prompt.
+    """
+    prompt = models.ForeignKey(
+        'Prompt',
+        on_delete=models.CASCADE,
+        related_name='archived_responses'
+    )
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    object_id = models.PositiveIntegerField(null=True, blank=True)
+    rating = models.IntegerField(null=True, blank=True)
+    latest = models.BooleanField(default=False)
+
+    objects = ArchivedResponseQuerySet.as_manager()
+
+    class Meta:
+        unique_together = [('prompt', 'user', 'content_type', 'object_id')]
+
+
+class ArchivedTag(models.Model):
+    """
+    The latest archived tags of each user per prompt, prompt object, and response object, see archive.py.
+    Added to the totals when only each user's latest tags count (user_unique), until a new response
+    of the user tags the response object again, see Prompt.replace_archived_tags().
+    A response can tag a response object more than once, so the tags are summed up like in TagAggregate.
+    """
+    prompt = models.ForeignKey(
+        'Prompt',
+        on_delete=models.CASCADE,
+        related_name='archived_tags'
+    )
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    content_type = models.ForeignKey(
+        ContentType, on_delete=models.CASCADE, null=True, blank=True, related_name='+'
+    )
+    object_id = models.PositiveIntegerField(null=True, blank=True)
+    response_content_type = models.ForeignKey(
+        ContentType, on_delete=models.CASCADE, null=True, blank=True, related_name='+'
+    )
+    response_object_id = models.PositiveIntegerField(null=True, blank=True)
+    tag_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.BigIntegerField(default=0)
+    rating_sq_sum = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = [
+            ('prompt', 'user', 'content_type', 'object_id', 'response_content_type', 'response_object_id'),
+        ]
+
+
+class ResponseRollup(models.Model):
+    """
+    Totals of the responses and tags written to a prompt within an hour or a day (in UTC).
+    Rollups are updated by create_response and CreateResponseView and read by get_timeseries().
+    Tags count in the bucket of the response they were written with.
+    The sums of squared ratings give the variances. Ratings are integers, so these sums are exact
+    and can be incremented in the same atomic update as the counts.
+    """
+    GRANULARITIES = Choices(
+        ('hour', _('hour')),
+        ('day', _('day'))
+    )
+
+    prompt = models.ForeignKey(
+        'Prompt',
+        on_delete=models.CASCADE,
+        related_name='rollups'
+    )
+    granularity = models.CharField(choices=GRANULARITIES, max_length=10)
+    bucket = models.DateTimeField(_('start of the hour or day'))
+
+    response_count = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.BigIntegerField(default=0)
+    rating_sq_sum = models.BigIntegerField(default=0)
+    tag_count = models.PositiveIntegerField(default=0)
+    tag_rating_sum = models.BigIntegerField(default=0)
+    tag_rating_sq_sum = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = [('prompt', 'granularity', 'bucket')]
+
+    @classmethod
+    def truncate(cls, value, granularity):
+        "The start of the bucket of a datetime"
+        if timezone.is_aware(value):
+            value = value.astimezone(timezone.utc)
+        value = value.replace(minute=0, second=0, microsecond=0)
+        if granularity == cls.GRANULARITIES.day:
+            value = value.replace(hour=0)
+        return value
+
+    @classmethod
+    def add(cls, prompt_id, created, **totals):
+        """
+        Add totals to the hour and day buckets of created.
+        Updates existing buckets with one query, and only creates missing buckets in a savepoint.
+        """
+        buckets = dict((granularity, cls.truncate(created, granularity)) for granularity, label in cls.GRANULARITIES)
+
+        def select(granularities):
+            q = Q()
+            for granularity in granularities:
+                q |= Q(granularity=granularity, bucket=buckets[granularity])
+            return cls.objects.filter(q, prompt_id=prompt_id)
+
+        increments = dict((field, F(field) + value) for field, value in totals.items())
+        updated = select(buckets).update(**increments)
+        if updated == len(buckets):
+            return
+        existing = set(select(buckets).values_list('granularity', flat=True)) if updated else set()
+        missing = [granularity for granularity in buckets if granularity not in existing]
+        try:
+            with transaction.atomic():
+                cls.objects.bulk_create([
+                    cls(prompt_id=prompt_id, granularity=granularity, bucket=buckets[granularity], **totals)
+                    for granularity in missing
+                ])
+        except IntegrityError:
+            # Created concurrently
+            select(missing).update(**increments)
+
+    @classmethod
+    def record(cls, response, tag_ratings=()):
+        "Add a new response and the ratings of its tags to the rollups"
+        tag_ratings = list(tag_ratings)
+        cls.add(
+            response.prompt_id, response.created,
+            response_count=1,
+            rating_count=0 if response.rating is None else 1,
+            rating_sum=response.rating or 0,
+            rating_sq_sum=(response.rating or 0) ** 2,
+            tag_count=len(tag_ratings),
+            tag_rating_sum=sum(tag_ratings),
+            tag_rating_sq_sum=sum(rating * rating for rating in tag_ratings),
+        )
+
+    @classmethod
+    def rebuild(cls, prompt, force=False):
+        """
+        Recompute the rollups of a prompt from its stored responses and tags,
+        e.g. for responses that were created before rollups existed.
+        Archived responses would be lost from rebuilt rollups, so prompts with archived
+        responses (see archive.py) raise a ValueError unless force is set.
+        """
+        if not force and ResponseAggregate.objects.filter(prompt=prompt).exists():
+            raise ValueError('Prompt %s has archived responses, which rebuilt rollups would not include.' % prompt.pk)
+        totals = defaultdict(lambda: defaultdict(int))
+        tag_totals = dict(
+            (row['response'], (row['count'], row['rating_sum'], row['rating_sq_sum']))
+            for row in Tag.objects.filter(response__prompt=prompt).order_by().values('response').annotate(
+                count=Count('id'), rating_sum=Sum('rating'), rating_sq_sum=Sum(F('rating') * F('rating'))
+            )
+        )
+        for pk, created, rating, data in prompt.responses.order_by().values_list(
+            'id', 'created', 'rating', 'packed_tags'
+        ).iterator():
+            if data is not None:
+                ratings = unpack_tags(data)[1]
+                tag_count, tag_rating_sum, tag_rating_sq_sum = (
+                    len(ratings), sum(ratings), sum(value * value for value in ratings)
+                )
+            else:
+                tag_count, tag_rating_sum, tag_rating_sq_sum = tag_totals.get(pk, (0, 0, 0))
+            for granularity, label in cls.GRANULARITIES:
+                bucket = totals[(granularity, cls.truncate(created, granularity))]
+                bucket['response_count'] += 1
+                bucket['rating_count'] += 0 if rating is None else 1
+                bucket['rating_sum'] += rating or 0
+                bucket['rating_sq_sum'] += (rating or 0) ** 2
+                bucket['tag_count'] += tag_count
+                bucket['tag_rating_sum'] += tag_rating_sum or 0
+                bucket['tag_rating_sq_sum'] += tag_rating_sq_sum or 0
+        with transaction.atomic():
+            prompt.rollups.all().delete()
+            cls.objects.bulk_create([
+                cls(prompt=prompt, granularity=granularity, bucket=bucket, **values)
+                for (granularity, bucket), values in totals.items()
+            ])
+
+    @classmethod
+    def select(cls, start=None, end=None, granularity='day', **filters):
+        "Rollups of a granularity, ordered by time. start selects its whole bucket"
+        if granularity not in cls.GRANULARITIES:
+            raise ValueError('Unsupported granularity: %s' % granularity)
+        qs = cls.objects.filter(granularity=granularity, **filters)
+        if start:
+            qs = qs.filter(bucket__gte=cls.truncate(start, granularity))
+        if end:
+            qs = qs.filter(bucket__lt=end)
+        return qs.order_by('bucket')
+
+    def as_dict(self):
+        return {
+            'bucket': self.bucket,
+            'response_count': self.response_count,
+            'mean_rating': float(self.rating_sum) / self.rating_count if self.rating_count else None,
+            'rating_variance': get_variance(self.rating_count, self.rating_sum, self.rating_sq_sum),
+            'tag_count': self.tag_count,
+            'mean_tag_rating': float(self.tag_rating_sum) / self.tag_count if self.tag_count else None,
+            'tag_rating_variance': get_variance(self.tag_count, self.tag_rating_sum, self.tag_rating_sq_sum),
+        }
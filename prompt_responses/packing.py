@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Packed storage of tags.
+
+Prompts with tag_storage = 'packed' store the tags of a response in its packed_tags column
+instead of one Tag row per response object. The column holds two parallel arrays of
+32-bit little-endian integers: the object_ids of the response objects, then their ratings.
+
+Aggregations read the columns of many responses and decode each array in one call,
+without loading Tag objects.
+"""
+from array import array
+from collections import Counter
+import sys
+
+
+def _to_bytes(values):
+    values = array('i', values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes() if hasattr(values, 'tobytes') else values.tostring()
+
+
+def _from_bytes(data):
+    values = array('i')
+    if hasattr(values, 'frombytes'):
+        values.frombytes(data)
+    else:
+        values.fromstring(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def pack_tags(tags):
+    "Encode a list of (object_id, rating) tuples"
+    object_ids = [int(object_id) for object_id, rating in tags]
+    ratings = [int(rating) for object_id, rating in tags]
+    return _to_bytes(object_ids) + _to_bytes(ratings)
+
+
+def unpack_tags(data):
+    "Decode packed tags into the arrays (object_ids, ratings)"
+    values = _from_bytes(bytes(data) if data else b'')
+    count = len(values) // 2
+    return values[:count], values[count:]
+
+
+def packed_tag_rows(responses):
+    "Stream the packed tags of a Response queryset as rows for aggregate_packed_tags()"
+    return responses.exclude(packed_tags=None).order_by('-id').values_list(
+        'id', 'prompt', 'content_type', 'object_id', 'user', 'prompt__response_object_type', 'packed_tags'
+    ).iterator()
+
+
+def aggregate_packed_tags(rows, group_by, user_unique=True, response_object_ids=None):
+    """
+    Sum up packed tags like a grouped query over Tag.
+    rows are tuples of (response id, prompt_id, content_type_id, object_id, user_id,
+    response_content_type_id, packed_tags) ordered by descending id, see packed_tag_rows().
+    group_by contains Tag lookups: response__prompt, response__content_type, response__object_id,
+    content_type, object_id (of the response object), and rating.
+    With user_unique, each user's tag of a response object only counts in their latest response.
+    response_object_ids optionally restricts the response objects.
+    Returns a list of dicts with the group_by fields, tag_count, rating_sum, and rating_sq_sum (sum of squares).
+    """
+    if response_object_ids is not None:
+        response_object_ids = set(int(pk) for pk in response_object_ids)
+    seen = {}
+    totals = {}
+    for response_id, prompt_id, content_type_id, object_id, user_id, response_content_type_id, data in rows:
+        object_ids, ratings = unpack_tags(data)
+        if user_unique or response_object_ids is not None:
+            tags = list(zip(object_ids, ratings))
+            if response_object_ids is not None:
+                tags = [tag for tag in tags if tag[0] in response_object_ids]
+            if user_unique:
+                latest = seen.setdefault((prompt_id, content_type_id, object_id, user_id), set())
+                tags = [tag for tag in tags if tag[0] not in latest]
+                latest.update(tag[0] for tag in tags)
+            object_ids = [tag[0] for tag in tags]
+            ratings = [tag[1] for tag in tags]
+        fields = {
+            'response__prompt': prompt_id,
+            'response__content_type': content_type_id,
+            'response__object_id': object_id,
+            'content_type': response_content_type_id,
+        }
+        if 'object_id' in group_by or 'rating' in group_by:
+            # One group per response object and/or rating
+            for tag_object_id, rating in zip(object_ids, ratings):
+                fields['object_id'] = tag_object_id
+                fields['rating'] = rating
+                total = totals.setdefault(tuple(fields[field] for field in group_by), [0, 0, 0])
+                total[0] += 1
+                total[1] += rating
+                total[2] += rating * rating
+        elif object_ids:
+            total = totals.setdefault(tuple(fields.get(field) for field in group_by), [0, 0, 0])
+            total[0] += len(ratings)
+            total[1] += sum(ratings)
+            total[2] += sum(rating * rating for rating in ratings)
+    return [
+        dict(zip(group_by, key), tag_count=tag_count, rating_sum=rating_sum, rating_sq_sum=rating_sq_sum)
+        for key, (tag_count, rating_sum, rating_sq_sum) in totals.items()
+    ]
+
+
+def packed_tag_histogram(responses):
+    "Count the ratings of the packed tags of a Response queryset. Returns a {rating: count} dict"
+    histogram = Counter()
+    for data in responses.exclude(packed_tags=None).values_list('packed_tags', flat=True).iterator():
+        histogram.update(unpack_tags(data)[1])
+    return dict(histogram)
@@ -0,0 +1,105 @@
+import base64
+import binascii
+import datetime
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.translation import ugettext_lazy as _
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a unique key made of several fields, by default (created, id).
+
+    Instead of an offset, every page is selected with a condition on the key of the
+    last item of the previous page (WHERE (created, id) > (...)), so fetching a page
+    costs the same no matter how deep into the table it is.
+    Results are ordered ascending, which allows clients to store the returned `cursor`
+    and later continue from there to receive only new items (incremental sync).
+    """
+    ordering = ('created', 'id')
+    page_size = api_settings.PAGE_SIZE or 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.get_position_filter(position))
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        # Fetch one more item to find out if there is a next page
+        results = list(queryset[:page_size + 1])
+        self.has_next = len(results) > page_size
+        self.page = results[:page_size]
+        if self.page:
+            self.position = [getattr(self.page[-1], field) for field in self.ordering]
+        else:
+            self.position = position
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def get_position_filter(self, position):
+        "(a, b) > (x, y) expressed as (a > x) OR (a = x AND b > y)"
+        condition = Q()
+        for idx, field in enumerate(self.ordering):
+            term = Q(**{'%s__gt' % field: position[idx]})
+            for prev_idx in range(idx):
+                term &= Q(**{self.ordering[prev_idx]: position[prev_idx]})
+            condition |= term
+        return condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param, None)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def encode_cursor(self, position):
+        if position is None:
+            return None
+        # Datetimes need full precision (DjangoJSONEncoder would truncate microseconds)
+        values = [value.isoformat() if isinstance(value, datetime.datetime) else value for value in position]
+        return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.position))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('cursor', self.encode_cursor(self.position)),
+            ('results', data)
+        ]))
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Database routing for analytics queries.
+
+Add the router to your settings and name the database alias of a read replica:
+
+    DATABASE_ROUTERS = ['prompt_responses.routers.AnalyticsRouter']
+    PROMPT_RESPONSES_ANALYTICS_DATABASE = 'replica'
+
+Reads within analytics methods (e.g. get_prompt_statistics) are then sent to the replica,
+while create_response and all other queries stay on the default database.
+"""
+from contextlib import contextmanager
+from functools import wraps
+import threading
+
+from django.conf import settings
+from django.db.models.query import QuerySet
+
+
+_state = threading.local()
+
+
+def get_analytics_database():
+    "The database alias for analytics queries, or None to use the default routing"
+    return getattr(settings, 'PROMPT_RESPONSES_ANALYTICS_DATABASE', None)
+
+
+def in_analytics():
+    return getattr(_state, 'depth', 0) > 0
+
+
+@contextmanager
+def analytics_database():
+    "Send reads within this block to the analytics database (if AnalyticsRouter is installed)"
+    _state.depth = getattr(_state, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _state.depth -= 1
+
+
+def analytics(func):
+    """
+    Decorator for analytics methods, see analytics_database().
+    Returned querysets are bound to the analytics database, as they are evaluated later.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with analytics_database():
+            result = func(*args, **kwargs)
+        database = get_analytics_database()
+        if database and isinstance(result, QuerySet):
+            result = result.using(database)
+        return result
+    return wrapper
+
+
+class AnalyticsRouter(object):
+    "Routes reads of analytics methods to PROMPT_RESPONSES_ANALYTICS_DATABASE"
+
+    def db_for_read(self, model, **hints):
+        if in_analytics():
+            return get_analytics_database()
+        return None
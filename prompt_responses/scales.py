@@ -0,0 +1,114 @@
+from django.utils.encoding import force_text
+from django.utils.translation import get_language
+
+from .metrics import cache_requests
+
+
+class Scale(object):
+    """
+    An immutable rating scale.
+    Iterating yields (value, label) tuples, so it can be used as a form field's choices.
+    `value in scale` checks if value is a valid rating with a set lookup.
+    """
+    __slots__ = ('choices', 'values', 'text_values')
+
+    def __init__(self, choices):
+        choices = tuple((value, label) for value, label in choices)
+        object.__setattr__(self, 'choices', choices)
+        object.__setattr__(self, 'values', frozenset(value for value, label in choices))
+        object.__setattr__(self, 'text_values', frozenset(force_text(value) for value, label in choices))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('%s objects are immutable' % self.__class__.__name__)
+
+    def __iter__(self):
+        return iter(self.choices)
+
+    def __len__(self):
+        return len(self.choices)
+
+    def __getitem__(self, index):
+        return self.choices[index]
+
+    def __contains__(self, value):
+        return value in self.values
+
+    def __eq__(self, other):
+        if isinstance(other, Scale):
+            return self.choices == other.choices
+        if isinstance(other, (list, tuple)):
+            return self.choices == tuple(tuple(choice) for choice in other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        return hash(self.choices)
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, list(self.choices))
+
+
+def get_scale_identity(custom_scale):
+    """
+    A string that identifies a custom_scale (a list or a callable) across requests and processes,
+    or None if it can't be identified, in which case its scales must not be memoized or cached.
+    Callables are identified by their `scale_key` attribute if they have one, otherwise module-level
+    functions and methods by their qualified name, so they should always return the same scale
+    for the same prompt. Lambdas and nested functions (e.g. closures created in a loop) share their names
+    and can't be identified without a scale_key.
+    """
+    if custom_scale is None:
+        return 'default'
+    if callable(custom_scale):
+        scale_key = getattr(custom_scale, 'scale_key', None)
+        if scale_key is not None:
+            return 'key:%s' % (scale_key,)
+        func = getattr(custom_scale, '__func__', custom_scale)
+        name = getattr(func, '__qualname__', None) or getattr(func, '__name__', None)
+        if not name or '<' in name or getattr(func, '__closure__', None):
+            return None
+        owner = getattr(custom_scale, '__self__', None)
+        return '%s.%s.%s' % (func.__module__, owner.__class__.__name__ if owner is not None else '', name)
+    return repr(list(custom_scale))
+
+
+class ScaleCache(object):
+    """
+    Process-wide memo of generated scales.
+    Keys include the prompt's modified timestamp, so changes to a prompt invalidate its scales.
+    Scales of custom scales without identity (see get_scale_identity()) are generated every time.
+    Cleared completely when it grows beyond max_size.
+    """
+    max_size = 1000
+
+    def __init__(self):
+        self.scales = {}
+
+    def get_key(self, prompt, custom_scale):
+        "The memo key, or None if the scale can't be memoized"
+        identity = get_scale_identity(custom_scale if custom_scale is not None else prompt.custom_scale)
+        if prompt.pk is None or identity is None:
+            return None
+        return (prompt.__class__, prompt.pk, prompt.modified, identity, get_language())
+
+    def get(self, prompt, custom_scale, generate):
+        key = self.get_key(prompt, custom_scale)
+        if key is None:
+            return Scale(generate())
+        scale = self.scales.get(key, None)
+        cache_requests.inc(cache='scale', result='miss' if scale is None else 'hit')
+        if scale is None:
+            scale = Scale(generate())
+            if len(self.scales) >= self.max_size:
+                self.scales.clear()
+            self.scales[key] = scale
+        return scale
+
+    def clear(self):
+        self.scales.clear()
+
+
+scale_cache = ScaleCache()
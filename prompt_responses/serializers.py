@@ -1,8 +1,15 @@
+from collections import OrderedDict
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 from .models import Prompt, PromptSet, Response, Tag
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
+from django.utils.translation import get_language
 from rest_framework.reverse import reverse
+try:
+    from django.urls import reverse as django_reverse, get_script_prefix, get_urlconf
+except ImportError:
+    from django.core.urlresolvers import reverse as django_reverse, get_script_prefix, get_urlconf
 
 
 class PromptSetPromptInstanceHyperlink(serializers.HyperlinkedRelatedField):
@@ -92,11 +99,125 @@ class PromptInstanceSerializer(serializers.Serializer):
     class Meta:
         fields = ('url', 'next_prompt_instance', 'response_url', 'display_text', 'prompt', 'object', 'response_objects', )
 
+class FastPromptInstanceSerializer(object):
+    """
+    Renders the same data as PromptInstanceSerializer, but without DRF's field machinery.
+    URLs are generated from URL templates that are reversed only once per view name,
+    and content type labels are cached per language.
+    Use it by setting `instance_serializer_class` on PromptViewSet.
+    """
+    # Placeholder values that are valid for the URL patterns and get replaced in the templates
+    url_sentinels = {
+        'pk': '918273645546372819',
+        'name': 'promptsetnamesentinel',
+        'promptset_name': 'promptsetnamesentinel',
+    }
+    url_templates = {}
+    type_labels = {}
+
+    def __init__(self, instance, context=None):
+        self.instance = instance
+        self.context = context or {}
+        request = self.context.get('request', None)
+        self.request = request
+        self.base_url = request.build_absolute_uri('/')[:-1] if request else ''
+        # Versioning schemes and format overrides can change URLs per request, so these use DRF's reverse()
+        self.use_reverse = request is not None and (
+            getattr(request, 'versioning_scheme', None) is not None or
+            api_settings.URL_FORMAT_OVERRIDE in getattr(request, 'GET', {})
+        )
+
+    def url(self, view_name, **kwargs):
+        if self.use_reverse:
+            return reverse(view_name, kwargs=kwargs, request=self.request)
+        key = (view_name, tuple(sorted(kwargs)), get_urlconf(), get_script_prefix())
+        template = self.url_templates.get(key, None)
+        if template is None:
+            path = django_reverse(view_name, kwargs={k: self.url_sentinels[k] for k in kwargs})
+            template = path.replace('{', '{{').replace('}', '}}')
+            for k in kwargs:
+                template = template.replace(self.url_sentinels[k], '{%s}' % k)
+            self.url_templates[key] = template
+        return self.base_url + template.format(**kwargs)
+
+    def type_label(self, content_type=None, obj=None):
+        key = (content_type if obj is None else obj.__class__, get_language())
+        label = self.type_labels.get(key, None)
+        if label is None:
+            if obj is None:
+                label = str(ContentType.objects.get_for_id(content_type))
+            else:
+                label = str(ContentType.objects.get_for_model(obj))
+            self.type_labels[key] = label
+        return label
+
+    def prompt_data(self, prompt):
+        if prompt is None:
+            return None
+        return OrderedDict((
+            ('url', self.url('prompt-detail', pk=prompt.pk)),
+            ('id', prompt.id),
+            ('instance_url', self.url('prompt-instantiate', pk=prompt.pk)),
+            ('type', prompt.type),
+            ('scale_min', prompt.scale_min),
+            ('scale_max', prompt.scale_max),
+            ('text', prompt.text),
+            ('label', prompt.label),
+            ('name', prompt.name),
+            ('prompt_object_type',
+                self.type_label(prompt.prompt_object_type_id) if prompt.prompt_object_type_id else None),
+            ('response_object_type',
+                self.type_label(prompt.response_object_type_id) if prompt.response_object_type_id else None),
+        ))
+
+    def object_data(self, obj):
+        if obj is None:
+            return None
+        return OrderedDict((
+            ('id', int(obj.id)),
+            ('__str__', str(obj)),
+            ('object_type', self.type_label(obj=obj)),
+        ))
+
+    @property
+    def data(self):
+        instance = self.instance
+        prompt = instance.prompt
+        next_prompt = instance.next_prompt
+        next_prompt_instance = None
+        if next_prompt:
+            next_prompt_instance = self.url(
+                'prompt-instantiate-from-set', promptset_name=instance.promptset.name, pk=next_prompt.pk
+            )
+        response_objects = None
+        if instance.response_objects is not None:
+            response_objects = [self.object_data(obj) for obj in instance.response_objects]
+        return OrderedDict((
+            ('next_prompt_instance', next_prompt_instance),
+            ('next_prompt', self.prompt_data(next_prompt)),
+            ('response_create_url', self.url('prompt-create-response', pk=prompt.pk)),
+            ('promptset', self.url('promptset-detail', name=instance.promptset.name) if instance.promptset else None),
+            ('prompt', self.prompt_data(prompt)),
+            ('object', self.object_data(instance.object)),
+            ('response_objects', response_objects),
+            ('display_text', str(instance)),
+        ))
+
+
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tag
         fields = ('rating', 'object_id',)
 
+class ResponseListSerializer(serializers.ModelSerializer):
+    "Read-only representation of responses incl. their tags"
+    tags = TagSerializer(many=True, read_only=True, source='tag_list')
+
+    class Meta:
+        model = Response
+        fields = ('id', 'created', 'prompt', 'user', 'rating', 'text', 'object_id', 'tags', )
+        read_only_fields = fields
+
 class ResponseSerializer(serializers.ModelSerializer):
     prompt = serializers.PrimaryKeyRelatedField(queryset=Prompt.objects)
     tags = TagSerializer(many=True, required=False)
@@ -109,7 +230,7 @@ class ResponseSerializer(serializers.ModelSerializer):
         prompt = validated_data.pop('prompt')
         user = self.context['request'].user if self.context['request'].user.is_authenticated else None
         try:
-            return prompt.create_response(user=user, **validated_data)
+            return prompt.create_response(user=user, custom_scale=self.context.get('custom_scale'), **validated_data)
         except ValidationError as e:
             # Propagate Django's validation errors
             try:
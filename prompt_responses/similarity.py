@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Similarity of response objects.
+
+Response objects of a tagging prompt are similar if they were tagged for the same prompt objects
+with similar ratings, e.g. to recommend related objects or to find duplicates.
+The mean tag ratings form a sparse matrix with one row per response object and one column per
+prompt object, which is loaded from the database in one streamed query.
+
+Similarities are the dot products of the normalized rows. They are computed with vectorized
+sparse operations for chunk_size rows at a time, so memory is bounded by chunk_size times the
+number of response objects instead of growing with the square of the vocabulary.
+NumPy is an optional dependency:
+
+    pip install numpy
+"""
+from itertools import chain
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Count, Sum
+
+# NumPy is imported on first use (see require_numpy()), as models import this module
+np = None
+
+from .packing import aggregate_packed_tags, packed_tag_rows
+
+
+METRICS = ('cosine', 'pearson')
+
+
+def require_numpy():
+    "Import NumPy into this module and return it, or raise ImproperlyConfigured if it isn't installed"
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImproperlyConfigured('Similarities require NumPy (pip install numpy).')
+        np = numpy
+    return np
+
+
+def get_chunk_size():
+    "The number of response objects whose similarities are computed at once"
+    return getattr(settings, 'PROMPT_RESPONSES_SIMILARITY_CHUNK_SIZE', 1000)
+
+
+def load_rating_matrix(prompt):
+    """
+    Load the mean tag ratings of a tagging prompt as a sparse matrix in coordinate form,
+    with one row per response object and one column per prompt object.
+    Returns (object_ids, rows, columns, ratings): object_ids are the sorted ids of the response objects
+    (one per row), and rows, columns, and ratings hold the entries, sorted by row and column.
+    """
+    # Imported here, as models import this module
+    from .models import Prompt, Tag
+    require_numpy()
+    if prompt.tag_storage == Prompt.TAG_STORAGES.packed:
+        groups = aggregate_packed_tags(
+            packed_tag_rows(prompt.responses.all()), ['object_id', 'response__object_id'], user_unique=False
+        )
+        groups = (
+            (group['object_id'], group['response__object_id'], group['rating_sum'], group['tag_count'])
+            for group in groups if group['response__object_id'] is not None
+        )
+    else:
+        # SELECT object_id, response.object_id, SUM(rating), COUNT(id) GROUP BY object_id, response.object_id
+        groups = Tag.objects.filter(
+            response__prompt=prompt, object_id__isnull=False, response__object_id__isnull=False
+        ).order_by().values_list('object_id', 'response__object_id').annotate(
+            rating_sum=Sum('rating'), tag_count=Count('id')
+        ).iterator()
+    data = np.fromiter(chain.from_iterable(groups), dtype=np.int64).reshape(-1, 4)
+    object_ids, rows = np.unique(data[:, 0], return_inverse=True)
+    rows = rows.reshape(-1)
+    columns = np.unique(data[:, 1], return_inverse=True)[1].reshape(-1)
+    ratings = data[:, 2] / data[:, 3].astype(float)
+    # Sorting by column as well makes the sums, and thus the results, independent of the query order
+    order = np.lexsort((columns, rows))
+    return object_ids, rows[order], columns[order], ratings[order]
+
+
+def normalize_ratings(rows, ratings, row_count, metric='cosine'):
+    """
+    Scale the ratings of each row to unit length, so that the dot products of rows are their cosine similarities.
+    For metric='pearson', the ratings are first centered on the mean of each row's entries.
+    Rows without variation are all zeros.
+    """
+    require_numpy()
+    if metric not in METRICS:
+        raise ValueError('Unsupported metric: %s' % metric)
+    if metric == 'pearson':
+        counts = np.bincount(rows, minlength=row_count)
+        means = np.bincount(rows, weights=ratings, minlength=row_count) / np.maximum(counts, 1)
+        ratings = ratings - means[rows]
+    norms = np.sqrt(np.bincount(rows, weights=ratings ** 2, minlength=row_count))[rows]
+    return np.where(norms > 0, ratings / np.where(norms > 0, norms, 1), 0)
+
+
+def _expand(starts, lengths):
+    "Concatenate the index ranges [start, start + length)"
+    total = lengths.sum()
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(total)
+
+
+def _indptr(indices, count):
+    "Offsets of the entries of each index in a sorted array of indices, followed by the total"
+    return np.concatenate(([0], np.cumsum(np.bincount(indices, minlength=count))))
+
+
+def iter_similarity_chunks(matrix, metric='cosine', chunk_size=None, object_ids=None):
+    """
+    Compute the similarities of the rows of a matrix from load_rating_matrix() in chunks.
+    object_ids optionally restricts the rows (ids without ratings are left out).
+    Yields (object_ids, similarities, common_counts) for chunk_size rows at a time (see get_chunk_size()),
+    where similarities and common_counts are arrays with one row per object id of the chunk
+    and one column per row of the matrix. common_counts are the numbers of prompt objects that
+    both response objects were tagged for.
+    """
+    require_numpy()
+    all_ids, rows, columns, ratings = matrix
+    row_count = len(all_ids)
+    column_count = columns.max() + 1 if len(columns) else 0
+    ratings = normalize_ratings(rows, ratings, row_count, metric)
+    row_indptr = _indptr(rows, row_count)
+
+    # The entries by column, to find the rows that share a column
+    by_column = np.argsort(columns, kind='stable')
+    column_rows, column_ratings = rows[by_column], ratings[by_column]
+    column_indptr = _indptr(columns[by_column], column_count)
+
+    if object_ids is None:
+        selected = np.arange(row_count)
+    else:
+        requested = np.unique(np.asarray(list(object_ids), dtype=np.int64))
+        selected = np.searchsorted(all_ids, requested)
+        found = selected < row_count
+        selected, requested = selected[found], requested[found]
+        selected = selected[all_ids[selected] == requested]
+    chunk_size = chunk_size or get_chunk_size()
+    for start in range(0, len(selected), chunk_size):
+        chunk = selected[start:start + chunk_size]
+        # The entries of the chunk's rows, and each of them paired with all entries in its column
+        lengths = np.diff(row_indptr)[chunk]
+        entries = _expand(row_indptr[chunk], lengths)
+        local_rows = np.repeat(np.arange(len(chunk)), lengths)
+        entry_columns = columns[entries]
+        pair_lengths = np.diff(column_indptr)[entry_columns]
+        partners = _expand(column_indptr[entry_columns], pair_lengths)
+        cells = np.repeat(local_rows, pair_lengths) * row_count + column_rows[partners]
+        size = len(chunk) * row_count
+        similarities = np.bincount(
+            cells, weights=np.repeat(ratings[entries], pair_lengths) * column_ratings[partners], minlength=size
+        ).reshape(len(chunk), row_count)
+        common_counts = np.bincount(cells, minlength=size).reshape(len(chunk), row_count)
+        yield all_ids[chunk], similarities, common_counts
+
+
+def top_neighbors(object_ids, similarities, common_counts, all_ids, k=10, min_common=1):
+    """
+    Select the k most similar other rows for each row of a chunk from iter_similarity_chunks(),
+    leaving out rows that share fewer than min_common prompt objects.
+    Returns [{'response_object_id': 1,
+              'neighbors': [{'response_object_id': 2, 'similarity': 0.9, 'common_count': 3}, ...]}, ...]
+    """
+    require_numpy()
+    similarities = np.where(common_counts >= max(min_common, 1), similarities, -np.inf)
+    # Leave out each row itself
+    positions = np.searchsorted(all_ids, object_ids)
+    similarities[np.arange(len(object_ids)), positions] = -np.inf
+    k = min(k, similarities.shape[1])
+    if k < similarities.shape[1]:
+        candidates = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(similarities.shape[1]), (len(object_ids), 1))
+    candidate_similarities = np.take_along_axis(similarities, candidates, axis=1)
+    # Most similar first, ties by object id
+    order = np.lexsort((candidates, -candidate_similarities), axis=1)
+    candidates = np.take_along_axis(candidates, order, axis=1)
+    results = []
+    for row, object_id in enumerate(object_ids):
+        results.append({
+            'response_object_id': int(object_id),
+            'neighbors': [
+                {
+                    'response_object_id': int(all_ids[column]),
+                    'similarity': float(similarities[row, column]),
+                    'common_count': int(common_counts[row, column]),
+                }
+                for column in candidates[row] if similarities[row, column] > -np.inf
+            ],
+        })
+    return results
+
+
+def get_similar_response_objects(prompt, k=10, metric='cosine', min_common=1, chunk_size=None, object_ids=None):
+    """
+    Get the k most similar response objects of each response object of a tagging prompt,
+    see top_neighbors(). The rating matrix is loaded with one query, and the similarities
+    are computed in chunks of chunk_size response objects.
+    """
+    if metric not in METRICS:
+        raise ValueError('Unsupported metric: %s' % metric)
+    matrix = load_rating_matrix(prompt)
+    results = []
+    for chunk in iter_similarity_chunks(matrix, metric, chunk_size, object_ids):
+        results.extend(top_neighbors(*chunk, all_ids=matrix[0], k=k, min_common=min_common))
+    return results
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Precomputed statistics summaries of prompts and prompt sets.
+
+Summaries are computed on request (e.g. by the admin's refresh action)
+and stored in Django's cache, so displaying them does not scan the responses.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import Count, Sum
+from django.utils import timezone
+import threading
+
+from .models import Prompt, PromptSet, Response, ResponseAggregate, Tag, TagAggregate
+from .packing import packed_tag_histogram
+from .routers import analytics
+
+
+def get_cache_key(obj):
+    return 'prompt_responses:summary:%s:%s' % (obj._meta.model_name, obj.pk)
+
+
+def get_cache_timeout():
+    # None keeps summaries until they are refreshed
+    return getattr(settings, 'PROMPT_RESPONSES_SUMMARY_CACHE_TIMEOUT', None)
+
+
+def summarize_histogram(histogram, archived_count=0, archived_sum=0):
+    """
+    Compute count and mean from a {rating: count} dict, ignoring missing ratings.
+    The count and sum of archived ratings are added to them, but not to the histogram.
+    """
+    count = sum(c for rating, c in histogram.items() if rating is not None) + (archived_count or 0)
+    total = sum(rating * c for rating, c in histogram.items() if rating is not None) + (archived_sum or 0)
+    return {
+        'count': count,
+        'mean': float(total) / count if count else None,
+        'histogram': sorted((rating, c) for rating, c in histogram.items() if rating is not None),
+    }
+
+
+@analytics
+def compute_prompt_summary(prompt):
+    """
+    Compute counts, mean ratings, and rating histograms of a prompt's
+    responses and tags. Uses three grouped queries, and one more per aggregate table.
+
+    Counts and means include the archived responses and tags (see archive.py),
+    histograms and the user count only the remaining ones.
+    """
+    responses = Response.objects.filter(prompt=prompt).order_by()
+    histogram = dict(responses.values_list('rating').annotate(count=Count('id')))
+    archived = ResponseAggregate.objects.filter(prompt=prompt).aggregate(
+        response_count=Sum('response_count'), rating_count=Sum('rating_count'), rating_sum=Sum('rating_sum'),
+    )
+    ratings = summarize_histogram(histogram, archived['rating_count'], archived['rating_sum'])
+    user_count = responses.aggregate(count=Count('user', distinct=True))['count']
+
+    summary = {
+        'prompt_id': prompt.pk,
+        'text': prompt.text,
+        'response_count': sum(histogram.values()) + (archived['response_count'] or 0),
+        'user_count': user_count,
+        'rating_count': ratings['count'],
+        'mean_rating': ratings['mean'],
+        'rating_histogram': ratings['histogram'],
+    }
+    if prompt.type == Prompt.TYPES.tagging:
+        if prompt.tag_storage == Prompt.TAG_STORAGES.packed:
+            tag_histogram = packed_tag_histogram(responses)
+        else:
+            tag_histogram = dict(
+                Tag.objects.filter(response__prompt=prompt).order_by()
+                .values_list('rating').annotate(count=Count('id'))
+            )
+        archived_tags = TagAggregate.objects.filter(prompt=prompt).aggregate(
+            tag_count=Sum('tag_count'), rating_sum=Sum('rating_sum'),
+        )
+        tag_ratings = summarize_histogram(tag_histogram, archived_tags['tag_count'], archived_tags['rating_sum'])
+        summary.update({
+            'tag_count': tag_ratings['count'],
+            'mean_tag_rating': tag_ratings['mean'],
+            'tag_rating_histogram': tag_ratings['histogram'],
+        })
+    return summary
+
+
+def compute_summary(obj):
+    "Compute the summary of a Prompt or PromptSet and store it in the cache"
+    if isinstance(obj, PromptSet):
+        data = {'prompts': [compute_prompt_summary(prompt) for prompt in obj.prompts.all()]}
+    else:
+        data = compute_prompt_summary(obj)
+    summary = {'computed': timezone.now(), 'refreshing': False, 'data': data}
+    cache.set(get_cache_key(obj), summary, get_cache_timeout())
+    return summary
+
+
+def get_summary(obj):
+    """
+    Get the stored summary of a Prompt or PromptSet without computing it.
+    Returns a dict with computed (datetime), refreshing (bool), and data,
+    or None if no summary was computed yet.
+    """
+    return cache.get(get_cache_key(obj))
+
+
+def _clear_refreshing(obj):
+    "Unmark a summary whose refresh failed, so that it can be refreshed again"
+    summary = get_summary(obj)
+    if summary and summary.get('refreshing'):
+        summary['refreshing'] = False
+        cache.set(get_cache_key(obj), summary, get_cache_timeout())
+
+
+def _compute_summaries(objects):
+    try:
+        for obj in objects:
+            compute_summary(obj)
+    finally:
+        # Summaries that weren't computed because of an error
+        for obj in objects:
+            _clear_refreshing(obj)
+        # Analytics queries may use other connections than the default one, see routers.py
+        connections.close_all()
+
+
+def refresh_summaries(objects, background=True):
+    """
+    Recompute the summaries of Prompts or PromptSets.
+    By default this happens in a background thread, and stored summaries
+    are marked as refreshing until they have been recomputed.
+    """
+    objects = list(objects)
+    if not background:
+        return [compute_summary(obj) for obj in objects]
+
+    for obj in objects:
+        summary = get_summary(obj) or {'computed': None, 'data': None}
+        summary['refreshing'] = True
+        cache.set(get_cache_key(obj), summary, get_cache_timeout())
+    thread = threading.Thread(target=_compute_summaries, args=(objects,))
+    thread.daemon = True
+    thread.start()
+    return thread
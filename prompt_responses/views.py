@@ -2,12 +2,17 @@ from django.db import transaction
 from django.views.generic import CreateView
 from django.views.generic.detail import SingleObjectMixin
 from .forms import ResponseForm, ResponseTagsForm
-from .models import Prompt, Response
+from .models import Prompt, Response, ResponseRollup, Tag
+from .packing import pack_tags
+from .metrics import registry
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.utils.functional import cached_property
-from django.core.exceptions import ImproperlyConfigured
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+from django.contrib import messages
 from django.contrib.messages.views import SuccessMessageMixin
+from django.http import HttpResponse, HttpResponseRedirect
+from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 try:
     from django.urls import reverse, resolve
@@ -41,7 +46,9 @@ class PromptInstanceMixin(object):
     def get_prompt_queryset(self):
         if self.prompt_queryset is None:
             if self.prompt_model:
-                return self.prompt_model._default_manager.all()
+                return self.prompt_model._default_manager.select_related(
+                    'prompt_object_type', 'response_object_type'
+                )
             else:
                 raise ImproperlyConfigured(
                     "%(cls)s is missing a QuerySet. Define "
@@ -96,23 +103,38 @@ class BaseCreateResponseView(PromptInstanceMixin, SuccessMessageMixin, CreateVie
         kwargs.update({'prompt_instance': self.prompt_instance})
         return kwargs
 
+    @cached_property
+    def formset(self):
+        """
+        Formset for the tags of tagging prompts, or None for other prompts.
+        Built only once per request and reused for validation and rendering.
+        """
+        if not self.prompt.response_object_type:
+            return None
+
+        initial = []
+        if self.prompt_instance.response_objects:
+            initial = [{
+                'content_type': ContentType.objects.get_for_model(obj),
+                'object_id': obj.pk
+            } for obj in self.prompt_instance.response_objects]
+
+        kwargs = {
+            'instance': self.object,
+            'initial': initial,
+            'form_kwargs': {'prompt_instance': self.prompt_instance},
+        }
+        if self.request.method in ('POST', 'PUT'):
+            kwargs['data'] = self.request.POST
+        formset = ResponseTagsForm(**kwargs)
+        formset.extra = len(initial)
+        formset.load_objects(self.prompt_instance.response_objects)
+        return formset
+
     def get_context_data(self, **kwargs):
         data = super(BaseCreateResponseView, self).get_context_data(**kwargs)
-    
-        if self.prompt.response_object_type:
-            initial = []
-            if self.prompt_instance.response_objects:
-                initial = [{
-                    'content_type': ContentType.objects.get_for_model(obj),
-                    'object_id': obj.pk
-                } for obj in self.prompt_instance.response_objects]
-                
-            if self.request.POST:
-                data['formset'] = ResponseTagsForm(self.request.POST, instance=self.object, initial=initial, form_kwargs={'prompt_instance': self.prompt_instance})
-            else:
-                data['formset'] = ResponseTagsForm(instance=self.object, initial=initial, form_kwargs={'prompt_instance': self.prompt_instance})
-            data['formset'].extra = len(initial)
-
+        if self.formset is not None:
+            data['formset'] = self.formset
         return data
 
     def get_success_url(self):
@@ -124,18 +146,47 @@ class BaseCreateResponseView(PromptInstanceMixin, SuccessMessageMixin, CreateVie
 
     @transaction.atomic
     def form_valid(self, form):
-        context = self.get_context_data()
-        form.instance.user = self.get_user()
-        self.object = form.save()
-        formset = context.get('formset', None)
-        if formset:
-            if formset.is_valid():
-                formset.instance = self.object
-                formset.save()
+        formset = self.formset
+        if formset is not None and not formset.is_valid():
+            return self.form_invalid(form)
 
-        return super(BaseCreateResponseView, self).form_valid(form)
+        form.instance.user = self.get_user()
+        tags = []
+        if formset is not None and self.prompt.tag_storage == Prompt.TAG_STORAGES.packed:
+            # Store the tags in the response, see packing.py
+            tags = formset.save(commit=False)
+            form.instance.packed_tags = pack_tags([(tag.object_id, tag.rating) for tag in tags])
+            self.object = form.save()
+            self.prompt.replace_packed_tags(self.object)
+        else:
+            self.object = form.save()
+            if formset is not None:
+                tags = formset.save(commit=False)
+                for tag in tags:
+                    tag.response = self.object
+                Tag.objects.bulk_create(tags)
+                # Earlier tags are kept, but only the new ones count as the user's latest tags
+                self.prompt.replace_archived_tags(self.object, [tag.object_id for tag in tags], aggregates=False)
+        ResponseRollup.record(self.object, [tag.rating for tag in tags])
+
+        # Not calling super().form_valid(), as ModelFormMixin would save the form a second time
+        success_message = self.get_success_message(form.cleaned_data)
+        if success_message:
+            messages.success(self.request, success_message)
+        return HttpResponseRedirect(self.get_success_url())
 
 
 class CreateResponseView(LoginRequiredMixin, BaseCreateResponseView):
     def get_user(self):
         return self.request.user
+
+
+def metrics_view(request):
+    """
+    Metrics in the Prometheus text format, see prompt_responses.metrics.
+    Only available to staff users and to requests from INTERNAL_IPS.
+    """
+    user = getattr(request, 'user', None)
+    if not (user is not None and user.is_staff) and request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+        raise PermissionDenied
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,41 +1,244 @@
-from rest_framework import viewsets, status
+from rest_framework import viewsets, mixins, status
 from rest_framework.decorators import detail_route, list_route
 from rest_framework.response import Response
-from rest_framework.exceptions import NotAuthenticated, NotFound
+from rest_framework.exceptions import APIException, NotAuthenticated, NotFound, ValidationError
 from rest_framework.permissions import IsAuthenticated
 from .serializers import (
-    PromptSerializer, PromptSetSerializer, PromptInstanceSerializer, ResponseSerializer
+    PromptSerializer, PromptSetSerializer, PromptInstanceSerializer, ResponseSerializer, ResponseListSerializer
 )
-from .models import Prompt, PromptSet
-from django.core.exceptions import ObjectDoesNotExist
+from .models import Prompt, PromptSet, Response as ResponseModel, ResponseRollup, Tag
+from . import agreement
+from .agreement import METRICS
+from .pagination import KeysetPagination
+from .routers import analytics
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from django.utils.translation import ugettext_lazy as _
+from calendar import timegm
+from datetime import datetime, timedelta
+import hashlib
 
 
-class PromptSetViewSet(viewsets.ReadOnlyModelViewSet):
+class ConditionalGetMixin(object):
+    """
+    Adds ETag and Last-Modified headers to list and retrieve responses.
+    Conditional requests that match are answered with 304 Not Modified
+    without serializing any data.
+    List responses only get an ETag, which includes the number of rows:
+    the latest modification of the remaining rows doesn't change when rows are deleted.
+    Set last_modified = False for objects that can change without a newer modified timestamp.
+    """
+    last_modified = True
+
+    def get_object_versions(self, obj):
+        "List of (pk, modified) tuples of everything that the serialized object depends on"
+        return [(obj.pk, obj.modified)]
+
+    def conditional_response(self, request, version, last_modified, render):
+        """
+        Return 304 if the request's conditions match version and last_modified,
+        otherwise call render() to create the response.
+        """
+        version = (version, getattr(request, 'accepted_media_type', None))
+        etag = quote_etag(hashlib.md5(repr(version).encode('utf-8')).hexdigest())
+        timestamp = timegm(last_modified.utctimetuple()) if last_modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = render()
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        return response
+
+    def versioned_response(self, request, objects, render, count=None):
+        """
+        Respond conditionally on the versions of objects.
+        For lists, count is the total number of rows, and Last-Modified is left out.
+        """
+        versions = [version for obj in objects for version in self.get_object_versions(obj)]
+        if count is not None:
+            return self.conditional_response(request, (count, versions), None, render)
+        if not self.last_modified:
+            return self.conditional_response(request, versions, None, render)
+        last_modified = max([modified for _pk, modified in versions]) if versions else None
+        return self.conditional_response(request, versions, last_modified, render)
+
+    def get_row_count(self, queryset):
+        "The total number of rows of a paginated list, from the paginator if it counted them"
+        page = getattr(self.paginator, 'page', None)
+        paginator = getattr(page, 'paginator', None)
+        if paginator is not None:
+            return paginator.count
+        return queryset.count()
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.versioned_response(
+                request, page,
+                lambda: self.get_paginated_response(self.get_serializer(page, many=True).data),
+                count=self.get_row_count(queryset)
+            )
+        objects = list(queryset)
+        return self.versioned_response(
+            request, objects,
+            lambda: Response(self.get_serializer(objects, many=True).data),
+            count=len(objects)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return self.versioned_response(
+            request, [instance],
+            lambda: Response(self.get_serializer(instance).data)
+        )
+
+
+class TimeseriesMixin(object):
+    "Parses the query parameters of the statistics/timeseries actions"
+    # Range of time series without a start parameter
+    timeseries_default_range = timedelta(days=30)
+
+    def parse_time(self, request, param):
+        value = request.query_params.get(param, None)
+        if not value:
+            return None
+        result = parse_datetime(value)
+        if result is None:
+            date = parse_date(value)
+            if date is None:
+                raise ValidationError({param: _('Expected an ISO 8601 date or datetime.')})
+            result = datetime(date.year, date.month, date.day)
+        # Naive times are in UTC, like the rollup buckets, unless time zones are disabled
+        if settings.USE_TZ and timezone.is_naive(result):
+            result = timezone.make_aware(result, timezone.utc)
+        elif not settings.USE_TZ and timezone.is_aware(result):
+            result = timezone.make_naive(result)
+        return result
+
+    def get_timeseries_options(self, request):
+        "Parse the query parameters start, end, and granularity for get_timeseries()"
+        granularity = request.query_params.get('granularity', ResponseRollup.GRANULARITIES.day)
+        if granularity not in ResponseRollup.GRANULARITIES:
+            raise ValidationError({'granularity': _('Choose one of %s.') % ', '.join(
+                value for value, label in ResponseRollup.GRANULARITIES
+            )})
+        end = self.parse_time(request, 'end')
+        start = self.parse_time(request, 'start') or (end or timezone.now()) - self.timeseries_default_range
+        return {'start': start, 'end': end, 'granularity': granularity}
+
+
+class NumPyUnavailable(APIException):
+    status_code = status.HTTP_501_NOT_IMPLEMENTED
+    default_detail = _('Agreement statistics require NumPy, which is not installed.')
+    default_code = 'numpy_unavailable'
+
+
+class AgreementMixin(object):
+    "Parses the query parameters of the statistics/agreement actions"
+
+    def get_agreement_options(self, request):
+        # NumPy is an optional dependency, see agreement.py
+        try:
+            agreement.require_numpy()
+        except ImproperlyConfigured:
+            raise NumPyUnavailable()
+        metric = request.query_params.get('metric', 'interval')
+        if metric not in METRICS:
+            raise ValidationError({'metric': _('Choose one of %s.') % ', '.join(METRICS)})
+        return {'metric': metric}
+
+
+class PromptSetViewSet(AgreementMixin, TimeseriesMixin, ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     "API for Prompt sets. Read-only"
-    queryset = PromptSet.objects.all()
+    # Prefetch sorted prompts (incl. their object types) once for all sets
+    # so that first_prompt, next_prompt_instance, and ordered_prompts don't query per set
+    queryset = PromptSet.objects.prefetch_related(
+        Prefetch('prompts', queryset=Prompt.objects.select_related('prompt_object_type', 'response_object_type'))
+    )
     serializer_class = PromptSetSerializer
     permission_classes = []
     lookup_field = 'name'
+    # Removing or reordering prompts doesn't change any modified timestamp, only the ETag
+    last_modified = False
+
+    def get_object_versions(self, obj):
+        "The serialized set also depends on the order and data of its prompts"
+        return [(obj.pk, obj.modified)] + [(prompt.pk, prompt.modified) for prompt in obj.prompts.all()]
 
     @detail_route(methods=['get'], url_name='statistics')
     def statistics(self, request, name=None):
         """
         Get statistics for each prompt in this promptset.
+        Supports the query parameters object_ids, response_object_ids, depth, and fields.
         See PromptSet.get_prompt_statistics for details.
         """
         promptset = self.get_object()
+        options = self.get_statistics_options(request)
+        data_version = promptset.get_data_version()
+        version = (
+            data_version['count'], data_version['max_id'], self.get_object_versions(promptset),
+            self.request.user.id if self.request.user.is_authenticated else None,
+            sorted(request.query_params.items()),
+        )
+        # Only an ETag, as deleted or archived responses don't change the latest timestamp
+        return self.conditional_response(
+            request, version, None, lambda: self._statistics_response(request, promptset, options)
+        )
+
+    @detail_route(methods=['get'], url_name='statistics-timeseries', url_path='statistics/timeseries')
+    def statistics_timeseries(self, request, name=None):
+        """
+        Get the response count and mean ratings of each prompt in this promptset over time.
+        Supports the query parameters start and end (ISO 8601 dates or datetimes, by default the last 30 days)
+        and granularity (hour or day). See PromptSet.get_timeseries for details.
+        """
+        promptset = self.get_object()
+        options = self.get_timeseries_options(request)
+        return Response(dict(options, prompts=promptset.get_timeseries(**options)))
+
+    @detail_route(methods=['get'], url_name='statistics-agreement', url_path='statistics/agreement')
+    def statistics_agreement(self, request, name=None):
+        """
+        Get the inter-rater agreement of each prompt in this promptset.
+        Supports the query parameter metric (nominal, ordinal, or interval). See Prompt.get_agreement for details.
+        """
+        promptset = self.get_object()
+        options = self.get_agreement_options(request)
+        return Response(dict(options, prompts=promptset.get_agreement(**options)))
+
+    def get_statistics_options(self, request):
+        "Parse query parameters that are passed to PromptSet.get_prompt_statistics"
+        options = {
+            'object_ids': request.query_params.get('object_ids', None),
+            'response_object_ids': request.query_params.get('response_object_ids', None),
+        }
+        depth = request.query_params.get('depth', None)
+        if depth:
+            if depth not in PromptSet.STATISTICS_DEPTHS:
+                raise ValidationError({'depth': _('Choose one of %s.') % ', '.join(PromptSet.STATISTICS_DEPTHS)})
+            options['depth'] = depth
+        fields = request.query_params.get('fields', None)
+        if fields:
+            options['fields'] = fields.split(',')
+            if not set(options['fields']).issubset(PromptSet.STATISTICS_FIELDS):
+                raise ValidationError({'fields': _('Choose from %s.') % ', '.join(PromptSet.STATISTICS_FIELDS)})
+        return options
+
+    def _statistics_response(self, request, promptset, options):
         context = {'request': request}
         series = []
         # get overall stats
         series.append({
             'name': 'all',
             'label': _('all'),
-            'prompt_data': promptset.get_prompt_statistics(
-                subset=None,
-                object_ids=request.query_params.get('object_ids', None),
-                response_object_ids=request.query_params.get('response_object_ids', None)
-            ),
+            'prompt_data': promptset.get_prompt_statistics(subset=None, **options),
         })
         # get stats for one user
         if self.request.user.is_authenticated:
@@ -45,8 +248,7 @@ class PromptSetViewSet(viewsets.ReadOnlyModelViewSet):
                 'prompt_data': promptset.get_prompt_statistics(
                     subset=None,
                     user_id=self.request.user.id,
-                    object_ids=request.query_params.get('object_ids', None),
-                    response_object_ids=request.query_params.get('response_object_ids', None)
+                    **options
                 ),
             })
         data = {
@@ -56,16 +258,21 @@ class PromptSetViewSet(viewsets.ReadOnlyModelViewSet):
         return Response(data)
 
 
-class PromptViewSet(viewsets.ReadOnlyModelViewSet):
+class PromptViewSet(AgreementMixin, TimeseriesMixin, ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     "API for Prompts. Read-only except create-response"
     queryset = Prompt.objects.all()
     serializer_class = PromptSerializer
+    # Set to FastPromptInstanceSerializer to render instances without DRF's field machinery
+    instance_serializer_class = PromptInstanceSerializer
     permission_classes = []
+    # A custom rating scale for instances and new responses, see Prompt.get_instance()
+    custom_scale = None
 
     def _instantiate(self, request, pk=None, promptset=None):
         prompt = self.get_object()
         try:
             instance = prompt.get_instance(
+                custom_scale=self.custom_scale,
                 promptset=promptset,
                 object_id=request.query_params.get('object_id', None),
                 response_object_ids=request.query_params.get('response_object_ids', None)
@@ -74,9 +281,73 @@ class PromptViewSet(viewsets.ReadOnlyModelViewSet):
             raise NotFound(_('The prompt object could not be found.'))
     
         context = {'request': request}
-        instance_serializer = PromptInstanceSerializer(instance, context=context)
+        instance_serializer = self.instance_serializer_class(instance, context=context)
         return Response(instance_serializer.data)
 
+    @detail_route(methods=['get'], url_name='statistics-timeseries', url_path='statistics/timeseries')
+    def statistics_timeseries(self, request, pk=None):
+        """
+        Get the response count and mean ratings of a prompt over time.
+        Supports the query parameters start, end, and granularity, see PromptSetViewSet.statistics_timeseries.
+        """
+        prompt = self.get_object()
+        options = self.get_timeseries_options(request)
+        return Response(dict(options, series=prompt.get_timeseries(**options)))
+
+    @detail_route(methods=['get'], url_name='statistics-agreement', url_path='statistics/agreement')
+    def statistics_agreement(self, request, pk=None):
+        """
+        Get the inter-rater agreement of a prompt.
+        Supports the query parameter metric, see PromptSetViewSet.statistics_agreement.
+        """
+        prompt = self.get_object()
+        return Response(prompt.get_agreement(**self.get_agreement_options(request)))
+
+    @detail_route(methods=['get'], url_name='top-response-objects', url_path='top-response-objects')
+    def top_response_objects(self, request, pk=None):
+        """
+        Get the top rated response objects of a prompt object.
+        Requires the query parameter object_id (of the prompt object) and supports
+        k (default 10, at most top_max_k), min_count (default 1), and rank_by (mean_rating or adjusted_rating).
+        See Prompt.get_top_response_objects for details.
+        Only tagging prompts with a prompt_object_type and a response_object_type have response objects.
+        """
+        prompt = self.get_object()
+        if prompt.type != Prompt.TYPES.tagging or not prompt.prompt_object_type or not prompt.response_object_type:
+            raise ValidationError({
+                'prompt': _('Only tagging prompts with prompt and response objects are supported.')
+            })
+        options = self.get_top_options(request)
+        object_id = request.query_params.get('object_id', None)
+        if not object_id:
+            raise ValidationError({'object_id': _('This parameter is required.')})
+        try:
+            prompt_object = prompt.get_object(object_id=object_id)
+        except (ObjectDoesNotExist, ValueError):
+            raise NotFound(_('The prompt object could not be found.'))
+        return Response(dict(
+            options, object_id=prompt_object.pk,
+            response_objects=prompt.get_top_response_objects(prompt_object, **options)
+        ))
+
+    top_max_k = 100
+
+    def get_top_options(self, request):
+        "Parse query parameters that are passed to Prompt.get_top_response_objects"
+        options = {'rank_by': request.query_params.get('rank_by', 'mean_rating')}
+        if options['rank_by'] not in Prompt.TOP_RANKINGS:
+            raise ValidationError({'rank_by': _('Choose one of %s.') % ', '.join(Prompt.TOP_RANKINGS)})
+        for param, default, minimum, maximum in (('k', 10, 1, self.top_max_k), ('min_count', 1, 1, None)):
+            try:
+                options[param] = int(request.query_params.get(param, default))
+            except ValueError:
+                raise ValidationError({param: _('Enter a whole number.')})
+            if options[param] < minimum:
+                raise ValidationError({param: _('Enter a number of at least %s.') % minimum})
+            if maximum is not None and options[param] > maximum:
+                raise ValidationError({param: _('Enter a number of at most %s.') % maximum})
+        return options
+
     @detail_route(methods=['get'], url_name='instantiate')
     def instantiate(self, request, pk=None):
         """Get a new instance for a prompt"""
@@ -98,9 +369,52 @@ class PromptViewSet(viewsets.ReadOnlyModelViewSet):
         data = {}
         data.update(**request.data)
         data['prompt'] = self.get_object().pk
-        context = {'request': request}
+        context = {'request': request, 'custom_scale': self.custom_scale}
         serializer = ResponseSerializer(data=data, context=context)
         serializer.is_valid(raise_exception=True)
         serializer.save()
         
         return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class ResponseViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    API for reading responses incl. their tags. Read-only.
+    Staff users can read all responses, other users only their own.
+    Results are ordered by (created, id) and paginated with a cursor,
+    so clients can continue from the last returned cursor to sync new responses.
+    Filter by comma-separated lists of ids with the query parameters
+    prompt, user, and object_id, or by the name of a promptset.
+    """
+    queryset = ResponseModel.objects.prefetch_related(
+        Prefetch('tags', queryset=Tag.objects.order_by('id'))
+    )
+    serializer_class = ResponseListSerializer
+    pagination_class = KeysetPagination
+    permission_classes = [IsAuthenticated]
+    filter_fields = (
+        ('prompt', 'prompt_id__in'),
+        ('user', 'user_id__in'),
+        ('object_id', 'object_id__in'),
+    )
+
+    def get_queryset(self):
+        queryset = super(ResponseViewSet, self).get_queryset()
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(user=self.request.user)
+        for param, lookup in self.filter_fields:
+            value = self.request.query_params.get(param, None)
+            if value:
+                try:
+                    queryset = queryset.filter(**{lookup: value.split(',')})
+                except ValueError:
+                    raise ValidationError({param: _('Expected a comma-separated list of ids.')})
+        promptset_name = self.request.query_params.get('promptset', None)
+        if promptset_name:
+            queryset = queryset.filter(prompt__promptset__name=promptset_name)
+        return queryset
+
+    @analytics
+    def list(self, request, *args, **kwargs):
+        "Responses are read from the analytics database, see routers.AnalyticsRouter"
+        return super(ResponseViewSet, self).list(request, *args, **kwargs)
@@ -57,6 +57,7 @@ setup(
     ],
     include_package_data=True,
     install_requires=["django-model-utils>=2.0","django-sortedm2m>=1.5",],
+    extras_require={"agreement": ["numpy"], "similarity": ["numpy"]},
     license="MIT",
     zip_safe=False,
     keywords='django-prompt-responses',
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-prompt-responses
+------------
+
+Tests for `django-prompt-responses` admin module.
+"""
+
+from django.test import TestCase, RequestFactory, override_settings
+from django.core.cache import cache
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.contrib.admin.sites import AdminSite
+from django.contrib.admin.utils import lookup_field
+from django.contrib.auth.models import Permission, User
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from prompt_responses import models
+from prompt_responses.admin import ResponseAdmin, TagAdmin, EstimatedCountPaginator, PromptAdmin, PromptSetAdmin
+from prompt_responses.summary import get_summary, refresh_summaries
+from .models import Book, Category
+
+
+class TestAdminChangelist(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='admin', email='admin@example.com', password='admin')
+        self.request = RequestFactory().get('/admin/')
+        self.request.user = self.user
+        self.site = AdminSite()
+        self.categories = [Category.objects.create(name="category %d" % idx) for idx in range(5)]
+        self.prompt = models.Prompt.create(
+            type=models.Prompt.TYPES.tagging,
+            text="Please rate the relevancy of the following categories for {object}.",
+            prompt_object_type=Book,
+            response_object_type=Category,
+            scale_max=5,
+        )
+
+    def add_responses(self, count):
+        for idx in range(count):
+            book = Book.objects.create(title="Book %d" % idx)
+            self.prompt.create_response(
+                user=self.user,
+                prompt_object=book,
+                tags=[(category, 1 + idx % 5) for category in self.categories]
+            )
+
+    def render_changelist(self, model_admin):
+        queryset = model_admin.get_queryset(self.request)
+        if model_admin.list_select_related:
+            queryset = queryset.select_related(*model_admin.list_select_related)
+        with CaptureQueriesContext(connection) as context:
+            rows = [
+                [lookup_field(name, obj, model_admin)[2] for name in model_admin.list_display]
+                for obj in queryset
+            ]
+        return rows, len(context.captured_queries)
+
+    def test_response_changelist_queries(self):
+        model_admin = ResponseAdmin(models.Response, self.site)
+        self.add_responses(2)
+        rows, small_count = self.render_changelist(model_admin)
+        self.assertEqual(len(rows), 2)
+        self.assertIn('Book 0', rows[0][3] + rows[1][3])
+        self.assertIn('category 4', rows[0][6])
+
+        self.add_responses(8)
+        rows, large_count = self.render_changelist(model_admin)
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(small_count, large_count)
+        # responses, tags, books, categories
+        self.assertLessEqual(large_count, 4)
+
+    def test_tag_changelist_queries(self):
+        model_admin = TagAdmin(models.Tag, self.site)
+        self.add_responses(4)
+        rows, count = self.render_changelist(model_admin)
+        self.assertEqual(len(rows), 20)
+        self.assertEqual(set(row[1] for row in rows), set(self.categories))
+        # tags, categories
+        self.assertEqual(count, 2)
+
+
+class TestEstimatedCountPaginator(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.categories = [Category.objects.create(name="category %d" % idx) for idx in range(5)]
+
+    def count(self, queryset):
+        paginator = EstimatedCountPaginator(queryset, 2)
+        with CaptureQueriesContext(connection) as context:
+            count = paginator.count
+        return count, len(context.captured_queries)
+
+    def test_exact_below_threshold(self):
+        self.assertEqual(self.count(Category.objects.order_by('id')), (5, 1))
+        Category.objects.create(name="category 5")
+        self.assertEqual(self.count(Category.objects.order_by('id')), (6, 1))
+
+    @override_settings(PROMPT_RESPONSES_ADMIN_EXACT_COUNT_THRESHOLD=3)
+    def test_cached_estimate(self):
+        self.assertEqual(self.count(Category.objects.order_by('id')), (5, 1))
+        Category.objects.create(name="category 5")
+        # The cached count is used until it expires
+        self.assertEqual(self.count(Category.objects.order_by('id')), (5, 0))
+        self.assertEqual(EstimatedCountPaginator(Category.objects.order_by('id'), 2).num_pages, 3)
+        cache.clear()
+        self.assertEqual(self.count(Category.objects.order_by('id')), (6, 1))
+
+    @override_settings(PROMPT_RESPONSES_ADMIN_EXACT_COUNT_THRESHOLD=3)
+    def test_filtered_exact(self):
+        self.count(Category.objects.order_by('id'))
+        queryset = Category.objects.filter(name__in=['category 1', 'category 2']).order_by('id')
+        self.assertEqual(self.count(queryset), (2, 1))
+        self.assertEqual(self.count(self.categories), (5, 0))
+
+
+class TestStatisticsAdmin(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser(username='admin', email='admin@example.com', password='admin')
+        self.client.force_login(self.user)
+        self.books = [Book.objects.create(title="Book %d" % idx) for idx in range(2)]
+        self.categories = [Category.objects.create(name="category %d" % idx) for idx in range(3)]
+        self.likert = models.Prompt.create(
+            type=models.Prompt.TYPES.likert,
+            text="How much do you like {object}?",
+            prompt_object_type=Book,
+            scale_max=5,
+        )
+        self.tagging = models.Prompt.create(
+            type=models.Prompt.TYPES.tagging,
+            text="Please rate the relevancy of the following categories for {object}.",
+            prompt_object_type=Book,
+            response_object_type=Category,
+        )
+        self.promptset = models.PromptSet.objects.create(name='set')
+        self.promptset.prompts.add(self.likert, self.tagging)
+        for idx, rating in enumerate([1, 2, 2, 5]):
+            user = User.objects.create_user(username='user%d' % idx)
+            self.likert.create_response(user=user, rating=rating, prompt_object=self.books[idx % 2])
+            self.tagging.create_response(user=user, prompt_object=self.books[0], tags=[
+                (category, rating) for category in self.categories
+            ])
+        self.likert.create_response(user=self.user, text="Not sure", prompt_object=self.books[0])
+
+    def test_prompt_summary(self):
+        summary = refresh_summaries([self.likert, self.tagging], background=False)
+        likert, tagging = [s['data'] for s in summary]
+        self.assertEqual(likert['response_count'], 5)
+        self.assertEqual(likert['user_count'], 5)
+        self.assertEqual(likert['rating_count'], 4)
+        self.assertEqual(likert['mean_rating'], 2.5)
+        self.assertEqual(likert['rating_histogram'], [(1, 1), (2, 2), (5, 1)])
+        self.assertNotIn('tag_count', likert)
+        self.assertEqual(tagging['tag_count'], 12)
+        self.assertEqual(tagging['mean_tag_rating'], 2.5)
+        self.assertEqual(tagging['tag_rating_histogram'], [(1, 3), (2, 6), (5, 3)])
+
+    def test_statistics_view_reads_summary(self):
+        url = '/admin/prompt_responses/prompt/%d/statistics/' % self.likert.pk
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'have not been computed yet')
+
+        refresh_summaries([self.likert], background=False)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertContains(response, 'Computed')
+        self.assertContains(response, '2.50')
+        self.assertFalse(any('prompt_responses_response' in q['sql'] for q in context.captured_queries))
+
+    def test_statistics_view_promptset(self):
+        refresh_summaries([self.promptset], background=False)
+        response = self.client.get('/admin/prompt_responses/promptset/%d/statistics/' % self.promptset.pk)
+        self.assertContains(response, self.likert.text)
+        self.assertContains(response, self.tagging.text)
+        self.assertContains(response, 'Tag ratings')
+
+    def test_refresh(self):
+        url = '/admin/prompt_responses/prompt/%d/statistics/' % self.likert.pk
+        with mock.patch('prompt_responses.summary.threading.Thread') as thread:
+            response = self.client.post(url)
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        self.assertTrue(thread.return_value.start.called)
+        self.assertEqual(get_summary(self.likert), {'computed': None, 'data': None, 'refreshing': True})
+        self.assertContains(self.client.get(url), 'A refresh is in progress')
+
+        # Run the background job in this thread
+        target = thread.call_args[1]['target']
+        with mock.patch('prompt_responses.summary.connections') as connections:
+            target(*thread.call_args[1]['args'])
+        self.assertTrue(connections.close_all.called)
+        summary = get_summary(self.likert)
+        self.assertFalse(summary['refreshing'])
+        self.assertEqual(summary['data']['mean_rating'], 2.5)
+
+    def test_refresh_failure(self):
+        with mock.patch('prompt_responses.summary.threading.Thread') as thread:
+            refresh_summaries([self.likert, self.tagging])
+        target = thread.call_args[1]['target']
+        with mock.patch('prompt_responses.summary.connections'):
+            with mock.patch('prompt_responses.summary.compute_prompt_summary', side_effect=RuntimeError):
+                with self.assertRaises(RuntimeError):
+                    target(*thread.call_args[1]['args'])
+        self.assertFalse(get_summary(self.likert)['refreshing'])
+        self.assertFalse(get_summary(self.tagging)['refreshing'])
+
+    def test_refresh_permission(self):
+        staff = User.objects.create_user(username='staff', password='staff', is_staff=True)
+        staff.user_permissions.add(Permission.objects.get(codename='view_prompt'))
+        self.client.force_login(staff)
+        url = '/admin/prompt_responses/prompt/%d/statistics/' % self.likert.pk
+        with mock.patch('prompt_responses.summary.threading.Thread') as thread:
+            self.assertEqual(403, self.client.post(url).status_code)
+            self.client.post('/admin/prompt_responses/prompt/', {
+                'action': 'refresh_statistics', '_selected_action': [self.likert.pk],
+            })
+        self.assertFalse(thread.called)
+        self.assertEqual(None, get_summary(self.likert))
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        self.assertNotContains(response, 'Refresh statistics')
+
+    def test_refresh_action(self):
+        with mock.patch('prompt_responses.summary.threading.Thread') as thread:
+            response = self.client.post('/admin/prompt_responses/prompt/', {
+                'action': 'refresh_statistics',
+                '_selected_action': [self.likert.pk, self.tagging.pk],
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            set(prompt.pk for prompt in thread.call_args[1]['args'][0]),
+            set([self.likert.pk, self.tagging.pk])
+        )
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-prompt-responses
+------------
+
+Tests for `django-prompt-responses` agreement module.
+"""
+from unittest import skipIf
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from rest_framework.test import APIRequestFactory
+
+from prompt_responses import agreement, models
+from prompt_responses.viewsets import PromptSetViewSet, PromptViewSet
+from .models import Book, Category
+
+
+# Reliability data from Krippendorff (2011), Computing Krippendorff's Alpha-Reliability:
+# the ratings of 12 units by 4 coders (None for missing ratings)
+RELIABILITY_DATA = [
+    [1, 2, 3, 3, 2, 1, 4, 1, 2, None, None, None],
+    [1, 2, 3, 3, 2, 2, 4, 1, 2, 5, None, 3],
+    [None, 3, 3, 3, 2, 3, 4, 2, 2, 5, 1, None],
+    [1, 2, 3, 3, 2, 4, 4, 1, 2, 5, 1, None],
+]
+
+
+@skipIf(numpy is None, 'Agreement statistics require NumPy')
+class TestAgreement(TestCase):
+
+    def setUp(self):
+        self.users = [User.objects.create_user(username='coder%d' % i) for i in range(len(RELIABILITY_DATA))]
+        self.books = [Book.objects.create(title='Book %d' % i) for i in range(len(RELIABILITY_DATA[0]))]
+        self.prompt = models.Prompt.create(
+            text="How do you like the book {object}?", prompt_object_type=Book, scale_min=1, scale_max=5
+        )
+        self.promptset = models.PromptSet.objects.create(name='agreement')
+        self.promptset.prompts.add(self.prompt)
+
+    def create_responses(self, prompt, **kwargs):
+        for user, ratings in zip(self.users, RELIABILITY_DATA):
+            for book, rating in zip(self.books, ratings):
+                if rating is not None:
+                    if prompt.type == models.Prompt.TYPES.tagging:
+                        prompt.create_response(user=user, prompt_object=book, tags=[(kwargs['category'], rating)])
+                    else:
+                        prompt.create_response(user=user, prompt_object=book, rating=rating)
+
+    def test_likert_agreement(self):
+        self.create_responses(self.prompt)
+        with self.assertNumQueries(1):
+            result = self.prompt.get_agreement()
+        self.assertEqual(11, result['unit_count'])
+        self.assertEqual(4, result['coder_count'])
+        self.assertEqual(40, result['rating_count'])
+        self.assertAlmostEqual(0.849, result['krippendorff_alpha'], places=3)
+        self.assertAlmostEqual(0.743, self.prompt.get_agreement(metric='nominal')['krippendorff_alpha'], places=3)
+        self.assertAlmostEqual(0.815, self.prompt.get_agreement(metric='ordinal')['krippendorff_alpha'], places=3)
+        self.assertTrue(0 < result['fleiss_kappa'] < 1)
+
+        # Only the latest rating of a user counts
+        self.prompt.create_response(user=self.users[0], prompt_object=self.books[0], rating=5)
+        self.assertLess(self.prompt.get_agreement()['krippendorff_alpha'], result['krippendorff_alpha'])
+        self.prompt.create_response(user=self.users[0], prompt_object=self.books[0], rating=1)
+        self.assertEqual(result, self.prompt.get_agreement())
+
+        with self.assertRaises(ValueError):
+            self.prompt.get_agreement(metric='ratio')
+
+    def test_perfect_agreement(self):
+        for user in self.users:
+            self.prompt.create_response(user=user, prompt_object=self.books[0], rating=3)
+            self.prompt.create_response(user=user, prompt_object=self.books[1], rating=5)
+        result = self.prompt.get_agreement()
+        self.assertEqual(1, result['krippendorff_alpha'])
+        self.assertEqual(1, result['fleiss_kappa'])
+
+    def test_undefined_agreement(self):
+        self.assertEqual({
+            'unit_count': 0, 'coder_count': 0, 'rating_count': 0,
+            'krippendorff_alpha': None, 'fleiss_kappa': None, 'metric': 'interval',
+        }, self.prompt.get_agreement())
+        # Without variation, no disagreement is expected
+        for user in self.users:
+            self.prompt.create_response(user=user, prompt_object=self.books[0], rating=3)
+        self.assertEqual(None, self.prompt.get_agreement()['krippendorff_alpha'])
+
+    def test_tagging_agreement(self):
+        self.create_responses(self.prompt)
+        likert = self.prompt.get_agreement()
+        category = Category.objects.create(name='crime')
+        for tag_storage in ('table', 'packed'):
+            prompt = models.Prompt.create(
+                type=models.Prompt.TYPES.tagging,
+                text="Please mark all categories that you think are related to {object}.",
+                prompt_object_type=Book, response_object_type=Category,
+                tag_storage=tag_storage,
+            )
+            self.create_responses(prompt, category=category)
+            self.assertEqual(likert, prompt.get_agreement())
+
+    def test_api(self):
+        self.create_responses(self.prompt)
+        api = APIRequestFactory()
+        view = PromptViewSet.as_view({'get': 'statistics_agreement'})
+        data = view(api.get('', {'metric': 'nominal'}), pk=self.prompt.pk).render().data
+        self.assertAlmostEqual(0.743, data['krippendorff_alpha'], places=3)
+        response = view(api.get('', {'metric': 'ratio'}), pk=self.prompt.pk).render()
+        self.assertEqual(400, response.status_code)
+
+        view = PromptSetViewSet.as_view({'get': 'statistics_agreement'})
+        data = view(api.get(''), name='agreement').render().data
+        self.assertEqual('interval', data['metric'])
+        self.assertEqual([self.prompt.pk], [prompt['prompt_id'] for prompt in data['prompts']])
+
+
+class TestAgreementWithoutNumPy(TestCase):
+
+    def test_api(self):
+        prompt = models.Prompt.create(text="How do you like the book {object}?", prompt_object_type=Book)
+        models.PromptSet.objects.create(name='agreement').prompts.add(prompt)
+        api = APIRequestFactory()
+        # NumPy is imported on first use, which fails if it isn't installed
+        with mock.patch('prompt_responses.agreement.np', None), mock.patch.dict('sys.modules', {'numpy': None}):
+            response = PromptViewSet.as_view({'get': 'statistics_agreement'})(api.get(''), pk=prompt.pk).render()
+            self.assertEqual(501, response.status_code)
+            self.assertIn('NumPy', response.data['detail'])
+            view = PromptSetViewSet.as_view({'get': 'statistics_agreement'})
+            response = view(api.get(''), name='agreement').render()
+            self.assertEqual(501, response.status_code)
@@ -8,17 +8,29 @@ test_django-prompt-responses
 Tests for `django-prompt-responses` Django Rest Framework compatability.
 """
 import json
+import time
 
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+try:
+    from unittest import mock
+except ImportError:
+    import mock
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.models import User
+from django.utils import timezone
+from django.utils.http import http_date
 
 from rest_framework.test import APIRequestFactory
 from rest_framework.test import force_authenticate
+from rest_framework.request import Request
 
-from prompt_responses.models import Prompt, PromptSet
+from prompt_responses.archive import archive_responses
+from prompt_responses.models import Prompt, PromptSet, Response
 from .models import Book, Category
-from prompt_responses.viewsets import PromptViewSet, PromptSetViewSet
+from prompt_responses.viewsets import PromptViewSet, PromptSetViewSet, ResponseViewSet
+from prompt_responses.serializers import PromptInstanceSerializer, FastPromptInstanceSerializer, PromptSerializer
 
 class TestPrompt_responses(TestCase):
 
@@ -72,6 +84,35 @@ class TestPrompt_responses(TestCase):
         # prompt3 called within prompt_set2 context should point to prompt4 as next_prompt
         self.assertEquals(data['next_prompt_instance'], 'http://testserver/api/prompts/%d/instantiate/my-other-prompts/' % prompt4.pk)
         
+    def test_prompt_set_list_queries(self):
+        view = PromptSetViewSet.as_view({'get': 'list'})
+
+        def count_list_queries():
+            request = self.api.get('')
+            with CaptureQueriesContext(connection) as context:
+                response = view(request).render()
+            self.assertEquals(200, response.status_code)
+            return len(context.captured_queries)
+
+        for idx in range(2):
+            prompt_set = PromptSet.objects.create(name='set-%d' % idx)
+            prompt_set.prompts.add(self.prompt, Prompt.create(text="Prompt %d" % idx))
+        queries_for_two = count_list_queries()
+
+        for idx in range(2, 6):
+            prompt_set = PromptSet.objects.create(name='set-%d' % idx)
+            prompt_set.prompts.add(Prompt.create(text="Prompt %d" % idx), self.prompt)
+        # Number of queries must not depend on the number of sets
+        self.assertEquals(queries_for_two, count_list_queries())
+
+        # Prefetched prompts keep their order
+        request = self.api.get('')
+        data = json.loads(view(request).render().content.decode('utf8'))
+        last_set = data[-1]
+        self.assertEquals(last_set['next_prompt']['text'], "Prompt 5")
+        self.assertEquals(len(last_set['ordered_prompts']), 2)
+        self.assertEquals(last_set['next_prompt']['prompt_object_type'], None)
+
     def test_get_prompt(self):
         request = self.api.get('')
         view = PromptViewSet.as_view({'get': 'retrieve'})
@@ -82,6 +123,202 @@ class TestPrompt_responses(TestCase):
         self.assertTrue('url' in data)
         self.assertTrue('instance_url' in data)
     
+    def test_conditional_get_prompt(self):
+        for actions, kwargs in (({'get': 'retrieve'}, {'pk': self.prompt.pk}), ({'get': 'list'}, {})):
+            view = PromptViewSet.as_view(actions)
+            response = view(self.api.get(''), **kwargs).render()
+            self.assertEquals(200, response.status_code)
+            etag = response['ETag']
+            # Lists have no Last-Modified, which wouldn't change when rows are deleted
+            self.assertEquals('pk' in kwargs, response.has_header('Last-Modified'))
+
+            # Matching ETag is answered without serialization
+            with mock.patch.object(PromptSerializer, 'to_representation') as to_representation:
+                response = view(self.api.get('', HTTP_IF_NONE_MATCH=etag), **kwargs)
+                self.assertEquals(304, response.status_code)
+                self.assertFalse(to_representation.called)
+
+            # Changes to the prompt change the ETag
+            self.prompt.text = "Did you read {object}?"
+            self.prompt.save()
+            response = view(self.api.get('', HTTP_IF_NONE_MATCH=etag), **kwargs).render()
+            self.assertEquals(200, response.status_code)
+            self.assertNotEquals(etag, response['ETag'])
+
+    def test_conditional_get_list_deletion(self):
+        other = Prompt.create(text="Another prompt")
+        view = PromptViewSet.as_view({'get': 'list'})
+        etag = view(self.api.get('')).render()['ETag']
+        other.delete()
+        response = view(self.api.get('', HTTP_IF_NONE_MATCH=etag)).render()
+        self.assertEquals(200, response.status_code)
+        self.assertEquals(1, len(response.data))
+
+    def test_conditional_get_prompt_set(self):
+        prompt_set = PromptSet.objects.create(name='my-prompts')
+        prompt_set.prompts.add(self.prompt)
+        view = PromptSetViewSet.as_view({'get': 'retrieve'})
+        etag = view(self.api.get(''), name='my-prompts').render()['ETag']
+        response = view(self.api.get('', HTTP_IF_NONE_MATCH=etag), name='my-prompts')
+        self.assertEquals(304, response.status_code)
+
+        # Adding a prompt to the set changes the ETag
+        prompt_set.prompts.add(Prompt.create(text="Another prompt"))
+        response = view(self.api.get('', HTTP_IF_NONE_MATCH=etag), name='my-prompts').render()
+        self.assertEquals(200, response.status_code)
+
+        # Statistics depend on the responses
+        view = PromptSetViewSet.as_view({'get': 'statistics'})
+        etag = view(self.api.get(''), name='my-prompts').render()['ETag']
+        response = view(self.api.get('', HTTP_IF_NONE_MATCH=etag), name='my-prompts')
+        self.assertEquals(304, response.status_code)
+        self.prompt.create_response(user=self.user, prompt_object=Book.objects.first(), rating=1)
+        response = view(self.api.get('', HTTP_IF_NONE_MATCH=etag), name='my-prompts').render()
+        self.assertEquals(200, response.status_code)
+        self.assertEquals(1, response.data['series'][0]['prompt_data'][0]['response_count'])
+
+    def test_conditional_get_prompt_set_prompts(self):
+        other = Prompt.create(text="Another prompt")
+        prompt_set = PromptSet.objects.create(name='my-prompts')
+        prompt_set.prompts.add(self.prompt, other)
+        view = PromptSetViewSet.as_view({'get': 'retrieve'})
+        response = view(self.api.get(''), name='my-prompts').render()
+        # Changes of the prompts don't change any modified timestamp, so there's only an ETag
+        self.assertFalse(response.has_header('Last-Modified'))
+        etag = response['ETag']
+        since = http_date(time.time() + 60)
+
+        # Reordering the prompts is not answered with 304 Not Modified
+        through = prompt_set.prompts.through.objects.filter(promptset=prompt_set)
+        through.filter(prompt=other).update(sort_value=-1)
+        response = view(self.api.get('', HTTP_IF_MODIFIED_SINCE=since), name='my-prompts')
+        self.assertEquals(200, response.render().status_code)
+        self.assertTrue(response.data['ordered_prompts'][0].endswith('/prompts/%d/' % other.pk))
+
+        # Neither is removing one
+        prompt_set.prompts.remove(other)
+        response = view(self.api.get('', HTTP_IF_MODIFIED_SINCE=since), name='my-prompts')
+        self.assertEquals(200, response.render().status_code)
+        self.assertEquals(1, len(response.data['ordered_prompts']))
+        self.assertNotEquals(etag, response['ETag'])
+
+    def test_conditional_get_statistics_deletion(self):
+        prompt_set = PromptSet.objects.create(name='my-prompts')
+        prompt_set.prompts.add(self.prompt)
+        book = Book.objects.first()
+        for rating in (1, 3):
+            self.prompt.create_response(user=self.user, prompt_object=book, rating=rating)
+        view = PromptSetViewSet.as_view({'get': 'statistics'})
+        response = view(self.api.get(''), name='my-prompts').render()
+        self.assertFalse(response.has_header('Last-Modified'))
+        since = http_date(time.time() + 60)
+
+        # Deleted or archived responses are not newer than the remaining ones
+        Response.objects.filter(prompt=self.prompt).order_by('id').first().delete()
+        response = view(self.api.get('', HTTP_IF_MODIFIED_SINCE=since), name='my-prompts').render()
+        self.assertEquals(200, response.status_code)
+        self.assertEquals(1, response.data['series'][0]['prompt_data'][0]['response_count'])
+        archive_responses(timezone.now())
+        response = view(self.api.get('', HTTP_IF_MODIFIED_SINCE=since), name='my-prompts').render()
+        self.assertEquals(200, response.status_code)
+
+    def test_statistics_depth(self):
+        prompt_set = PromptSet.objects.create(name='my-prompts')
+        prompt_set.prompts.add(self.prompt)
+        self.prompt.create_response(user=self.user, prompt_object=Book.objects.first(), rating=1)
+        view = PromptSetViewSet.as_view({'get': 'statistics'})
+
+        request = self.api.get('', {'depth': 'prompt', 'fields': 'mean_rating'})
+        data = view(request, name='my-prompts').render().data
+        self.assertEquals([{'prompt_id': self.prompt.pk, 'mean_rating': 1}], data['series'][0]['prompt_data'])
+
+        request = self.api.get('', {'depth': 'object'})
+        data = view(request, name='my-prompts').render().data
+        self.assertEquals(1, len(data['series'][0]['prompt_data'][0]['objects']))
+
+        request = self.api.get('', {'depth': 'prompt', 'fields': 'distribution'})
+        data = view(request, name='my-prompts').render().data
+        distribution = data['series'][0]['prompt_data'][0]['distribution']
+        self.assertEquals(1, distribution['median'])
+        self.assertEquals(1, sum(bucket['count'] for bucket in distribution['histogram']))
+
+        for params in ({'depth': 'deep'}, {'fields': 'mean_rating,median'}):
+            response = view(self.api.get('', params), name='my-prompts').render()
+            self.assertEquals(400, response.status_code)
+
+    def test_statistics_timeseries(self):
+        prompt_set = PromptSet.objects.create(name='my-prompts')
+        prompt_set.prompts.add(self.prompt)
+        self.prompt.create_response(user=self.user, prompt_object=Book.objects.first(), rating=4)
+        view = PromptSetViewSet.as_view({'get': 'statistics_timeseries'})
+
+        data = view(self.api.get('', {'granularity': 'hour'}), name='my-prompts').render().data
+        self.assertEquals('hour', data['granularity'])
+        series = data['prompts'][0]['series']
+        self.assertEquals(1, len(series))
+        self.assertEquals(4, series[0]['mean_rating'])
+
+        # Responses before the range are left out
+        data = view(self.api.get('', {'start': '2100-01-01'}), name='my-prompts').render().data
+        self.assertEquals([], data['prompts'][0]['series'])
+
+        for params in ({'granularity': 'week'}, {'start': 'yesterday'}):
+            response = view(self.api.get('', params), name='my-prompts').render()
+            self.assertEquals(400, response.status_code)
+
+        view = PromptViewSet.as_view({'get': 'statistics_timeseries'})
+        data = view(self.api.get('', {'end': '2000-01-01T00:00:00Z'}), pk=self.prompt.pk).render().data
+        self.assertEquals([], data['series'])
+        data = view(self.api.get(''), pk=self.prompt.pk).render().data
+        self.assertEquals(1, data['series'][0]['response_count'])
+
+    @override_settings(USE_TZ=False)
+    def test_statistics_timeseries_naive(self):
+        self.prompt.create_response(user=self.user, prompt_object=Book.objects.first(), rating=4)
+        view = PromptViewSet.as_view({'get': 'statistics_timeseries'})
+        for params in ({'start': '2000-01-01'}, {'start': '2000-01-01T00:00:00Z', 'end': '2100-01-01T00:00:00+02:00'}):
+            response = view(self.api.get('', params), pk=self.prompt.pk).render()
+            self.assertEquals(200, response.status_code)
+            self.assertEquals(1, response.data['series'][0]['response_count'])
+
+    def test_top_response_objects(self):
+        book = Book.objects.first()
+        crime = Category.objects.create(name="crime")
+        travel = Category.objects.create(name="travel")
+        prompt = Prompt.create(
+            type=Prompt.TYPES.tagging,
+            text="Please rate the relevancy of the following categories for {object}.",
+            prompt_object_type=Book,
+            response_object_type=Category
+        )
+        prompt.create_response(user=self.user, prompt_object=book, tags=[(crime, 1), (travel, -1)])
+        view = PromptViewSet.as_view({'get': 'top_response_objects'})
+
+        data = view(self.api.get('', {'object_id': book.pk}), pk=prompt.pk).render().data
+        self.assertEquals('mean_rating', data['rank_by'])
+        self.assertEquals(book.pk, data['object_id'])
+        self.assertEquals([crime.pk, travel.pk], [row['response_object_id'] for row in data['response_objects']])
+
+        request = self.api.get('', {'object_id': book.pk, 'k': 1, 'rank_by': 'adjusted_rating'})
+        data = view(request, pk=prompt.pk).render().data
+        self.assertEquals([crime.pk], [row['response_object_id'] for row in data['response_objects']])
+
+        for params in ({}, {'object_id': book.pk, 'k': 0}, {'object_id': book.pk, 'k': 1000},
+                       {'object_id': book.pk, 'min_count': 'many'}, {'object_id': book.pk, 'rank_by': 'tag_count'}):
+            response = view(self.api.get('', params), pk=prompt.pk).render()
+            self.assertEquals(400, response.status_code, params)
+        response = view(self.api.get('', {'object_id': 1000}), pk=prompt.pk).render()
+        self.assertEquals(404, response.status_code)
+
+        # Prompts without prompt objects or response objects have no top response objects
+        untyped = Prompt.create(
+            type=Prompt.TYPES.tagging, text="Which categories do you like?", response_object_type=Category
+        )
+        for other in (untyped, self.prompt):
+            response = view(self.api.get('', {'object_id': book.pk}), pk=other.pk).render()
+            self.assertEquals(400, response.status_code)
+            self.assertTrue('prompt' in response.data)
+
     def test_get_prompt_instance(self):
         request = self.api.get('')
         view = PromptViewSet.as_view({'get': 'instantiate'})
@@ -92,6 +329,41 @@ class TestPrompt_responses(TestCase):
         self.assertEquals(data['response_objects'], None)
         self.assertEquals(self.prompt.id, data['object']['id'])
 
+    def test_fast_prompt_instance_serializer(self):
+        Category.objects.create(name="crime")
+        Category.objects.create(name="thriller")
+        tagging_prompt = Prompt.create(
+            type=Prompt.TYPES.tagging,
+            text="Please rate the relevancy of the following categories for {object}.",
+            prompt_object_type=Book,
+            response_object_type=Category,
+            label="Categories",
+        )
+        prompt_set = PromptSet.objects.create(name='my-prompts')
+        prompt_set.prompts.add(tagging_prompt, self.prompt)
+
+        request = Request(self.api.get(''))
+        context = {'request': request}
+        instances = [
+            self.prompt.get_instance(),
+            tagging_prompt.get_instance(promptset=prompt_set),
+            self.prompt.get_instance(promptset=prompt_set),
+            Prompt.create(text="No objects").get_instance(),
+        ]
+        for instance in instances:
+            expected = json.loads(json.dumps(PromptInstanceSerializer(instance, context=context).data))
+            actual = json.loads(json.dumps(FastPromptInstanceSerializer(instance, context=context).data))
+            self.assertEquals(expected, actual)
+
+        # Can be chosen per view
+        view = PromptViewSet.as_view(
+            {'get': 'instantiate'}, instance_serializer_class=FastPromptInstanceSerializer
+        )
+        response = view(self.api.get(''), pk=self.prompt.pk).render()
+        data = json.loads(response.content.decode('utf8'))
+        self.assertEquals(data['display_text'], "How do you like the book Two Scoops of Django?")
+        self.assertEquals(data['prompt']['url'], 'http://testserver/api/prompts/%d/' % self.prompt.pk)
+
     def test_create_response(self):
         view = PromptViewSet.as_view({'post': 'create_response'})
         
@@ -126,6 +398,15 @@ class TestPrompt_responses(TestCase):
         self.assertEquals(201, response.status_code)
         self.assertEquals(prompt_instance.object.id, data['object_id'])
         self.assertEquals(1, data['rating'])
+
+    def test_create_response_custom_scale(self):
+        view = PromptViewSet.as_view({'post': 'create_response'}, custom_scale=[(-1, 'no'), (0, 'maybe'), (1, 'yes')])
+        book = Book.objects.first()
+        for rating, status_code in ((-1, 201), (0, 201), (5, 400)):
+            request = self.api.post('', {'rating': rating, 'object_id': book.pk}, format='json')
+            force_authenticate(request, user=self.user)
+            response = view(request, pk=self.prompt.pk).render()
+            self.assertEquals(status_code, response.status_code)
         
     def test_create_tagging_response(self):
         view = PromptViewSet.as_view({'post': 'create_response'})
@@ -155,5 +436,70 @@ class TestPrompt_responses(TestCase):
         self.assertEquals(5, data['tags'][0]['rating'])
 
 
+    def test_list_responses(self):
+        view = ResponseViewSet.as_view({'get': 'list'})
+        book = Book.objects.first()
+        other_user = User.objects.create_user(username='bob')
+        staff = User.objects.create_user(username='carol', is_staff=True)
+        prompt = Prompt.create(
+            type=Prompt.TYPES.tagging,
+            text="Please rate the relevancy of the following categories for {object}.",
+            prompt_object_type=Book,
+            response_object_type=Category
+        )
+        category = Category.objects.create(name="crime")
+        for idx in range(5):
+            self.prompt.create_response(user=self.user, prompt_object=book, rating=idx)
+            self.prompt.create_response(user=other_user, prompt_object=book, rating=idx)
+        prompt.create_response(user=self.user, prompt_object=book, tags=[(category, 1)])
+        # Responses with identical timestamps are still paginated correctly
+        Response.objects.filter(rating__in=[1, 2, 3]).update(created=Response.objects.first().created)
+
+        def get(auth_user, **params):
+            request = self.api.get('/api/responses/', params)
+            force_authenticate(request, user=auth_user)
+            response = view(request).render()
+            return response.status_code, json.loads(response.content.decode('utf8'))
+
+        self.assertEquals(401, get(None)[0])
+
+        # Users only see their own responses
+        status, data = get(self.user)
+        self.assertEquals(6, len(data['results']))
+        self.assertEquals(1, data['results'][-1]['tags'][0]['rating'])
+
+        # Walk through all pages with the cursor
+        seen = []
+        params = {'page_size': 3}
+        with CaptureQueriesContext(connection) as context:
+            while True:
+                status, data = get(staff, **params)
+                self.assertEquals(200, status)
+                seen.extend(item['id'] for item in data['results'])
+                params['cursor'] = data['cursor']
+                if not data['next']:
+                    break
+        expected = list(Response.objects.order_by('created', 'id').values_list('id', flat=True))
+        self.assertEquals(expected, seen)
+        # One query for responses and one for tags per page
+        self.assertEquals(4 * 2, len(context.captured_queries))
+
+        # Incremental sync continues from the last cursor
+        new_response = self.prompt.create_response(user=self.user, prompt_object=book, rating=1)
+        status, data = get(staff, cursor=params['cursor'])
+        self.assertEquals([new_response.pk], [item['id'] for item in data['results']])
+
+        # Filters
+        status, data = get(staff, prompt=prompt.pk)
+        self.assertEquals(1, len(data['results']))
+        status, data = get(staff, user='%d,%d' % (self.user.pk, staff.pk), object_id=book.pk)
+        self.assertEquals(7, len(data['results']))
+        prompt_set = PromptSet.objects.create(name='my-prompts')
+        prompt_set.prompts.add(prompt)
+        status, data = get(staff, promptset='my-prompts')
+        self.assertEquals(1, len(data['results']))
+        self.assertEquals(400, get(staff, user='alice')[0])
+        self.assertEquals(404, get(staff, cursor='invalid')[0])
+
     def tearDown(self):
         pass
@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-prompt-responses
+------------
+
+Tests for `django-prompt-responses` archive module and archive_responses command.
+"""
+
+from datetime import datetime, timedelta
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Max
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.utils.six import StringIO
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from benchmarks.data import generate
+from prompt_responses import models
+from prompt_responses import archive
+from prompt_responses.archive import archive_responses
+from prompt_responses.summary import compute_prompt_summary
+from .models import Book, Category
+
+
+def normalize(statistics):
+    "Round means and sort objects, which may be in a different order after archival"
+    if isinstance(statistics, list):
+        items = [normalize(item) for item in statistics]
+        return sorted(items, key=lambda item: (
+            item.get('object_id'), item.get('response_object_id'), item.get('prompt_id')
+        ))
+    result = {}
+    for key, value in statistics.items():
+        if isinstance(value, float):
+            value = round(value, 10)
+        elif isinstance(value, list):
+            value = normalize(value)
+        result[key] = value
+    return result
+
+
+class TestArchive(TestCase):
+
+    def setUp(self):
+        data = generate(users=5, books=4, categories=4, prompts=2, responses=60, tags_per_response=2, seed=3)
+        self.promptset = data['promptset']
+        self.prompts = data['prompts']
+        # Like create_response(), keep one tag per user and response object in the user's latest response
+        keys = ('response__prompt', 'response__user', 'response__content_type', 'response__object_id',
+                'content_type', 'object_id')
+        for row in models.Tag.objects.order_by().values(*keys).annotate(tag_id=Max('id'), response_id=Max('response')):
+            models.Tag.objects.filter(pk=row['tag_id']).update(response=row['response_id'])
+            models.Tag.objects.filter(**dict((key, row[key]) for key in keys)).exclude(pk=row['tag_id']).delete()
+        self.cutoff = timezone.now() - timedelta(days=30)
+        # Make the older half of the responses older than the cutoff
+        for prompt in self.prompts:
+            ids = list(prompt.responses.order_by('id').values_list('id', flat=True)[:30])
+            models.Response.objects.filter(pk__in=ids).update(created=self.cutoff - timedelta(days=1))
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def get_totals(self):
+        totals = {}
+        for user_unique in (True, False):
+            for depth in models.PromptSet.STATISTICS_DEPTHS:
+                totals[('statistics', depth, user_unique)] = normalize(self.promptset.get_prompt_statistics(
+                    depth=depth, user_unique=user_unique,
+                    fields=models.PromptSet.DEFAULT_STATISTICS_FIELDS + models.PromptSet.SPREAD_STATISTICS_FIELDS,
+                ))
+            for prompt in self.prompts:
+                totals[('count', prompt.pk, user_unique)] = prompt.get_response_count(user_unique=user_unique)
+                mean = prompt.get_mean_rating(user_unique=user_unique)
+                totals[('mean', prompt.pk, user_unique)] = round(mean, 10) if mean is not None else None
+        return totals
+
+    def test_archive_preserves_totals(self):
+        before = self.get_totals()
+        tag_count = models.Tag.objects.filter(response__created__lt=self.cutoff).count()
+        remaining_tag_count = models.Tag.objects.count() - tag_count
+        result = archive_responses(self.cutoff, batch_size=7)
+        self.assertEqual(60, result['responses'])
+        self.assertEqual(tag_count, result['tags'])
+        self.assertEqual(60, models.Response.objects.count())
+        self.assertEqual(remaining_tag_count, models.Tag.objects.count())
+        self.assertTrue(models.ResponseAggregate.objects.exists())
+        self.assertTrue(models.TagAggregate.objects.exists())
+        self.assertEqual(before, self.get_totals())
+
+        # Archiving everything keeps the totals as well
+        archive_responses(timezone.now())
+        self.assertFalse(models.Response.objects.exists())
+        self.assertEqual(before, self.get_totals())
+
+    def test_archive_summary(self):
+        fields = ('response_count', 'rating_count', 'mean_rating', 'tag_count', 'mean_tag_rating')
+
+        def get_summaries():
+            summaries = [compute_prompt_summary(prompt) for prompt in self.prompts]
+            return [
+                dict((key, round(summary[key], 10) if isinstance(summary[key], float) else summary[key])
+                     for key in fields if key in summary)
+                for summary in summaries
+            ]
+
+        before = get_summaries()
+        archive_responses(timezone.now())
+        self.assertFalse(models.Response.objects.exists())
+        after = get_summaries()
+        self.assertEqual(before, after)
+        self.assertEqual(60, after[0]['response_count'])
+        self.assertIsNotNone(after[0]['mean_rating'])
+        self.assertIn('mean_tag_rating', after[1])
+
+    def test_rebuild_rollups(self):
+        likert = self.prompts[0]
+        models.ResponseRollup.rebuild(likert)
+        archive_responses(self.cutoff)
+        before = list(likert.rollups.order_by('granularity', 'bucket').values_list('bucket', 'response_count'))
+        self.assertTrue(before)
+        with self.assertRaises(ValueError):
+            models.ResponseRollup.rebuild(likert)
+
+        # The command keeps the rollups of the archived periods unless forced
+        stderr = StringIO()
+        call_command('rebuild_rollups', prompts=[likert.pk], stdout=StringIO(), stderr=stderr)
+        self.assertIn('Skipped prompt %d' % likert.pk, stderr.getvalue())
+        self.assertEqual(before, list(likert.rollups.order_by('granularity', 'bucket').values_list(
+            'bucket', 'response_count'
+        )))
+        call_command('rebuild_rollups', prompts=[likert.pk], force=True, stdout=StringIO())
+        self.assertEqual(30, sum(likert.rollups.filter(granularity='day').values_list('response_count', flat=True)))
+
+    def test_archive_packed_tags(self):
+        tagging = self.prompts[1]
+        packed = models.Prompt.objects.create(
+            type=models.Prompt.TYPES.tagging, text=tagging.text, scale_min=-1, scale_max=1,
+            prompt_object_type=tagging.prompt_object_type, response_object_type=tagging.response_object_type,
+            tag_storage=models.Prompt.TAG_STORAGES.packed,
+        )
+        self.promptset.prompts.add(packed)
+        self.prompts.append(packed)
+        for response in tagging.responses.order_by('id').prefetch_related('tags'):
+            tags = [(tag.object_id, tag.rating) for tag in response.tags.all()]
+            packed.create_response(
+                user=response.user, prompt_object=response.prompt_object, rating=response.rating, tags=tags or None
+            )
+        ids = list(packed.responses.order_by('id').values_list('id', flat=True)[:30])
+        models.Response.objects.filter(pk__in=ids).update(created=self.cutoff - timedelta(days=1))
+
+        before = self.get_totals()
+        result = archive_responses(self.cutoff)
+        self.assertEqual(90, result['responses'])
+        self.assertEqual(30, packed.responses.count())
+        self.assertTrue(packed.tag_aggregates.exists())
+        self.assertEqual(before, self.get_totals())
+
+    def replay_responses(self):
+        """
+        Replace the prompts with copies whose responses were created with create_response(),
+        which keeps each user's tags unique (unlike the generated data), with both tag storages
+        """
+        promptset = models.PromptSet.objects.create(name='replayed')
+        likert, tagging = self.prompts
+        copies = [(likert, 'table')] + [
+            (tagging, tag_storage) for tag_storage in ('table', 'packed')
+        ]
+        self.prompts = []
+        for prompt, tag_storage in copies:
+            copy = models.Prompt.objects.create(
+                type=prompt.type, text=prompt.text, scale_min=prompt.scale_min, scale_max=prompt.scale_max,
+                prompt_object_type=prompt.prompt_object_type, response_object_type=prompt.response_object_type,
+                tag_storage=tag_storage,
+            )
+            promptset.prompts.add(copy)
+            self.prompts.append(copy)
+            for response in prompt.responses.order_by('id').prefetch_related('tags'):
+                tags = [(tag.object_id, tag.rating) for tag in response.tags.all()]
+                copy.create_response(
+                    user=response.user, prompt_object=response.prompt_object, rating=response.rating, tags=tags or None
+                )
+            ids = list(copy.responses.order_by('id').values_list('id', flat=True)[:30])
+            models.Response.objects.filter(pk__in=ids).update(created=self.cutoff - timedelta(days=1))
+        models.Response.objects.filter(prompt__in=[likert, tagging]).delete()
+        self.promptset = promptset
+
+    def respond_again(self):
+        "Let each user respond to the prompts again, replacing some of their archived responses and tags"
+        books = list(Book.objects.order_by('id'))
+        categories = list(Category.objects.order_by('id'))
+        for i, user in enumerate(User.objects.order_by('id')):
+            book = books[i % len(books)]
+            self.prompts[0].create_response(user=user, prompt_object=book, rating=5)
+            for prompt in self.prompts[1:]:
+                prompt.create_response(user=user, prompt_object=book, tags=[
+                    (categories[i % len(categories)], 1), (categories[(i + 1) % len(categories)], -1),
+                ])
+
+    def test_respond_after_archive(self):
+        self.replay_responses()
+        # The totals if the users had responded before archival
+        with transaction.atomic():
+            self.respond_again()
+            expected = self.get_totals()
+            transaction.set_rollback(True)
+
+        archive_responses(self.cutoff)
+        self.assertEqual(90, models.Response.objects.count())
+        self.respond_again()
+        self.assertEqual(expected, self.get_totals())
+        # Archiving the new responses as well keeps the totals
+        archive_responses(timezone.now())
+        self.assertFalse(models.Response.objects.exists())
+        self.assertEqual(expected, self.get_totals())
+
+    def test_latest_archived_response(self):
+        user = User.objects.order_by('id')[0]
+        book = Book.objects.order_by('id')[0]
+        prompt = models.Prompt.create(text='How do you like {object}?', prompt_object_type=Book)
+        prompt.create_response(user=user, prompt_object=book, rating=1)
+        models.Response.objects.filter(prompt=prompt).update(created=self.cutoff - timedelta(days=1))
+        archive_responses(self.cutoff)
+        self.assertEqual(1, prompt.get_response_count())
+        self.assertEqual(1.0, prompt.get_mean_rating())
+
+        # The user's new response replaces the archived one
+        prompt.create_response(user=user, prompt_object=book, rating=5)
+        self.assertEqual(1, prompt.get_response_count())
+        self.assertEqual(5.0, prompt.get_mean_rating())
+        self.assertEqual(2, prompt.get_response_count(user_unique=False))
+        self.assertEqual(3.0, prompt.get_mean_rating(user_unique=False))
+        self.promptset.prompts.add(prompt)
+        statistics = self.promptset.get_prompt_statistics(depth='object')
+        statistics = [item for item in statistics if item['prompt_id'] == prompt.pk][0]
+        self.assertEqual(1, statistics['response_count'])
+        self.assertEqual(5.0, statistics['mean_rating'])
+
+    def post_tags(self, prompt, book, tags):
+        "Create a response with the CreateResponseView, which keeps the user's earlier tags"
+        data = {
+            'prompt': prompt.pk, 'content_type': ContentType.objects.get_for_model(Book).pk, 'object_id': book.pk,
+            'tags-TOTAL_FORMS': len(tags), 'tags-INITIAL_FORMS': 0,
+        }
+        for idx, (category, rating) in enumerate(tags):
+            data['tags-%d-content_type' % idx] = ContentType.objects.get_for_model(Category).pk
+            data['tags-%d-object_id' % idx] = category.pk
+            data['tags-%d-rating' % idx] = rating
+        self.assertEqual(302, self.client.post('/prompt/%d/' % prompt.pk, data).status_code)
+
+    def test_latest_archived_tags(self):
+        user = User.objects.order_by('id')[0]
+        book = Book.objects.order_by('id')[0]
+        categories = list(Category.objects.order_by('id'))
+        prompt = models.Prompt.create(
+            type=models.Prompt.TYPES.tagging, text='Which categories fit {object}?', scale_min=-1, scale_max=1,
+            prompt_object_type=Book, response_object_type=Category,
+        )
+        self.promptset.prompts.add(prompt)
+        self.client.force_login(user)
+        # The view only offers its custom scale, -1 and 0
+        for rating in (0, 0, -1):
+            self.post_tags(prompt, book, [(category, rating) for category in categories])
+        archive_responses(timezone.now())
+
+        # Only the user's latest tag of each category is kept
+        self.assertEqual(len(categories), models.ArchivedTag.objects.filter(prompt=prompt).count())
+
+        def get_statistics(user_unique):
+            statistics = self.promptset.get_prompt_statistics(depth='response_object', user_unique=user_unique)
+            statistics = [item for item in statistics if item['prompt_id'] == prompt.pk][0]
+            return dict(
+                (item['response_object_id'], (item['tag_count'], round(item['mean_rating'], 2)))
+                for item in statistics['objects'][0]['response_objects']
+            )
+
+        self.assertEqual((1, -1.0), get_statistics(True)[categories[0].pk])
+        self.assertEqual((3, -0.33), get_statistics(False)[categories[0].pk])
+        # A new tag replaces the archived one when only the latest tags count
+        self.post_tags(prompt, book, [(categories[0], 0)])
+        self.assertEqual((1, 0.0), get_statistics(True)[categories[0].pk])
+        self.assertEqual((1, -1.0), get_statistics(True)[categories[1].pk])
+        self.assertEqual((4, -0.25), get_statistics(False)[categories[0].pk])
+
+    def test_archive_files(self):
+        likert, tagging = self.prompts
+        archived = tagging.responses.filter(created__lt=self.cutoff).order_by('id').first()
+        tag_count = archived.tags.count()
+        path = os.path.join(self.tmpdir, 'responses-%Y-%m.jsonl.gz')
+
+        result = archive_responses(self.cutoff, output=path, batch_size=7)
+        filename = (self.cutoff - timedelta(days=1)).strftime(path)
+        self.assertEqual([filename], result['files'])
+        # Each batch is appended once it was committed, without leaving partial files
+        self.assertEqual([os.path.basename(filename)], os.listdir(self.tmpdir))
+        with gzip.open(filename, 'rb') as f:
+            lines = [json.loads(line.decode('utf-8')) for line in f]
+        self.assertEqual(60, len(lines))
+        line = [line for line in lines if line['id'] == archived.pk][0]
+        self.assertEqual(tagging.pk, line['prompt'])
+        self.assertEqual(archived.user_id, line['user'])
+        self.assertEqual(archived.object_id, line['object_id'])
+        self.assertEqual(tag_count, len(line['tags']))
+
+    def test_archive_files_rollback(self):
+        path = os.path.join(self.tmpdir, 'responses.jsonl.gz')
+        update = archive.update_archived_tags
+        calls = []
+
+        def fail_second_batch(ids):
+            calls.append(ids)
+            if len(calls) == 2:
+                raise RuntimeError('failed')
+            update(ids)
+
+        with mock.patch('prompt_responses.archive.update_archived_tags', fail_second_batch):
+            with self.assertRaises(RuntimeError):
+                archive_responses(self.cutoff, output=path, batch_size=10)
+        # Only the committed batch was written
+        self.assertEqual(['responses.jsonl.gz'], os.listdir(self.tmpdir))
+        with gzip.open(path, 'rb') as f:
+            self.assertEqual(calls[0], [json.loads(line.decode('utf-8'))['id'] for line in f])
+        self.assertEqual(110, models.Response.objects.count())
+
+    def test_user_filter_excludes_archive(self):
+        user_id = models.Response.objects.filter(created__gte=self.cutoff).values_list('user', flat=True)[0]
+        before = normalize(self.promptset.get_prompt_statistics(user_id=user_id))
+        archive_responses(self.cutoff)
+        live = normalize(self.promptset.get_prompt_statistics(user_id=user_id))
+        self.assertNotEqual(before, live)
+        self.assertTrue(all(prompt['response_count'] for prompt in live))
+
+    def test_command(self):
+        tag_count = models.Tag.objects.filter(response__created__lt=self.cutoff).count()
+        out = StringIO()
+        call_command('archive_responses', days=30, dry_run=True, discard=True, stdout=out)
+        self.assertIn('Would archive 60 responses with %d tags' % tag_count, out.getvalue())
+        self.assertEqual(120, models.Response.objects.count())
+
+        with self.assertRaises(CommandError):
+            call_command('archive_responses', days=30, stdout=out)
+        with self.assertRaises(CommandError):
+            call_command('archive_responses', discard=True, stdout=out)
+        with self.assertRaises(CommandError):
+            call_command('archive_responses', before='yesterday', discard=True, stdout=out)
+
+        out = StringIO()
+        path = os.path.join(self.tmpdir, 'archive.jsonl.gz')
+        call_command('archive_responses', before=self.cutoff.date().isoformat(), output=path, stdout=out)
+        self.assertIn('Archived 60 responses with %d tags' % tag_count, out.getvalue())
+        self.assertIn(path, out.getvalue())
+        self.assertEqual(60, models.Response.objects.count())
+
+    def test_command_naive_cutoff(self):
+        ids = list(models.Response.objects.filter(created__lt=self.cutoff).values_list('id', flat=True))
+        tag_count = models.Tag.objects.filter(response__in=ids).count()
+        out = StringIO()
+        with override_settings(USE_TZ=False):
+            models.Response.objects.filter(pk__in=ids).update(created=datetime(2000, 1, 1))
+            call_command('archive_responses', before='2000-01-02', discard=True, stdout=out)
+        self.assertIn('Archived 60 responses with %d tags' % tag_count, out.getvalue())
+        self.assertEqual(60, models.Response.objects.count())
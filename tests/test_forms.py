@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-prompt-responses
+------------
+
+Tests for `django-prompt-responses` forms module.
+"""
+
+from django.test import TestCase
+from django.core.cache import cache
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from prompt_responses import models
+from prompt_responses.forms import ResponseForm, ResponseTagsForm, RatingRadioSelect, get_scale_fragment_key
+from .models import Book, Category
+
+
+class TestForms(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        Book.objects.create(title="Two Scoops of Django")
+        self.categories = [Category.objects.create(name="category %d" % idx) for idx in range(20)]
+        self.prompt = models.Prompt.create(
+            type=models.Prompt.TYPES.tagging,
+            text="Please rate the relevancy of the following categories for {object}.",
+            prompt_object_type=Book,
+            response_object_type=Category,
+            scale_max=7,
+        )
+
+    def render_tags(self, instance, data=None):
+        initial = [{'content_type': models.ContentType.objects.get_for_model(obj), 'object_id': obj.pk}
+                   for obj in self.categories]
+        formset = ResponseTagsForm(data=data, initial=initial, form_kwargs={'prompt_instance': instance})
+        formset.extra = len(initial)
+        return [str(form['rating']) for form in formset]
+
+    def test_scale_fragment_cache(self):
+        instance = self.prompt.get_instance()
+        original_render = RatingRadioSelect._render
+        with mock.patch.object(RatingRadioSelect, '_render', autospec=True, side_effect=original_render) as render:
+            rendered = self.render_tags(instance)
+            # The scale is rendered once for all rows
+            self.assertEqual(1, render.call_count)
+            self.render_tags(instance)
+            self.assertEqual(1, render.call_count)
+
+        with mock.patch('prompt_responses.forms.get_scale_fragment_key', return_value=None):
+            expected = self.render_tags(instance)
+        self.assertEqual(expected, rendered)
+        self.assertIn('name="tags-19-rating"', rendered[19])
+        self.assertIn('id="id_tags-19-rating_6"', rendered[19])
+
+        # Selected values are rendered normally
+        data = {'tags-TOTAL_FORMS': 1, 'tags-INITIAL_FORMS': 0, 'tags-0-rating': 3}
+        self.assertIn(
+            'value="3" class="rating-input" id="id_tags-0-rating_2" checked', self.render_tags(instance, data)[0]
+        )
+
+        # Likert forms use another fragment, as their attributes differ
+        likert_prompt = models.Prompt.create(text="How do you like {object}?", prompt_object_type=Book, scale_max=7)
+        form = ResponseForm(prompt_instance=likert_prompt.get_instance())
+        self.assertIn('required', str(form['rating']))
+
+    def test_rating_validation(self):
+        instance = self.prompt.get_instance(custom_scale=[(-1, 'no'), (0, 'maybe'), (1, 'yes')])
+        data = {
+            'tags-TOTAL_FORMS': 2, 'tags-INITIAL_FORMS': 0,
+            'tags-0-content_type': models.ContentType.objects.get_for_model(Category).pk,
+            'tags-0-object_id': self.categories[0].pk,
+            'tags-0-rating': -1,
+            'tags-1-content_type': models.ContentType.objects.get_for_model(Category).pk,
+            'tags-1-object_id': self.categories[1].pk,
+            'tags-1-rating': 7,
+        }
+        formset = ResponseTagsForm(data=data, form_kwargs={'prompt_instance': instance})
+        self.assertFalse(formset.is_valid())
+        self.assertEqual(-1, formset.forms[0].cleaned_data['rating'])
+        self.assertIn('rating', formset.errors[1])
+
+    def test_scale_fragment_key(self):
+        key = get_scale_fragment_key(self.prompt)
+        self.assertEqual(key, get_scale_fragment_key(models.Prompt.objects.get(pk=self.prompt.pk)))
+
+        self.prompt.custom_scale = [(0, 'no'), (1, 'yes')]
+        custom_key = get_scale_fragment_key(self.prompt)
+        self.assertNotEqual(key, custom_key)
+
+        # Lambdas have no identity, so their fragments aren't cached
+        self.prompt.custom_scale = lambda prompt: [(0, 'no'), (1, 'yes')]
+        self.assertEqual(None, get_scale_fragment_key(self.prompt))
+
+        self.prompt.custom_scale = None
+        self.prompt.scale_max = 5
+        self.prompt.save()
+        self.assertNotEqual(key, get_scale_fragment_key(self.prompt))
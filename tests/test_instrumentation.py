@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-prompt-responses
+------------
+
+Tests for `django-prompt-responses` instrumentation module.
+"""
+
+from django.test import TestCase
+from django.contrib.auth.models import User
+
+from prompt_responses import models
+from prompt_responses.instrumentation import stage, stage_finished
+from .models import Book, Category
+
+
+class TestInstrumentation(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice')
+        Book.objects.create(title="Two Scoops of Django")
+        self.categories = [Category.objects.create(name="category %d" % idx) for idx in range(3)]
+        self.prompt = models.Prompt.create(
+            type=models.Prompt.TYPES.tagging,
+            text="Please rate the relevancy of the following categories for {object}.",
+            prompt_object_type=Book,
+            response_object_type=Category,
+        )
+        self.promptset = models.PromptSet.objects.create(name='set')
+        self.promptset.prompts.add(self.prompt)
+        self.stages = []
+        self.data = {}
+
+    def receiver(self, sender, stage, duration, queries, **kwargs):
+        self.stages.append((sender, stage, duration, queries))
+        self.data[stage] = kwargs
+
+    def record(self, func, sender=None):
+        stage_finished.connect(self.receiver, sender=sender)
+        try:
+            result = func()
+        finally:
+            stage_finished.disconnect(self.receiver, sender=sender)
+        return result
+
+    def test_stage(self):
+        with stage('test'):
+            User.objects.count()
+        self.assertEqual([], self.stages)
+
+        def run():
+            with stage('test'):
+                User.objects.count()
+                User.objects.count()
+        self.record(run)
+        sender, name, duration, queries = self.stages[0]
+        self.assertEqual('test', name)
+        self.assertGreaterEqual(duration, 0)
+        self.assertEqual(2, queries)
+
+    def test_stage_exception(self):
+        def run():
+            with stage('test'):
+                raise ValueError()
+        with self.assertRaises(ValueError):
+            self.record(run)
+        self.assertEqual([], self.stages)
+
+    def test_instrumented_methods(self):
+        instance = self.record(self.prompt.get_instance, sender=models.Prompt)
+        self.record(lambda: self.prompt.create_response(
+            user=self.user, prompt_object=instance.object, tags=[(category, 1) for category in self.categories]
+        ), sender=models.Prompt)
+        self.record(self.promptset.get_prompt_statistics, sender=models.PromptSet)
+        self.assertEqual([
+            'get_instance.object',
+            'get_instance.response_objects',
+            'get_instance',
+            'create_response.validation',
+            'create_response.response',
+            'create_response.tags',
+            'create_response.rollups',
+            'create_response',
+            'get_prompt_statistics.archived',
+            'get_prompt_statistics.tag_matrix',
+            'get_prompt_statistics.tag_response_counts',
+            'get_prompt_statistics.response_matrix',
+            'get_prompt_statistics.assembly',
+            'get_prompt_statistics',
+        ], [name for sender, name, duration, queries in self.stages])
+        queries = dict((name, queries) for sender, name, duration, queries in self.stages)
+        self.assertEqual(1, queries['create_response.response'])
+        self.assertEqual(1, queries['get_prompt_statistics.tag_matrix'])
+        self.assertEqual(0, queries['get_prompt_statistics.assembly'])
+        self.assertEqual(3, self.data['create_response.tags']['inserted'])
+        self.assertEqual(0, self.data['create_response.tags']['updated'])
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-prompt-responses
+------------
+
+Tests for `django-prompt-responses` metrics module.
+"""
+
+import gc
+import threading
+
+from django.test import TestCase, RequestFactory, override_settings
+from django.contrib.auth.models import User, AnonymousUser
+from django.core.exceptions import PermissionDenied
+
+from prompt_responses import metrics, models
+from prompt_responses.scales import scale_cache
+from prompt_responses.views import metrics_view
+from .models import Book, Category
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        metrics.enable()
+        scale_cache.clear()
+        self.user = User.objects.create_user(username='alice')
+        self.book = Book.objects.create(title="Two Scoops of Django")
+        self.categories = [Category.objects.create(name="category %d" % idx) for idx in range(3)]
+        self.prompt = models.Prompt.create(
+            type=models.Prompt.TYPES.tagging,
+            text="Please rate the relevancy of the following categories for {object}.",
+            prompt_object_type=Book,
+            response_object_type=Category,
+            scale_max=5,
+        )
+
+    def tearDown(self):
+        metrics.disable()
+        metrics.registry.reset()
+
+    def test_counter_threads(self):
+        counter = metrics.Counter('test_total', 'Test.', ['thread'])
+        counter.enabled = True
+
+        def work():
+            for _ in range(1000):
+                counter.inc(thread='any')
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(8000, counter.get(thread='any'))
+        self.assertEqual(['test_total{thread="any"} 8000.0'], counter.render())
+
+    def test_ended_threads(self):
+        histogram = metrics.Histogram('test_seconds', 'Test.', buckets=(1,))
+        histogram.enabled = True
+        for _ in range(20):
+            thread = threading.Thread(target=histogram.observe, args=(.5,))
+            thread.start()
+            thread.join()
+        gc.collect()
+        # The shards of ended threads are merged, so they don't accumulate
+        self.assertEqual(1, len(histogram._all_shards()))
+        self.assertEqual(20, histogram.get_count())
+        histogram.observe(2)
+        self.assertEqual(21, histogram.get_count())
+        self.assertEqual('test_seconds_sum 12.0', histogram.render()[-2])
+
+    def test_disabled(self):
+        metrics.disable()
+        self.prompt.create_response(user=self.user, prompt_object=self.book, tags=[(self.categories[0], 1)])
+        self.assertEqual(0, metrics.responses_created.get(prompt=self.prompt.pk))
+        self.assertEqual(0, metrics.tag_upserts.get(operation='insert'))
+
+    def test_histogram(self):
+        histogram = metrics.Histogram('test_seconds', 'Test.', buckets=(.1, 1))
+        histogram.enabled = True
+        for value in (.05, .5, .5, 5):
+            histogram.observe(value)
+        self.assertEqual([
+            'test_seconds_bucket{le="0.1"} 1.0',
+            'test_seconds_bucket{le="1.0"} 3.0',
+            'test_seconds_bucket{le="+Inf"} 4.0',
+            'test_seconds_sum 6.05',
+            'test_seconds_count 4.0',
+        ], histogram.render())
+
+    def test_hot_paths(self):
+        self.prompt.get_instance()
+        self.prompt.create_response(user=self.user, prompt_object=self.book, tags=[
+            (category, 1) for category in self.categories
+        ])
+        self.prompt.create_response(user=self.user, prompt_object=self.book, tags=[(self.categories[0], 2)])
+
+        self.assertEqual(2, metrics.responses_created.get(prompt=self.prompt.pk))
+        self.assertEqual(3, metrics.tag_upserts.get(operation='insert'))
+        self.assertEqual(1, metrics.tag_upserts.get(operation='update'))
+        self.assertEqual(1, metrics.stage_duration.get_count(stage='get_instance'))
+        self.assertEqual(2, metrics.stage_duration.get_count(stage='create_response.tags'))
+        self.assertEqual(1, metrics.cache_requests.get(cache='scale', result='miss'))
+        self.assertEqual(1, metrics.cache_requests.get(cache='scale', result='hit'))
+
+    def test_view(self):
+        self.prompt.create_response(user=self.user, prompt_object=self.book, tags=[(self.categories[0], 1)])
+        request = RequestFactory().get('/metrics/')
+        request.user = AnonymousUser()
+        with self.assertRaises(PermissionDenied):
+            metrics_view(request)
+
+        request.user = User.objects.create_user(username='staff', is_staff=True)
+        response = metrics_view(request)
+        content = response.content.decode('utf8')
+        self.assertIn('# TYPE prompt_responses_responses_created_total counter', content)
+        self.assertIn('prompt_responses_responses_created_total{prompt="%d"} 1.0' % self.prompt.pk, content)
+        self.assertIn('prompt_responses_stage_duration_seconds_count{stage="create_response"} 1.0', content)
+
+        request.user = AnonymousUser()
+        with override_settings(INTERNAL_IPS=['127.0.0.1']):
+            self.assertEqual(200, metrics_view(request).status_code)
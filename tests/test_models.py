@@ -9,11 +9,22 @@ Tests for `django-prompt-responses` models module.
 """
 
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+try:
+    from unittest import mock
+except ImportError:
+    import mock
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+from django.utils.six import StringIO
+from django.core.management import call_command
+from datetime import datetime, timedelta
 
 from prompt_responses import models
+from prompt_responses.scales import get_scale_identity
 from .models import Book, Category
 
 
@@ -104,6 +115,59 @@ class TestPrompt_responses(TestCase):
             rating=10
         )
 
+    def test_scale(self):
+        prompt = models.Prompt.create(
+            text="How do you like the weather today?",
+            scale_max=5
+        )
+        scale = prompt.get_scale()
+        self.assertEqual([(i, str(i)) for i in range(1, 6)], scale)
+        self.assertTrue(5 in scale)
+        self.assertFalse(6 in scale)
+        self.assertEqual(hash(scale), hash(models.Prompt.objects.get(pk=prompt.pk).get_scale()))
+        with self.assertRaises(AttributeError):
+            scale.values = frozenset()
+
+        # Memoized per prompt until it is modified
+        self.assertIs(scale, models.Prompt.objects.get(pk=prompt.pk).get_scale())
+        prompt.scale_max = 3
+        prompt.save()
+        self.assertEqual(3, len(prompt.get_scale()))
+
+        # Custom scales are only generated once
+        custom_scale = mock.Mock(return_value=[(-1, 'no'), (1, 'yes')])
+        custom_scale.scale_key = 'yes-no'
+        instance = prompt.get_instance(custom_scale=custom_scale)
+        self.assertEqual([(-1, 'no'), (1, 'yes')], instance.scale)
+        self.assertEqual([(-1, 'no'), (1, 'yes')], prompt.get_instance(custom_scale=custom_scale).scale)
+        self.assertEqual(1, custom_scale.call_count)
+        # The prompt itself keeps its scale
+        self.assertEqual(None, prompt.custom_scale)
+        self.assertEqual(3, len(prompt.get_scale()))
+
+        # Lambdas and closures can't be told apart by name, so their scales aren't memoized
+        scales = [lambda prompt, high=high: [(i, str(i)) for i in range(high)] for high in (2, 4)]
+        self.assertEqual([None, None], [get_scale_identity(scale) for scale in scales])
+        self.assertEqual(2, len(prompt.get_instance(custom_scale=scales[0]).scale))
+        self.assertEqual(4, len(prompt.get_instance(custom_scale=scales[1]).scale))
+        prompt.custom_scale = scales[1]
+        prompt.create_response(user=self.user, rating=3)
+        prompt.custom_scale = None
+        self.assertTrue(get_scale_identity(prompt.generate_scale).endswith('Prompt.generate_scale'))
+
+        # Ratings are validated against the scale
+        with self.assertRaises(ValidationError):
+            prompt.create_response(user=self.user, rating=4)
+        prompt.create_response(user=self.user, rating=3)
+
+        # or against the custom scale of an instance
+        instance = prompt.get_instance(custom_scale=[(-1, 'no'), (0, 'maybe'), (1, 'yes')])
+        self.assertEqual(-1, instance.create_response(user=self.user, rating=-1).rating)
+        response = prompt.create_response(user=self.user, rating=0, custom_scale=instance.custom_scale)
+        self.assertEqual(0, response.rating)
+        with self.assertRaises(ValidationError):
+            instance.create_response(user=self.user, rating=3)
+
     def test_user_unique(self):
         prompt = models.Prompt.create(
             text="Was {object} a good read?",
@@ -235,6 +299,39 @@ class TestPrompt_responses(TestCase):
         for (index, rating) in enumerate([-1, 1, 0]):
             self.assertEqual(rating, prompt.get_mean_tag_rating(instance.object, instance.response_objects[index]))
 
+    def test_tagging_response_queries(self):
+        categories = [Category.objects.create(name="category %d" % idx) for idx in range(10)]
+        prompt = models.Prompt.create(
+            type=models.Prompt.TYPES.tagging,
+            text="Please mark all categories that you think are related to {object}.",
+            prompt_object_type=Book,
+            response_object_type=Category
+        )
+        book = Book.objects.get()
+
+        def count_queries(tags):
+            with CaptureQueriesContext(connection) as context:
+                prompt.create_response(user=self.user, prompt_object=book, tags=tags)
+            return len(context.captured_queries)
+
+        # Create the rollup buckets first, so that all responses only update them
+        models.ResponseRollup.add(prompt.pk, timezone.now(), response_count=0)
+
+        # The number of queries doesn't grow with the number of tags
+        few = count_queries([{'object_id': obj.pk, 'rating': 1} for obj in categories[:2]])
+        many = count_queries([{'object_id': obj.pk, 'rating': 1} for obj in categories[2:]])
+        self.assertEqual(few, many)
+        self.assertEqual(10, models.Tag.objects.count())
+
+        # Updating tags takes one query per distinct rating
+        updated = count_queries([(obj, -1) for obj in categories])
+        self.assertLessEqual(updated, few)
+        self.assertEqual(10, models.Tag.objects.filter(rating=-1).count())
+        self.assertEqual(10, models.Response.objects.last().tags.count())
+
+        with self.assertRaises(Category.DoesNotExist):
+            prompt.create_response(user=self.user, prompt_object=book, tags=[{'object_id': 999, 'rating': 1}])
+
     def test_model_type_checks(self):
         Book.objects.create(title="Two Scoops of Django")
         Category.objects.create(name="crime")
@@ -347,6 +444,372 @@ class TestPrompt_responses(TestCase):
         }
         self.assertEqual(expected, prompt.get_mean_tag_rating_matrix())
 
+    def test_prompt_statistics_depth(self):
+        book1 = Book.objects.get()
+        book2 = Book.objects.create(title="Another book")
+        crime = Category.objects.create(name="crime")
+        travel = Category.objects.create(name="travel")
+        tagging_prompt = models.Prompt.create(
+            type=models.Prompt.TYPES.tagging,
+            text="Please mark all categories that you think are related to {object}.",
+            prompt_object_type=Book,
+            response_object_type=Category
+        )
+        likert_prompt = models.Prompt.create(
+            text="How do you like the book {object}?",
+            prompt_object_type=Book
+        )
+        prompt_set = models.PromptSet.objects.create(name='book-rating')
+        prompt_set.prompts.add(tagging_prompt, likert_prompt)
+        tagging_prompt.create_response(user=self.user, prompt_object=book1, tags=[(crime, 1), (travel, -1)])
+        tagging_prompt.create_response(user=self.user2, prompt_object=book1, tags=[(crime, 1)])
+        tagging_prompt.create_response(user=self.user2, prompt_object=book2, tags=[(travel, 0)])
+        likert_prompt.create_response(user=self.user, prompt_object=book1, rating=1)
+        likert_prompt.create_response(user=self.user2, prompt_object=book2, rating=-1)
+
+        stats = prompt_set.get_prompt_statistics()
+        tagging_stats, likert_stats = stats
+        self.assertEqual(3, tagging_stats['response_count'])
+        self.assertEqual(4, tagging_stats['tag_count'])
+        self.assertEqual(0.25, tagging_stats['mean_rating'])
+        book1_stats = [obj for obj in tagging_stats['objects'] if obj['object_id'] == book1.pk][0]
+        self.assertEqual(2, book1_stats['response_count'])
+        self.assertEqual(2, len(book1_stats['response_objects']))
+        self.assertEqual(2, likert_stats['response_count'])
+        self.assertEqual(0, likert_stats['mean_rating'])
+
+        # Only the user's responses
+        user_stats = prompt_set.get_prompt_statistics(user_id=self.user2.pk)
+        self.assertEqual(2, user_stats[0]['response_count'])
+        self.assertEqual(-1, user_stats[1]['mean_rating'])
+
+        # Object depth drops response objects
+        object_stats = prompt_set.get_prompt_statistics(depth='object')
+        self.assertEqual(
+            [{k: v for k, v in obj.items() if k != 'response_objects'} for obj in tagging_stats['objects']],
+            object_stats[0]['objects']
+        )
+
+        # Prompt depth has the same totals without objects, and skips the object-level queries
+        # (two of them for archived responses)
+        with self.assertNumQueries(6):
+            prompt_stats = prompt_set.get_prompt_statistics(depth='prompt')
+        for full, totals in zip(stats, prompt_stats):
+            self.assertFalse('objects' in totals)
+            self.assertEqual(full['response_count'], totals['response_count'])
+            self.assertEqual(full['mean_rating'], totals['mean_rating'])
+
+        # Without response counts, the count query is skipped
+        with self.assertNumQueries(5):
+            mean_stats = prompt_set.get_prompt_statistics(depth='prompt', fields=['mean_rating'])
+        self.assertEqual(
+            [{'prompt_id': tagging_prompt.pk, 'mean_rating': 0.25}, {'prompt_id': likert_prompt.pk, 'mean_rating': 0}],
+            mean_stats
+        )
+
+        with self.assertRaises(ValueError):
+            prompt_set.get_prompt_statistics(depth='tag')
+
+    def test_packed_tags(self):
+        book1 = Book.objects.get()
+        book2 = Book.objects.create(title="Another book")
+        crime = Category.objects.create(name="crime")
+        travel = Category.objects.create(name="travel")
+        prompt_set = models.PromptSet.objects.create(name='book-tagging')
+        prompts = {}
+        for tag_storage in ('table', 'packed'):
+            prompts[tag_storage] = models.Prompt.create(
+                type=models.Prompt.TYPES.tagging,
+                text="Please mark all categories that you think are related to {object}.",
+                prompt_object_type=Book,
+                response_object_type=Category,
+                tag_storage=tag_storage,
+            )
+            prompt = prompts[tag_storage]
+            prompt.create_response(user=self.user, prompt_object=book1, tags=[(crime, 1), (travel, -1)])
+            prompt.create_response(user=self.user2, prompt_object=book1, tags=[(crime.pk, 1)])
+            prompt.create_response(user=self.user2, prompt_object=book2, tags=[{'object_id': travel.pk, 'rating': 0}])
+            # Tagging again replaces the user's earlier tag of the response object
+            prompt.create_response(user=self.user, prompt_object=book1, tags=[(travel, 0)])
+        prompt_set.prompts.add(prompts['table'], prompts['packed'])
+        table, packed = prompts['table'], prompts['packed']
+        self.assertEqual(0, models.Tag.objects.filter(response__prompt=packed).count())
+
+        response = packed.responses.order_by('id').first()
+        self.assertEqual([(crime.pk, 1)], [(tag.object_id, tag.rating) for tag in response.tag_list])
+        self.assertEqual(table.get_mean_tag_rating_matrix(), packed.get_mean_tag_rating_matrix())
+        self.assertEqual(
+            list(table.get_mean_tag_ratings(book1).order_by('response_object_id')),
+            sorted(packed.get_mean_tag_ratings(book1), key=lambda row: row['response_object_id'])
+        )
+        self.assertEqual(table.get_mean_tag_rating(book1, travel), packed.get_mean_tag_rating(book1, travel))
+
+        for kwargs in ({}, {'user_unique': False}, {'user_id': self.user.pk}, {'response_object_ids': str(crime.pk)}):
+            table_stats, packed_stats = prompt_set.get_prompt_statistics(**kwargs)
+            for stats in (table_stats, packed_stats):
+                del stats['prompt_id']
+                stats['objects'].sort(key=lambda obj: obj['object_id'])
+                for obj in stats['objects']:
+                    obj['response_objects'].sort(key=lambda obj: obj['response_object_id'])
+            self.assertEqual(table_stats, packed_stats, kwargs)
+
+        with self.assertRaises(ValidationError):
+            models.Prompt(text="How do you like {object}?", scale_max=5, tag_storage='packed').clean_fields()
+        packed.tag_storage = 'table'
+        with self.assertRaises(ValidationError):
+            packed.clean_fields()
+
+    def test_prompt_statistics_distribution(self):
+        book1 = Book.objects.get()
+        book2 = Book.objects.create(title="Another book")
+        crime = Category.objects.create(name="crime")
+        travel = Category.objects.create(name="travel")
+        prompt_set = models.PromptSet.objects.create(name='book-distribution')
+        for tag_storage in ('table', 'packed'):
+            tagging_prompt = models.Prompt.create(
+                type=models.Prompt.TYPES.tagging,
+                text="Please mark all categories that you think are related to {object}.",
+                prompt_object_type=Book,
+                response_object_type=Category,
+                scale_min=-1, scale_max=1,
+                tag_storage=tag_storage,
+            )
+            tagging_prompt.create_response(user=self.user, prompt_object=book1, tags=[(crime, 1), (travel, -1)])
+            tagging_prompt.create_response(user=self.user2, prompt_object=book1, tags=[(crime, 1)])
+            tagging_prompt.create_response(user=self.user2, prompt_object=book2, tags=[(travel, 0)])
+            prompt_set.prompts.add(tagging_prompt)
+        likert_prompt = models.Prompt.create(
+            text="How do you like the book {object}?", prompt_object_type=Book, scale_min=1, scale_max=5
+        )
+        likert_prompt.create_response(user=self.user, prompt_object=book1, rating=2)
+        likert_prompt.create_response(user=self.user2, prompt_object=book1, rating=5)
+        likert_prompt.create_response(user=self.user2, prompt_object=book2, rating=4)
+        prompt_set.prompts.add(likert_prompt)
+
+        # The histograms don't need additional queries
+        with CaptureQueriesContext(connection) as queries:
+            stats = prompt_set.get_prompt_statistics()
+        with self.assertNumQueries(len(queries)):
+            distribution_stats = prompt_set.get_prompt_statistics(
+                fields=models.PromptSet.STATISTICS_FIELDS
+            )
+
+        table_stats, packed_stats, likert_stats = distribution_stats
+        self.assertEqual({
+            'histogram': [
+                {'value': -1, 'label': '-1', 'count': 1},
+                {'value': 0, 'label': '0', 'count': 1},
+                {'value': 1, 'label': '1', 'count': 2},
+            ],
+            'median': 0.5,
+            'std': 0.95742710775634,
+            'percentiles': [
+                {'percentile': 25, 'value': -1}, {'percentile': 50, 'value': 0}, {'percentile': 75, 'value': 1},
+            ],
+        }, dict(table_stats['distribution'], std=round(table_stats['distribution']['std'], 14)))
+        book1_stats = [obj for obj in likert_stats['objects'] if obj['object_id'] == book1.pk][0]
+        self.assertEqual([0, 1, 0, 0, 1], [bucket['count'] for bucket in book1_stats['distribution']['histogram']])
+        self.assertEqual(3.5, book1_stats['distribution']['median'])
+        # The sample standard deviation is undefined for a single rating
+        book2_stats = [obj for obj in likert_stats['objects'] if obj['object_id'] == book2.pk][0]
+        self.assertEqual(None, book2_stats['distribution']['std'])
+        self.assertEqual(4, likert_stats['distribution']['median'])
+        crime_stats = [
+            obj for obj in table_stats['objects'] if obj['object_id'] == book1.pk
+        ][0]['response_objects']
+        crime_stats = [obj for obj in crime_stats if obj['response_object_id'] == crime.pk][0]
+        self.assertEqual([0, 0, 2], [bucket['count'] for bucket in crime_stats['distribution']['histogram']])
+        self.assertEqual(0, crime_stats['distribution']['std'])
+
+        # The other values are the same, and packed tags have the same distributions
+        for full, distribution in zip(stats, distribution_stats):
+            self.assertEqual(full['mean_rating'], distribution['mean_rating'])
+            self.assertEqual(full['response_count'], distribution['response_count'])
+        self.assertEqual(table_stats['distribution'], packed_stats['distribution'])
+
+        prompt_stats = prompt_set.get_prompt_statistics(depth='prompt', fields=['distribution'])
+        self.assertEqual(
+            [stats['distribution'] for stats in distribution_stats],
+            [stats['distribution'] for stats in prompt_stats]
+        )
+        self.assertEqual(['distribution', 'prompt_id'], sorted(prompt_stats[0].keys()))
+
+    @override_settings(PROMPT_RESPONSES_PRIOR_WEIGHT=2)
+    def test_prompt_statistics_spread(self):
+        book1 = Book.objects.get()
+        book2 = Book.objects.create(title="Another book")
+        crime = Category.objects.create(name="crime")
+        travel = Category.objects.create(name="travel")
+        prompt_set = models.PromptSet.objects.create(name='book-spread')
+        for tag_storage in ('table', 'packed'):
+            tagging_prompt = models.Prompt.create(
+                type=models.Prompt.TYPES.tagging,
+                text="Please mark all categories that you think are related to {object}.",
+                prompt_object_type=Book,
+                response_object_type=Category,
+                tag_storage=tag_storage,
+            )
+            tagging_prompt.create_response(user=self.user, prompt_object=book1, tags=[(crime, 1), (travel, -1)])
+            tagging_prompt.create_response(user=self.user2, prompt_object=book1, tags=[(crime, 1)])
+            tagging_prompt.create_response(user=self.user2, prompt_object=book2, tags=[(travel, 0)])
+            prompt_set.prompts.add(tagging_prompt)
+        likert_prompt = models.Prompt.create(text="How do you like the book {object}?", prompt_object_type=Book)
+        likert_prompt.create_response(user=self.user, prompt_object=book1, rating=2)
+        likert_prompt.create_response(user=self.user2, prompt_object=book1, rating=5)
+        likert_prompt.create_response(user=self.user2, prompt_object=book2, rating=4)
+        prompt_set.prompts.add(likert_prompt)
+
+        # Spreads don't need additional queries
+        with CaptureQueriesContext(connection) as queries:
+            prompt_set.get_prompt_statistics(fields=['mean_rating'])
+        fields = ['mean_rating', 'variance', 'std_error', 'adjusted_rating']
+        with self.assertNumQueries(len(queries)):
+            table_stats, packed_stats, likert_stats = prompt_set.get_prompt_statistics(fields=fields)
+
+        def get(items, key, pk):
+            return [item for item in items if item[key] == pk][0]
+
+        self.assertAlmostEqual(11 / 12.0, table_stats['variance'])
+        self.assertAlmostEqual((11 / 48.0) ** 0.5, table_stats['std_error'])
+        self.assertEqual(table_stats['mean_rating'], table_stats['adjusted_rating'])
+        book1_stats = get(table_stats['objects'], 'object_id', book1.pk)
+        self.assertEqual(
+            {
+                'response_object_id': crime.pk, 'mean_rating': 1.0, 'variance': 0.0, 'std_error': 0.0,
+                'adjusted_rating': 0.625,
+            },
+            get(book1_stats['response_objects'], 'response_object_id', crime.pk)
+        )
+        book2_stats = get(table_stats['objects'], 'object_id', book2.pk)
+        self.assertEqual(None, book2_stats['variance'])
+        self.assertEqual(None, book2_stats['std_error'])
+        self.assertAlmostEqual(1 / 6.0, book2_stats['adjusted_rating'])
+        self.assertAlmostEqual(table_stats['variance'], packed_stats['variance'])
+
+        book1_stats = get(likert_stats['objects'], 'object_id', book1.pk)
+        self.assertEqual(4.5, book1_stats['variance'])
+        self.assertEqual(1.5, book1_stats['std_error'])
+        self.assertAlmostEqual(43 / 12.0, book1_stats['adjusted_rating'])
+
+        prompt_stats = prompt_set.get_prompt_statistics(depth='prompt', fields=['variance'])
+        self.assertEqual(
+            [
+                {'prompt_id': stats['prompt_id'], 'variance': stats['variance']}
+                for stats in (table_stats, packed_stats, likert_stats)
+            ],
+            prompt_stats
+        )
+
+    def test_top_response_objects(self):
+        book1 = Book.objects.get()
+        book2 = Book.objects.create(title="Another book")
+        crime = Category.objects.create(name="crime")
+        romance = Category.objects.create(name="romance")
+        travel = Category.objects.create(name="travel")
+        user3 = User.objects.create_user(username='carol')
+        prompts = {}
+        for tag_storage in ('table', 'packed'):
+            prompt = prompts[tag_storage] = models.Prompt.create(
+                type=models.Prompt.TYPES.tagging,
+                text="Please mark all categories that you think are related to {object}.",
+                prompt_object_type=Book,
+                response_object_type=Category,
+                tag_storage=tag_storage,
+            )
+            prompt.create_response(user=self.user, prompt_object=book1, tags=[(crime, 1), (romance, 1), (travel, -1)])
+            prompt.create_response(user=self.user2, prompt_object=book1, tags=[(crime, 1)])
+            prompt.create_response(user=self.user2, prompt_object=book2, tags=[(travel, 0)])
+            prompt.create_response(user=user3, prompt_object=book1, tags=[(crime, 0)])
+
+        table = prompts['table']
+        with self.assertNumQueries(2):
+            top = table.get_top_response_objects(book1)
+        self.assertEqual([romance.pk, crime.pk, travel.pk], [row['response_object_id'] for row in top])
+        self.assertEqual(
+            {'response_object_id': romance.pk, 'mean_rating': 1.0, 'tag_count': 1},
+            {key: value for key, value in top[0].items() if key != 'adjusted_rating'}
+        )
+        # Starts with 5 ratings at the prompt's mean of 1/3
+        self.assertAlmostEqual((5 / 3.0 + 1) / 6, top[0]['adjusted_rating'])
+
+        # Adjusted ratings rank the response object with more tags higher
+        top = table.get_top_response_objects(book1, rank_by='adjusted_rating')
+        self.assertEqual([crime.pk, romance.pk, travel.pk], [row['response_object_id'] for row in top])
+        self.assertEqual(
+            [crime.pk],
+            [row['response_object_id'] for row in table.get_top_response_objects(book1, min_count=2)]
+        )
+        self.assertEqual(1, len(table.get_top_response_objects(book1, k=1)))
+        self.assertEqual([], table.get_top_response_objects(Book.objects.create(title="Untagged")))
+
+        def summarize(top):
+            return [(row['response_object_id'], row['tag_count'], round(row['adjusted_rating'], 10)) for row in top]
+
+        for kwargs in ({}, {'rank_by': 'adjusted_rating'}, {'min_count': 2}, {'k': 2}):
+            table_top = table.get_top_response_objects(book1, **kwargs)
+            packed_top = prompts['packed'].get_top_response_objects(book1, **kwargs)
+            self.assertEqual(summarize(table_top), summarize(packed_top))
+
+        with self.assertRaises(ValueError):
+            table.get_top_response_objects(book1, rank_by='tag_count')
+
+    def test_timeseries(self):
+        book = Book.objects.get()
+        crime = Category.objects.create(name="crime")
+        likert_prompt = models.Prompt.create(text="How do you like the book {object}?", prompt_object_type=Book)
+        tagging_prompt = models.Prompt.create(
+            type=models.Prompt.TYPES.tagging,
+            text="Please mark all categories that you think are related to {object}.",
+            prompt_object_type=Book,
+            response_object_type=Category
+        )
+        prompt_set = models.PromptSet.objects.create(name='book-rating')
+        prompt_set.prompts.add(likert_prompt, tagging_prompt)
+        day1 = datetime(2018, 1, 1, tzinfo=timezone.utc)
+        day2 = datetime(2018, 1, 2, tzinfo=timezone.utc)
+        for created, rating in ((day1 + timedelta(hours=10, minutes=30), 1),
+                                (day1 + timedelta(hours=11, minutes=15), 3),
+                                (day2 + timedelta(hours=9), 5)):
+            likert_prompt.create_response(user=self.user, prompt_object=book, rating=rating, created=created)
+        tagging_prompt.create_response(user=self.user, prompt_object=book, tags=[(crime, 1)], created=day2)
+        tagging_prompt.create_response(user=self.user2, prompt_object=book, tags=[(crime, 0)], created=day2)
+
+        self.assertEqual([
+            {'bucket': day1, 'response_count': 2, 'mean_rating': 2.0, 'rating_variance': 2.0,
+             'tag_count': 0, 'mean_tag_rating': None, 'tag_rating_variance': None},
+            {'bucket': day2, 'response_count': 1, 'mean_rating': 5.0, 'rating_variance': None,
+             'tag_count': 0, 'mean_tag_rating': None, 'tag_rating_variance': None},
+        ], likert_prompt.get_timeseries())
+        self.assertEqual(
+            [day1 + timedelta(hours=10), day1 + timedelta(hours=11), day2 + timedelta(hours=9)],
+            [bucket['bucket'] for bucket in likert_prompt.get_timeseries(granularity='hour')]
+        )
+        # The start selects its whole bucket, the end is exclusive
+        self.assertEqual(
+            [day1 + timedelta(hours=11)],
+            [bucket['bucket'] for bucket in likert_prompt.get_timeseries(
+                start=day1 + timedelta(hours=11, minutes=30), end=day2, granularity='hour'
+            )]
+        )
+        with self.assertRaises(ValueError):
+            likert_prompt.get_timeseries(granularity='week')
+
+        with self.assertNumQueries(2):
+            likert_series, tagging_series = prompt_set.get_timeseries(start=day2)
+        self.assertEqual(likert_prompt.pk, likert_series['prompt_id'])
+        self.assertEqual(1, len(likert_series['series']))
+        self.assertEqual(
+            [{'bucket': day2, 'response_count': 2, 'mean_rating': None, 'rating_variance': None,
+              'tag_count': 2, 'mean_tag_rating': 0.5, 'tag_rating_variance': 0.5}],
+            tagging_series['series']
+        )
+
+        # Rebuilding from the stored responses gives the same rollups
+        before = prompt_set.get_timeseries(granularity='hour')
+        models.ResponseRollup.objects.all().delete()
+        call_command('rebuild_rollups', prompts=[likert_prompt.pk, tagging_prompt.pk], stdout=StringIO())
+        self.assertEqual(before, prompt_set.get_timeseries(granularity='hour'))
+
     def test_promptset_ordering(self):
         prompt_set = models.PromptSet.objects.create(name='book-rating')
         prompt1 = models.Prompt.objects.create(
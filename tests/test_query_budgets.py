@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-prompt-responses
+------------
+
+Query budgets of the public model methods, API actions, and views.
+
+The budgets must hold for every data size, so an accidental N+1 query fails these tests
+and lists the executed SQL.
+"""
+
+from django.test import TestCase
+from django.contrib.contenttypes.models import ContentType
+from rest_framework.test import APIClient
+
+from benchmarks.data import generate
+from prompt_responses import models
+from .models import Book, Category
+from .utils import QueryBudgetMixin
+
+
+class QueryBudgets(QueryBudgetMixin):
+    counts = None
+
+    @classmethod
+    def setUpTestData(cls):
+        data = generate(seed=1, **cls.counts)
+        cls.promptset = data['promptset']
+        cls.likert, cls.tagging = data['prompts'][:2]
+        cls.user = data['user']
+
+    def setUp(self):
+        self.book = Book.objects.first()
+        self.categories = list(Category.objects.all()[:3])
+        self.api = APIClient()
+        self.api.force_authenticate(user=self.user)
+
+    def test_get_instance(self):
+        with self.assertMaxQueries(2):
+            self.likert.get_instance()
+        # Count and select the object, count and select three response objects
+        with self.assertMaxQueries(6):
+            self.tagging.get_instance()
+
+    def test_create_response(self):
+        # Including four queries to create the rollup buckets of the current hour and day
+        with self.assertMaxQueries(10):
+            self.likert.create_response(user=self.user, prompt_object=self.book, rating=1)
+        # Including one query for the user's archived tags of the new tags
+        with self.assertMaxQueries(13):
+            self.tagging.create_response(user=self.user, prompt_object=self.book, tags=[
+                (category, 1) for category in self.categories
+            ])
+        # Updating the same tags, and the rollups with one query
+        with self.assertMaxQueries(9):
+            self.tagging.create_response(user=self.user, prompt_object=self.book, tags=[
+                (category, 0) for category in self.categories
+            ])
+
+    def test_prompt_statistics(self):
+        for depth in models.PromptSet.STATISTICS_DEPTHS:
+            with self.assertMaxQueries(6, msg=depth):
+                self.promptset.get_prompt_statistics(depth=depth)
+        with self.assertMaxQueries(1):
+            self.tagging.get_mean_tag_rating_matrix()
+
+    def test_api_statistics(self):
+        with self.assertMaxQueries(13):
+            response = self.api.get('/api/prompt-sets/%s/statistics/' % self.promptset.name)
+        self.assertEqual(200, response.status_code)
+
+    def test_api_instantiate(self):
+        with self.assertMaxQueries(9):
+            response = self.api.get('/api/prompts/%d/instantiate/' % self.tagging.pk)
+        self.assertEqual(200, response.status_code)
+
+    def test_api_instantiate_from_set(self):
+        with self.assertMaxQueries(12):
+            response = self.api.get('/api/prompts/%d/instantiate/%s/' % (self.likert.pk, self.promptset.name))
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.data['next_prompt_instance'])
+
+    def test_api_create_response(self):
+        with self.assertMaxQueries(19):
+            response = self.api.post('/api/prompts/%d/create-response/' % self.tagging.pk, {
+                'object_id': self.book.pk,
+                'tags': [{'object_id': category.pk, 'rating': 1} for category in self.categories],
+            }, format='json')
+        self.assertEqual(201, response.status_code)
+
+    def test_create_response_view(self):
+        self.client.force_login(self.user)
+        url = '/prompt/%d/' % self.tagging.pk
+        with self.assertMaxQueries(9):
+            response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+
+        data = {
+            'prompt': self.tagging.pk,
+            'content_type': ContentType.objects.get_for_model(Book).pk,
+            'object_id': self.book.pk,
+            'tags-TOTAL_FORMS': len(self.categories),
+            'tags-INITIAL_FORMS': 0,
+        }
+        for idx, category in enumerate(self.categories):
+            data['tags-%d-content_type' % idx] = ContentType.objects.get_for_model(Category).pk
+            data['tags-%d-object_id' % idx] = category.pk
+            data['tags-%d-rating' % idx] = 0
+        # Including one query to replace the user's archived tags
+        with self.assertMaxQueries(24):
+            response = self.client.post(url, data)
+        self.assertEqual(302, response.status_code)
+
+
+class TestQueryBudgetsSmall(QueryBudgets, TestCase):
+    counts = dict(users=2, books=2, categories=3, prompts=2, responses=1, tags_per_response=1)
+
+
+class TestQueryBudgetsMedium(QueryBudgets, TestCase):
+    counts = dict(users=10, books=10, categories=10, prompts=4, responses=50, tags_per_response=3)
+
+
+class TestQueryBudgetsLarge(QueryBudgets, TestCase):
+    counts = dict(users=50, books=50, categories=30, prompts=6, responses=300, tags_per_response=10)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-prompt-responses
+------------
+
+Tests for `django-prompt-responses` routers module.
+"""
+
+from django.db import connections
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+
+from prompt_responses import models
+from prompt_responses.instrumentation import stage_finished
+from prompt_responses.routers import analytics_database
+from .models import Book, Category
+
+
+@override_settings(PROMPT_RESPONSES_ANALYTICS_DATABASE='replica')
+class TestAnalyticsRouter(TestCase):
+    databases = {'default', 'replica'}
+    # Django < 2.2
+    multi_db = True
+
+    def create_data(self, using):
+        "Create the same prompts on a database and return the response count"
+        user = User.objects.db_manager(using).create_user(username='alice')
+        book = Book.objects.using(using).create(title="Two Scoops of Django")
+        category = Category.objects.using(using).create(name="crime")
+        likert = models.Prompt(type=models.Prompt.TYPES.likert, text="How do you like {object}?", scale_max=5)
+        likert.prompt_object_type = models.ContentType.objects.db_manager(using).get_for_model(Book)
+        likert.save(using=using)
+        tagging = models.Prompt(type=models.Prompt.TYPES.tagging, text="Rate categories for {object}")
+        tagging.prompt_object_type = likert.prompt_object_type
+        tagging.response_object_type = models.ContentType.objects.db_manager(using).get_for_model(Category)
+        tagging.save(using=using)
+        promptset = models.PromptSet.objects.using(using).create(name='set')
+        promptset.prompts.add(likert, tagging)
+        return user, book, category, likert, tagging, promptset
+
+    def setUp(self):
+        self.user, self.book, self.category, self.likert, self.tagging, self.promptset = self.create_data('default')
+        self.replica = self.create_data('replica')
+
+    def test_analytics_read_replica(self):
+        self.likert.create_response(user=self.user, prompt_object=self.book, rating=4)
+        self.tagging.create_response(user=self.user, prompt_object=self.book, tags=[(self.category, 1)])
+        # Writes and their reads go to the default database
+        self.assertEqual(2, models.Response.objects.using('default').count())
+        self.assertEqual(0, models.Response.objects.using('replica').count())
+        self.assertEqual(1, models.Tag.objects.using('default').count())
+
+        # Analytics read from the replica, which hasn't received the responses
+        self.assertEqual(0, self.likert.get_response_count())
+        self.assertIsNone(self.likert.get_mean_rating())
+        self.assertEqual({}, self.tagging.get_mean_tag_rating_matrix())
+        self.assertEqual([], list(self.tagging.get_mean_tag_ratings(self.book)))
+        self.assertIsNone(self.tagging.get_mean_tag_rating(self.book, self.category))
+        statistics = self.promptset.get_prompt_statistics()
+        self.assertEqual([0, 0], [prompt['response_count'] for prompt in statistics])
+
+        # Replicate
+        user, book, category, likert, tagging, promptset = self.replica
+        likert.create_response(user=user, prompt_object=book, rating=4)
+        self.assertEqual(1, self.likert.get_response_count())
+        self.assertEqual(4, self.likert.get_mean_rating())
+
+    def test_stage_counts_replica_queries(self):
+        stages = []
+
+        def receiver(sender, stage, queries, **kwargs):
+            stages.append((stage, queries))
+        stage_finished.connect(receiver)
+        try:
+            with CaptureQueriesContext(connections['replica']) as context:
+                self.promptset.get_prompt_statistics()
+        finally:
+            stage_finished.disconnect(receiver)
+        self.assertTrue(context.captured_queries)
+        self.assertIn(('get_prompt_statistics', len(context.captured_queries)), stages)
+
+    def test_other_queries_use_default(self):
+        self.assertEqual(1, models.Prompt.objects.filter(pk=self.likert.pk).count())
+        models.Prompt.objects.using('replica').all().delete()
+        self.assertEqual(1, models.Prompt.objects.filter(pk=self.likert.pk).count())
+        with analytics_database():
+            self.assertEqual(0, models.Prompt.objects.filter(pk=self.likert.pk).count())
+
+    def test_response_list_api(self):
+        self.likert.create_response(user=self.user, prompt_object=self.book, rating=4)
+        api = APIClient()
+        api.force_authenticate(user=self.user)
+        response = api.get('/api/responses/')
+        self.assertEqual([], response.data['results'])
+
+    @override_settings(PROMPT_RESPONSES_ANALYTICS_DATABASE=None)
+    def test_without_replica(self):
+        self.likert.create_response(user=self.user, prompt_object=self.book, rating=4)
+        self.assertEqual(1, self.likert.get_response_count())
+        self.assertEqual(4, self.likert.get_mean_rating())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-prompt-responses
+------------
+
+Tests for `django-prompt-responses` similarity module.
+"""
+from unittest import skipIf
+
+from django.test import TestCase
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from benchmarks.data import generate
+from prompt_responses import models, similarity
+
+
+def brute_force(prompt, metric):
+    "Dense similarities of all pairs of response objects, for comparison"
+    np = similarity.require_numpy()
+    ratings = {}
+    for tag in models.Tag.objects.filter(response__prompt=prompt).select_related('response'):
+        ratings.setdefault((tag.object_id, tag.response.object_id), []).append(tag.rating)
+    object_ids = sorted(set(key[0] for key in ratings))
+    prompt_object_ids = sorted(set(key[1] for key in ratings))
+    matrix = np.zeros((len(object_ids), len(prompt_object_ids)))
+    rated = np.zeros(matrix.shape, dtype=bool)
+    for (object_id, prompt_object_id), values in ratings.items():
+        row, column = object_ids.index(object_id), prompt_object_ids.index(prompt_object_id)
+        matrix[row, column] = float(sum(values)) / len(values)
+        rated[row, column] = True
+    if metric == 'pearson':
+        means = matrix.sum(axis=1) / rated.sum(axis=1)
+        matrix = np.where(rated, matrix - means[:, None], 0)
+    norms = np.sqrt((matrix ** 2).sum(axis=1))
+    matrix = matrix / np.where(norms > 0, norms, 1)[:, None]
+    return object_ids, np.dot(matrix, matrix.T), np.dot(rated.astype(int), rated.T.astype(int))
+
+
+@skipIf(numpy is None, 'Similarities require NumPy')
+class TestSimilarity(TestCase):
+
+    def setUp(self):
+        data = generate(users=5, books=6, categories=8, prompts=2, responses=40, tags_per_response=3, seed=5)
+        self.likert, self.prompt = data['prompts']
+
+    def test_similar_response_objects(self):
+        for metric in similarity.METRICS:
+            object_ids, expected, common = brute_force(self.prompt, metric)
+            with self.assertNumQueries(1):
+                result = self.prompt.get_similar_response_objects(k=len(object_ids), metric=metric)
+            self.assertEqual(object_ids, [row['response_object_id'] for row in result])
+            for row, item in enumerate(result):
+                neighbors = [
+                    (column, expected[row, column]) for column in range(len(object_ids))
+                    if column != row and common[row, column]
+                ]
+                self.assertEqual(len(neighbors), len(item['neighbors']))
+                for neighbor in item['neighbors']:
+                    column = object_ids.index(neighbor['response_object_id'])
+                    self.assertAlmostEqual(expected[row, column], neighbor['similarity'])
+                    self.assertEqual(common[row, column], neighbor['common_count'])
+                similarities = [neighbor['similarity'] for neighbor in item['neighbors']]
+                self.assertEqual(sorted(similarities, reverse=True), similarities)
+
+    def test_top_k_and_chunks(self):
+        result = self.prompt.get_similar_response_objects(k=2, metric='pearson')
+        self.assertTrue(all(len(row['neighbors']) <= 2 for row in result))
+        full = self.prompt.get_similar_response_objects(k=100, metric='pearson')
+        for row, full_row in zip(result, full):
+            top = [neighbor['similarity'] for neighbor in full_row['neighbors'][:2]]
+            self.assertEqual(top, [neighbor['similarity'] for neighbor in row['neighbors']])
+
+        # Chunks don't change the results
+        self.assertEqual(full, self.prompt.get_similar_response_objects(k=100, metric='pearson', chunk_size=3))
+        with self.settings(PROMPT_RESPONSES_SIMILARITY_CHUNK_SIZE=1):
+            self.assertEqual(full, self.prompt.get_similar_response_objects(k=100, metric='pearson'))
+
+        object_ids = [full[2]['response_object_id'], full[0]['response_object_id'], 0]
+        self.assertEqual(
+            [full[0], full[2]],
+            self.prompt.get_similar_response_objects(k=100, metric='pearson', response_object_ids=object_ids)
+        )
+
+        result = self.prompt.get_similar_response_objects(k=100, min_common=3)
+        self.assertTrue(all(
+            neighbor['common_count'] >= 3 for row in result for neighbor in row['neighbors']
+        ))
+
+    def test_packed_tags(self):
+        # Copy the tags to prompts with both storages, as create_response() replaces a user's earlier tags
+        copies = [
+            models.Prompt.objects.create(
+                type=models.Prompt.TYPES.tagging, text=self.prompt.text, scale_min=-1, scale_max=1,
+                prompt_object_type=self.prompt.prompt_object_type,
+                response_object_type=self.prompt.response_object_type, tag_storage=tag_storage,
+            )
+            for tag_storage in ('table', 'packed')
+        ]
+        for response in self.prompt.responses.order_by('id').prefetch_related('tags'):
+            for prompt in copies:
+                prompt.create_response(user=response.user, prompt_object=response.prompt_object, tags=[
+                    (tag.object_id, tag.rating) for tag in response.tags.all()
+                ])
+        table, packed = copies
+        result = table.get_similar_response_objects(k=3)
+        self.assertTrue(any(row['neighbors'] for row in result))
+        self.assertEqual(result, packed.get_similar_response_objects(k=3))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            self.likert.get_similar_response_objects()
+        with self.assertRaises(ValueError):
+            self.prompt.get_similar_response_objects(metric='jaccard')
+        with self.assertRaises(ValueError):
+            self.prompt.get_similar_response_objects(k=0)
+        empty = models.Prompt.objects.create(
+            type=models.Prompt.TYPES.tagging, text=self.prompt.text,
+            prompt_object_type=self.prompt.prompt_object_type, response_object_type=self.prompt.response_object_type,
+        )
+        self.assertEqual([], empty.get_similar_response_objects())
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_django-prompt-responses
+------------
+
+Tests for `django-prompt-responses` views module.
+"""
+
+from django.test import TestCase, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.contrib.auth.models import User
+from django.utils import timezone
+from django.contrib.messages.storage.cookie import CookieStorage
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+try:
+    from django.urls import resolve
+except ImportError:
+    from django.core.urlresolvers import resolve
+
+from prompt_responses import models
+from prompt_responses.views import BaseCreateResponseView
+from .models import Book, Category
+
+
+class CreateResponseView(BaseCreateResponseView):
+    def get_user(self):
+        return self.request.user
+
+
+class TestCreateResponseView(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice')
+        self.factory = RequestFactory()
+        self.book = Book.objects.create(title="Two Scoops of Django")
+        self.categories = [Category.objects.create(name="category %d" % idx) for idx in range(10)]
+        self.prompt = models.Prompt.create(
+            type=models.Prompt.TYPES.tagging,
+            text="Please rate the relevancy of the following categories for {object}.",
+            prompt_object_type=Book,
+            response_object_type=Category,
+            scale_max=5,
+        )
+
+    def request(self, method, data=None):
+        path = '/prompt/%d/' % self.prompt.pk
+        request = getattr(self.factory, method)(path, data or {})
+        request.user = self.user
+        request.resolver_match = resolve(path)
+        request._messages = CookieStorage(request)
+        view = CreateResponseView.as_view()
+        with CaptureQueriesContext(connection) as context:
+            response = view(request, pk=self.prompt.pk)
+            if hasattr(response, 'render'):
+                response.render()
+        return response, context.captured_queries
+
+    def test_get_tagging_prompt(self):
+        with mock.patch.object(models.Prompt, 'get_response_objects', return_value=self.categories):
+            response, queries = self.request('get')
+        self.assertEqual(200, response.status_code)
+        content = response.content.decode('utf8')
+        for category in self.categories:
+            self.assertIn(category.name, content)
+        # prompt, prompt object (count + select), no queries for the response objects
+        self.assertEqual(3, len(queries))
+
+    def test_post_invalid_tags(self):
+        data = {
+            'prompt': self.prompt.pk,
+            'content_type': models.ContentType.objects.get_for_model(Book).pk,
+            'object_id': self.book.pk,
+            'tags-TOTAL_FORMS': 1,
+            'tags-INITIAL_FORMS': 0,
+            'tags-0-content_type': models.ContentType.objects.get_for_model(Category).pk,
+            'tags-0-object_id': self.categories[0].pk,
+            'tags-0-rating': 100,
+        }
+        response, queries = self.request('post', data)
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.context_data['formset'].errors[0])
+        self.assertEqual(0, models.Response.objects.count())
+
+    def post_tags(self, categories):
+        data = {
+            'prompt': self.prompt.pk,
+            'content_type': models.ContentType.objects.get_for_model(Book).pk,
+            'object_id': self.book.pk,
+            'tags-TOTAL_FORMS': len(categories),
+            'tags-INITIAL_FORMS': 0,
+        }
+        content_type = models.ContentType.objects.get_for_model(Category).pk
+        for idx, category in enumerate(categories):
+            data['tags-%d-content_type' % idx] = content_type
+            data['tags-%d-object_id' % idx] = category.pk
+            # See BaseCreateResponseView.custom_scale
+            data['tags-%d-rating' % idx] = idx % 2 - 1
+        return self.request('post', data)
+
+    def test_post_tagging_response(self):
+        # Create the rollup buckets first, so that all responses only update them
+        models.ResponseRollup.add(self.prompt.pk, timezone.now(), response_count=0)
+        response, few_queries = self.post_tags(self.categories[:2])
+        self.assertEqual(302, response.status_code)
+
+        response, queries = self.post_tags(self.categories)
+        self.assertEqual(302, response.status_code)
+        response = models.Response.objects.last()
+        self.assertEqual(10, response.tags.count())
+        self.assertEqual(self.user, response.user)
+        self.assertEqual([-1, 0] * 5, list(response.tags.order_by('id').values_list('rating', flat=True)))
+
+        # The number of queries doesn't depend on the number of tags
+        self.assertEqual(len(few_queries), len(queries))
+        tags_inserted = [query for query in queries if query['sql'].startswith('INSERT INTO "prompt_responses_tag"')]
+        self.assertEqual(1, len(tags_inserted))
+
+    def test_post_packed_tags(self):
+        self.prompt.tag_storage = models.Prompt.TAG_STORAGES.packed
+        self.prompt.save()
+        response, queries = self.post_tags(self.categories[:4])
+        self.assertEqual(302, response.status_code)
+        response, queries = self.post_tags(self.categories[2:])
+        self.assertEqual(302, response.status_code)
+        self.assertEqual(0, models.Tag.objects.count())
+
+        first, last = models.Response.objects.order_by('id')
+        self.assertEqual(
+            [(category.pk, idx % 2 - 1) for idx, category in enumerate(self.categories[2:])],
+            [(tag.object_id, tag.rating) for tag in last.tag_list]
+        )
+        # The tags of the second response replace the earlier tags of the same categories
+        self.assertEqual([self.categories[0].pk, self.categories[1].pk], [tag.object_id for tag in first.tag_list])
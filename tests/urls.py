@@ -1,12 +1,15 @@
 from django.conf.urls import url, include
+from django.contrib import admin
 from rest_framework import routers
 from prompt_responses.viewsets import *
 
 router = routers.DefaultRouter()
 router.register(r'prompts', PromptViewSet)
 router.register(r'prompt-sets', PromptSetViewSet)
+router.register(r'responses', ResponseViewSet)
 
 urlpatterns = [
+    url(r'^admin/', admin.site.urls),
     url(r'^api/', include(router.urls)),
     url(r'', include('prompt_responses.urls', namespace='prompt_responses')),
 ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers for the test suite.
+"""
+from contextlib import contextmanager
+
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin(object):
+    """
+    TestCase mixin to pin the maximum number of queries of a block of code.
+
+        with self.assertMaxQueries(3):
+            prompt.get_instance()
+
+    Unlike assertNumQueries, this allows for fewer queries, and the
+    failure message lists every executed query so the offending SQL is visible.
+    """
+
+    @contextmanager
+    def assertMaxQueries(self, num, using=DEFAULT_DB_ALIAS, msg=None):
+        with CaptureQueriesContext(connections[using]) as context:
+            yield context
+        executed = len(context)
+        if executed > num:
+            queries = '\n'.join(
+                '%d. %s' % (idx, query['sql']) for idx, query in enumerate(context.captured_queries, start=1)
+            )
+            self.fail('%s%d queries executed, at most %d expected\nCaptured queries were:\n%s' % (
+                '%s: ' % msg if msg else '', executed, num, queries
+            ))